@@ -1,9 +1,12 @@
 # BathyConfig
 # A static text file that holds various configuration values that the rest of the program references
 
-# If set to True, the script will use threading. Fair warning, this opens up an immense amount of complexity
+# If set to True, the script will process files in parallel. Fair warning, this opens up an immense amount of complexity
 USE_THREADING = False
 
+# If set to True, parallel work runs in a pool of worker processes, which sidesteps the GIL for CPU-bound stages. Otherwise it runs in a pool of threads
+USE_PROCESSES = True
+
 # If set to True, the script will describe it's actions step by step. Useful for debugging
 CONDITIONAL_OUTPUT_ALLOWED = True
 
@@ -13,32 +16,143 @@ INPUT_ROOT_FOLDER = "C:\\Bathy\\ProcessBathymetricData\\Input"
 # The root folder where all script outputs will be held (in appropriate subdirectories)
 OUTPUT_ROOT_FOLDER = "C:\\Bathy\\ProcessBathymetricData\\Output"
 
+# The SQLite database which records which files have been through which processing stages
+MANIFEST_PATH = OUTPUT_ROOT_FOLDER + "\\ProcessingManifest.sqlite"
+
+# The JSON-lines file which the measurements of every stage's work on every file are appended to. If set to None, they are only totalled in memory,
+# and reported at the end of the run
+METRICS_PATH = OUTPUT_ROOT_FOLDER + "\\Metrics.jsonl"
+
+# The names of the stages whose work is run under cProfile. Each file's profile is saved to PROFILE_DIRECTORY, to be read with pstats
+PROFILE_STAGES = []
+
+# Where the profiles of the stages in PROFILE_STAGES are saved
+PROFILE_DIRECTORY = OUTPUT_ROOT_FOLDER + "\\Profiles"
+
+# The least time, in seconds, between the checkpoints saved by stages which stream their input. If a stage is interrupted, it carries on from
+# its last checkpoint next time, so at most this much of its work is lost. Each checkpoint pushes the output to disk. Set to None for no checkpoints
+CHECKPOINT_INTERVAL = 30
+
+# If set to True, the progress of every stage (files done, points per second, and time left) is shown on a single console line as the pipeline runs
+SHOW_PROGRESS = True
+
+# The number of times a second the progress line is redrawn
+PROGRESS_REFRESH_RATE = 4
+
+# If set to True, the contents of every directory searched for files are remembered, and directories which haven't changed since are not listed again
+USE_FILE_INDEX = True
+
+# The SQLite database which remembers the contents of searched directories
+FILE_INDEX_PATH = OUTPUT_ROOT_FOLDER + "\\FileIndex.sqlite"
+
+# The number of directories listed at once when searching for files. High values help most on network drives
+FILE_SCAN_THREADS = 16
+
 # The file format which the script will look for in the raw data folder. At the moment, the script cannot handle any format except '.xyz'
 INPUT_FILE_FORMAT = ".csv"
 
-# The maximum number of parallel threads allowed to run simultaneously
+# The number of bytes read from a raw input file at a time when streaming it. Bounds the memory used to process a single file, regardless of the file's size
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+# The size of the buffer used when writing processed files to disk. Expressed in bytes
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# The maximum number of parallel threads (or processes) allowed to run simultaneously
 MAX_ALLOWED_THREADS = 6
 
+# The number of files each pipeline stage may process at once, by stage name. Stages not listed here may process MAX_ALLOWED_THREADS files at once.
+# Only applies if USE_THREADING is True. Otherwise every stage processes one file at a time
+PIPELINE_STAGE_WORKERS = { "Headers": 2, "ZScores": 2, "Shapefiles": 2, "Projection": 2, "Grid": 2 }
+
+# The maximum number of files allowed to wait in the queue in front of each pipeline stage. When a queue is full, the stage before it waits
+PIPELINE_QUEUE_SIZE = 4
+
+# If set to True, every processed file is binned into a grid of depth statistics as the last stage of processing, and the grids are merged into
+# a single surface for the whole survey
+GRID_SURFACE = True
+
+# The width of the grid cells points are binned into. Expressed in the units of the projected coordinate system.
+# Each file's grid covers the bounding box of its points, so small cells over widely spread files make large grids
+GRID_CELL_SIZE = 100.0
+
+# The order SplitFCByNumFeat splits points in: "OID" for runs of consecutive records, or "MORTON" or "HILBERT" for spatially compact tiles
+SPLIT_MODE = "OID"
+
 # The maximum size a subdirectory is allowed to reach before a new subdirectory is created. Expressed in bytes
-MAX_FOLDER_SIZE = 900000
+MAX_FOLDER_SIZE = 900 * 1024 * 1024
+
+# The maximum number of files a subdirectory is allowed to hold before a new subdirectory is created. If set to None, there is no limit
+MAX_FOLDER_FILES = None
+
+# The coordinate system shapefiles are projected into (NAD 1983 Alaska Albers), as well-known text
+PROJECTION_WKT = "PROJCS['NAD_1983_Alaska_Albers',GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Albers'],PARAMETER['False_Easting',0.0],PARAMETER['False_Northing',0.0],PARAMETER['Central_Meridian',-154.0],PARAMETER['Standard_Parallel_1',55.0],PARAMETER['Standard_Parallel_2',65.0],PARAMETER['Latitude_Of_Origin',50.0],UNIT['Meter',1.0]]"
+
+# The format files are handed between the numeric stages in. ".bpt" is PointTile's columnar binary format, which downstream stages memory-map
+# without parsing. Any other value keeps the XYZ text format of the input
+INTERMEDIATE_FORMAT = ".bpt"
+
+# If set to True, shapefiles are written directly from NumPy arrays by the Shapefile module, rather than by arcpy.ASCII3DToFeatureClass_3d.
+# Doesn't need a 3D Analyst license
+USE_NATIVE_SHAPEFILE_WRITER = True
 
-# If the main thread attempts to create a thread, and fails because there are too many threads, it will wait this long before reattempting to create the thread.
-# A longer wait time will reduce the main thread load on the processor during heavy use, thus marginally decreasing latency, but may also decrease throughput.
-# Expressed in seconds
-WAIT_TIME_AFTER_THREAD_CREATION_FAILURE = 1
+# If set to True, PointTiles are sorted along the Morton curve and given a block index as they are written, so that bounding box and depth
+# queries only read the parts of the tile they need
+INDEX_TILES = True
 
-# When the main thread is waiting for the threads of a processing step to finish, it will check in at intervals >= this value
-# Expressed in seconds
-MAIN_THREAD_SLEEP_TIME_WHILE_PROCESSING = 1
+# The number of consecutive points covered by each entry of a PointTile's block index
+TILE_INDEX_BLOCK_SIZE = 4096
+
+# If set to True, XYZ files are projected into PROJECTION_WKT by the native NumPy projection engine as their headers are added, rather than by
+# arcpy after they have been made into shapefiles. Assumes x is longitude and y is latitude, in degrees
+USE_NATIVE_PROJECTION = False
+
+# The maximum total size of the cached intermediate outputs under OUTPUT_ROOT_FOLDER. When exceeded, the least recently used are deleted.
+# Expressed in bytes. If set to None, nothing is ever evicted
+RESULT_CACHE_MAX_BYTES = 200 * 1024 * 1024 * 1024
+
+# The stages whose outputs may be evicted from the result cache. Outputs of stages not listed here are final products, and are never deleted
+RESULT_CACHE_EVICTABLE_STAGES = [ "Headers", "ZScores", "Shapefiles" ]
 
 # Column name for the Z_SCORE field when it's created in a shapefile
 Z_SCORE_COLUMN_NAME = "Z-Score"
 
 Z_FIELD_COLUMN_NAME = "z"
 
+# If set to True, points whose z-scores are outside Z_SCORE_MAX_MIN are removed from the XYZ files before they are processed into shapefiles.
+# With the default limit this removes about 5% of the points of a normally distributed survey, so it is off unless asked for
+REMOVE_EXTREME_Z_SCORES = False
+
+# If set to True, z-scores are calculated against the statistics of every file in the survey together, rather than those of each file on its own
+Z_SCORE_SURVEY_WIDE = False
+
+# Files larger than this are filtered in two streaming passes, rather than being loaded into memory. Expressed in bytes
+MAX_IN_MEMORY_FILE_SIZE = 1024 * 1024 * 1024
+
+# The precision points are held in by the stages which load a whole file into memory (z-score filtering and outlier analysis).
+# "float64" holds them as they are, at 24 bytes a point. "float32" holds x and y as float32 offsets from a nearby origin, and "quantized" as
+# int32 multiples of POINT_QUANTUM; both hold z as float32, at 12 bytes a point. See Precision for the errors each introduces
+POINT_PRECISION = "float64"
+
+# The step x and y are rounded to when POINT_PRECISION is "quantized". Expressed in the units of the data's coordinate system
+POINT_QUANTUM = 0.001
+
 # The maxiumum absolute value a z score is allowed to have when processing a raw file
 Z_SCORE_MAX_MIN = 1.98
 
+# If set to True, the projected shapefiles go through the outlier analysis, and the points whose Gi_Bin is below MIN_BIN_SCORE are removed.
+# This throws away a large share of the points of most surveys, so it is off unless asked for
+REMOVE_OUTLIERS = False
+
+# The radius within which points are considered neighbors by the outlier analysis. Expressed in the units of the data's coordinate system
+OUTLIER_NEIGHBOR_RADIUS = 50.0
+
+# The width of the square tiles the outlier analysis is split into. Each tile also carries a halo of neighboring points one radius wide.
+# Must be larger than OUTLIER_NEIGHBOR_RADIUS. If set to None, each file is analyzed whole
+OUTLIER_TILE_SIZE = 5000.0
+
+# The minimum Gi_Bin score (-3 to 3) a point must have to be kept by the outlier analysis
+MIN_BIN_SCORE = 0
+
 # Only prints if the script has been told it is allowed. Can be set in BathyConfig
 def ConditionalPrint( message, variables=None ):
 	if CONDITIONAL_OUTPUT_ALLOWED == True:
@@ -7,23 +7,62 @@ import os
 import sys
 import time
 import re
-import arcpy
-import sys
+import io
+import numpy as np
+import BathyConfig
+import OSToolbox
+import XYZParser
+import Projection
+import PointIO
+import PointTile
+import Splitter
+import FileIndex
+import Progress
+
+# arcpy is only imported when one of the functions which need it is first called, so that importing this module loads neither ArcGIS nor a license
+arcpy = OSToolbox.LazyImport( "arcpy" )
 
-# This function requests all necessary licenses from ArcGIS
+# This function requests all necessary licenses from ArcGIS. 3D Analyst is only needed to make shapefiles when the native writer is off
 def GetNecessaryLicenses():
-	arcpy.CheckOutExtension("3D")
+	if BathyConfig.USE_NATIVE_SHAPEFILE_WRITER == False:
+		arcpy.CheckOutExtension("3D")
 
 
-# Originally authored by Jeff Hartley
-# Edited for use in this toolbox by Tristan Sebens
 # Method that splits the input feature class into multiple smaller feature classes, each made up of the specified number of features.
 # If the cleanup flad is set to >0, then the input file will be deleted after being split.
 # The new, smaller files will be saved into the same directory as the old, large, input file.
+# Point shapefiles and PointTiles are split natively, in a single pass over the source. Anything else is split by arcpy selections
 # @param fcName = The feature class to be split
 # @param featCount = The max number of features each of the smaller feature classes will contain.
 # @param cleanup = A flag for whether or not to delete the old, large file after the splitting is complete. Considered raised if > 0
-def SplitFCByNumFeat( fcName, featCount, cleanup=False ):
+# @param MODE = The order features are split in: "OID", "MORTON" or "HILBERT". Defaults to the value specified in BathyConfig.
+#               Only native splits can be spatial. arcpy splits are always by OID
+# @return = The paths of the new feature classes
+def SplitFCByNumFeat( fcName, featCount, cleanup=False, MODE=None ):
+    Pieces = Splitter.SplitFile( fcName, featCount, MODE )
+    if Pieces == None:
+        Pieces = SplitFCByNumFeatWithSelections( fcName, featCount )
+
+    # Delete old files
+    if cleanup == True: # Check to see if the flag is set
+        ( outDir, FILE_NAME ) = fcName.rsplit( os.sep, 1 )
+        ( FC_LAYER_NAME, EXT ) = os.path.splitext( FILE_NAME )
+        print( "Deleting old files of %s." % FC_LAYER_NAME )
+        files = os.listdir( outDir )
+        for file in files:
+            ( layerName, extension ) = os.path.splitext( file )
+            if layerName == FC_LAYER_NAME:
+                try:
+                    os.remove( os.path.join( outDir, file ) )
+                except:
+                    pass # If the file isn't there any more, then we don't care
+    return Pieces
+
+# Originally authored by Jeff Hartley
+# Edited for use in this toolbox by Tristan Sebens
+# Splits a feature class by running a selection for every range of OIDs. Reads the whole feature class once per piece
+# @return = The paths of the new feature classes
+def SplitFCByNumFeatWithSelections( fcName, featCount ):
     if arcpy.Exists( fcName ):
     	pass
     else:
@@ -45,6 +84,7 @@ def SplitFCByNumFeat( fcName, featCount, cleanup=False ):
     for fld in fldList:
         fldName = fld.name
     intersectStartTime = time.time()
+    Pieces = list()
 	
     while i <= (int(totalFeats.getOutput(0)) + int(featCount)):
         print( "\nProcessing features " + fldName.upper() + " >= " + str(i - featCount) + " AND " + fldName.upper() + " < " + str(i) + "\n" )
@@ -63,97 +103,93 @@ def SplitFCByNumFeat( fcName, featCount, cleanup=False ):
         except:
             print( "\n" + arcpy.GetMessages() )
             sys.exit()
+        Pieces.append( outFC )
         i += featCount
 		
     intersectStopTime = time.time()
     intTotalTime = (intersectStopTime - intersectStartTime) / 60
     print( "Total time to run split using selection sets = " + str(intTotalTime) + " minutes.")
-
-    # Delete old files
-    if cleanup == True: # Check to see if the flag is set
-        print( "Deleting old files." % FC_LAYER_NAME )
-        files = os.listdir( outDir )
-        for file in files:
-            ( layerName, extension ) = os.path.splitext( file )
-            if layerName == FC_LAYER_NAME:
-                try:
-                    os.remove( os.path.join( outDir, file ) )
-                except:
-                    pass # If the file isn't there any more, then we don't care
+    return Pieces
 	
 # Method that walks through a file tree recursively, looking for files with the specified extension.
 # It then returns a list containing all files which mached the specified extension
 # @param root = The root of the file tree to search through
 # @param ext = The extension to look for
 def FindFilesByExtension( ROOT, EXTENSION ):
-    AllFiles = os.walk( ROOT, True, None, False )
-    ReturnFiles = list()
-
-    for entry in AllFiles:
-        # entry is a tuple containing (path, directories, files)
-        for file in entry[2]:
-            ( filename, extension ) = os.path.splitext( file )
-            if extension == ext:
-                ReturnFiles.append( os.path.join( entry[0], file ) )
-
-    return ReturnFiles
+    return FileIndex.FindFiles( ROOT, EXTENSION )
 
-# Adds header to XYZ file. NOT TECHNICALLY TESTED (since revision)
-# Throws an exception if a line is found with missing data. When this happens, the line is disregarded, an error is printed to the console, and processing continues
+# Adds header to XYZ file. The file is streamed block by block through XYZParser, so memory use stays bounded even for multi-gigabyte files.
+# The original first line of the file is discarded, delimiters (tabs, spaces, commas) are normalized to commas, and z is negated.
+# If BathyConfig.INTERMEDIATE_FORMAT is ".bpt", the points are written to a binary PointTile instead of text.
+# Checkpoints are saved as the file is streamed, so if processing is interrupted, the next run carries on from the last one.
+# Lines with missing or malformed data are disregarded. When one is found, an error is printed to the console, and processing continues
 # @param FILE_PATH = The path of the file to be processed
 # @param OUT_DIRECTORY = The directory to save the newly processed file
-def AddHeaderToXYZFile( FILE_PATH, OUT_DIRECTORY ):
+# @param PROJECT = If True, each block is projected into the coordinate system specified in BathyConfig on its way through
+def AddHeaderToXYZFile( FILE_PATH, OUT_DIRECTORY, PROJECT=False ):
     ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = SplitFilePath( FILE_PATH )
-    headerLine = "x,y,z\n"
-
-    newFilename = FILE_NAME + "_proc" + FILE_EXTENSION # Create the new filename for the file.
-
-    # Here we open the file for parsing 
-    f = open( FILE_PATH, "r+" )
-                
-    content = headerLine
-    f.readline()
-
-    # In this loop, we go through the file line by line
-    for line in f.readlines():
-        line.strip()
-        newLine = re.sub(r"[\t ]+", ",", line)
-        newLineArray = newLine.split(",")
-        try: 
-            z = float(newLineArray[-1].strip()) * -1
-        except ValueError:
-            errorCount += 1
-
-            print("Found an offending line: " + line + "Total Offending Lines: " + str(errorCount) )
-            continue
-        newLine = "%s,%s,%s\n" % (newLineArray[0], newLineArray[1], z)
-        content+= newLine
-            
-    # Now that we have finished writing the new file, we can save it to the finished directory
-    newFile = open(os.path.join( OUT_DIRECTORY, newFilename), "w")
-    newFile.write(content)
-       
-    # We are finished. Now we clean up after outselves by closing all resources.
-    f.close()
-    newFile.close
-
-# Processes an XYZ file into a shapefile, along will all corresponding file, to the specified directory
+
+    newFilename = FILE_NAME + "_proc" + PointIO.IntermediateExtension( FILE_EXTENSION ) # Create the new filename for the file.
+
+    # The output goes through a buffered writer, so it is flushed to disk in large blocks as we go rather than all at once at the end
+    with PointIO.CheckpointedStream( FILE_PATH, os.path.join( OUT_DIRECTORY, newFilename ), CRS=BathyConfig.PROJECTION_WKT if PROJECT == True else "" ) as newFile:
+        errorCount = newFile.Extra.get( "errorCount", 0 )
+        # In this loop, we go through the file block by block. Each block is parsed into arrays in one go
+        for ( x, y, z, badLines ) in newFile.Blocks():
+            for line in badLines:
+                errorCount += 1
+                print( "Found an offending line: " + line + "\nTotal Offending Lines: " + str( errorCount ) )
+            newFile.Extra[ "errorCount" ] = errorCount
+            if PROJECT == True:
+                ( x, y ) = Projection.ProjectArrays( x, y )
+            newFile.Append( [ x, y, -z ] )
+            Progress.Advance( len( z ) )
+    # We are finished. The stream is closed, and the new file given its real name
+    return newFile.OutFile
+
+# Processes an XYZ file (or a PointTile) into a shapefile, along will all corresponding file, to the specified directory
 # @param FILE_PATH = The path of the file that is to be processed
 # @param OUT_DIRECTORY = The directory into which the shape file and all corresponding files will be output to
+# @return = The path of the new shapefile
 def ProcessXYZtoShapefile( FILE_PATH, OUT_DIRECTORY ):
     ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = SplitFilePath( FILE_PATH )
-    outFile = os.path.join( OUT_DIRECTORY, FILE_NAME )
-    arcpy.ASCII3DToFeatureClass_3d( FILE_PATH, "XYZ", outFile, "POINT", "1", "", "", "", "DECIMAL_POINT")
+    outFile = os.path.join( OUT_DIRECTORY, FILE_NAME + ".shp" )
+    if BathyConfig.USE_NATIVE_SHAPEFILE_WRITER == True:
+        # Text files which have already been projected natively don't record their coordinate system, so it is taken from BathyConfig
+        CRS = None
+        if PointIO.IsTile( FILE_PATH ) == False and BathyConfig.USE_NATIVE_PROJECTION == True:
+            CRS = BathyConfig.PROJECTION_WKT
+        return PointIO.ConvertPoints( FILE_PATH, outFile, CRS )
+    if PointIO.IsTile( FILE_PATH ):
+        return ProcessTileToShapefile( FILE_PATH, outFile )
+    # Files which have already been projected natively are tagged with their coordinate system. Otherwise it is left for ProjectShapefile
+    COORDINATE_SYSTEM = BathyConfig.PROJECTION_WKT if BathyConfig.USE_NATIVE_PROJECTION == True else ""
+    arcpy.ASCII3DToFeatureClass_3d( FILE_PATH, "XYZ", outFile, "POINT", "1", COORDINATE_SYSTEM, "", "", "DECIMAL_POINT")
+    return outFile
+
+# Writes the points of a PointTile to a shapefile. The tile's coordinate system, if it has one, is carried over
+# @return = The path of the new shapefile
+def ProcessTileToShapefile( FILE_PATH, OUT_FILE ):
+    tile = PointTile.ReadTile( FILE_PATH )
+    points = np.empty( tile.Count, dtype=[ ( "x", np.float64 ), ( "y", np.float64 ), ( "z", np.float64 ) ] )
+    ( points[ "x" ], points[ "y" ], points[ "z" ] ) = tile.XYZ()
+    spatialReference = None
+    if tile.CRS != "":
+        spatialReference = arcpy.SpatialReference()
+        spatialReference.loadFromString( tile.CRS )
+    arcpy.da.NumPyArrayToFeatureClass( points, OUT_FILE, ( "x", "y", "z" ), spatialReference )
+    return OUT_FILE
 
 # Projects a shapefile in Alaska Albers coordinate system. If the projection is for some reason unsuccessful, this method throws an exception.
+# @return = The path of the projected shapefile
 def ProjectShapefile( FILE_PATH, OUT_DIRECTORY ):
     ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = SplitFilePath( FILE_PATH )
-    OUT_NAME = FILE_NAME + "_AA" + FILE_EXTENSION
-    OUT_FILE = os.path.join( OUT_DIRECTORY, FILE_NAME )
+    OUT_FILE = os.path.join( OUT_DIRECTORY, FILE_NAME + FILE_EXTENSION )
     try:
-        arcpy.Project_management( FILE_PATH, OUT_FILE, "PROJCS['NAD_1983_Alaska_Albers',GEOGCS['GCS_North_American_1983',DATUM['D_North_American_1983',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]],PROJECTION['Albers'],PARAMETER['False_Easting',0.0],PARAMETER['False_Northing',0.0],PARAMETER['Central_Meridian',-154.0],PARAMETER['Standard_Parallel_1',55.0],PARAMETER['Standard_Parallel_2',65.0],PARAMETER['Latitude_Of_Origin',50.0],UNIT['Meter',1.0]]", "", "")
+        arcpy.Project_management( FILE_PATH, OUT_FILE, BathyConfig.PROJECTION_WKT, "", "")
     except Exception as e:
         raise e
+    return OUT_FILE
 
 # This method is meant to perform a basic analysis of bathymetric data, and to delete those points in the data which appear to be inaccurate.
 # The inaccuracy arises largely from the fact that as the distance between the sonar array and the ocean floor increases, the readings become less and less reliable.
@@ -233,11 +269,5 @@ def RemoveExtremeZScores( INPUT ):
 	# Process: Delete Features
 	arcpy.DeleteFeatures_management(SELECTED)
 	
-# Helper function that takes in a filepath, and returns a list containing three items:
-# 0: The directory of the file
-# 1: The name of the file
-# 2: The extension of the file
-def SplitFilePath( INPUT ):
-	( INPUT_DIRECTORY, FILE ) = INPUT.rsplit( os.sep, 1 ) # Split the input path into the filename, and the file's directory
-	( FILE_NAME, EXTENSION ) = os.path.splitext( FILE )
-	return ( INPUT_DIRECTORY, FILE_NAME, EXTENSION )
+# Helper function that splits a filepath into its directory, name and extension. Lives in OSToolbox so that modules without arcpy can use it
+SplitFilePath = OSToolbox.SplitFilePath
@@ -0,0 +1,230 @@
+# Benchmark
+# Measures the throughput of the native processing stages on synthetic surveys, and writes the results to a JSON file, so that runs of
+# different versions can be compared. No part of it needs arcpy.
+# A survey is generated as raw XYZ text (in the format AddHeaderToXYZFile accepts), and as a PointTile and a point shapefile of the same points.
+# Every stage then runs in a fresh worker process, so that the peak memory use reported for it is its own.
+# Usage: python Benchmark.py --points 100000 1000000 10000000 --output Benchmark.json
+
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+import BathyConfig
+import BathyToolbox
+import Gridder
+import Metrics
+import OutlierFilter
+import PointIO
+import PointTile
+import Projection
+import RunConfig
+import Shapefile
+import XYZParser
+import ZScoreFilter
+
+# The number of points generated at a time
+GENERATE_BLOCK_SIZE = 1000000
+
+# The geographic center of every synthetic survey
+SURVEY_CENTER = ( -152.0, 58.0 )
+
+# The delimiters raw survey files may be written with
+DELIMITERS = { "comma": b",", "space": b" ", "tab": b"\t" }
+
+# The stages, in the order they run. Each takes the paths of the survey's files and the outputs of the stages before it
+STAGE_NAMES = [ "parse_csv", "parse_bpt", "parse_shp", "projection", "zscores", "outliers", "write_bpt", "write_shp", "write_csv", "grid" ]
+
+# Generator for the points of a synthetic survey, block by block. The survey is run in lawnmower lines across a square area sized so that
+# points are about SPACING meters apart. Depths follow a sloping seabed with ridges and a seamount, plus gaussian noise, and a fraction of
+# the points are spikes far above or below the seabed, for the filters to find.
+# @param COUNT = The number of points in the survey
+# @param SEED = Seeds the random numbers. The same seed always gives the same survey
+# @param NOISE = The standard deviation of the noise added to every depth, in meters
+# @param SPIKE_FRACTION = The fraction of points which are spikes
+# @param SPIKE_SIZE = How far spikes are from the seabed, in meters
+# @param SPACING = The average distance between neighboring points, in meters
+# @param SWATH = The width of each survey line, in meters
+# @return = Yields a tuple of ( lon, lat, depth ) for every block. Depths are positive down, as in raw survey files
+def GenerateSurvey( COUNT, SEED=0, NOISE=0.5, SPIKE_FRACTION=0.001, SPIKE_SIZE=50.0, SPACING=5.0, SWATH=200.0 ):
+    side = math.sqrt( COUNT ) * SPACING
+    lines = max( 1, int( math.ceil( side / SWATH ) ) )
+    perLine = int( math.ceil( COUNT / float( lines ) ) )
+    ( X0, Y0 ) = Projection.ProjectArrays( np.array( [ SURVEY_CENTER[0] ] ), np.array( [ SURVEY_CENTER[1] ] ) )
+    for ( blockNumber, start ) in enumerate( range( 0, COUNT, GENERATE_BLOCK_SIZE ) ):
+        rng = np.random.default_rng( [ SEED, blockNumber ] )
+        index = np.arange( start, min( start + GENERATE_BLOCK_SIZE, COUNT ) )
+        line = index // perLine
+        along = ( index % perLine + rng.random( len( index ) ) ) / perLine * side
+        along = np.where( line % 2 == 0, along, side - along ) # Every other line runs back the other way
+        across = ( line + rng.random( len( index ) ) ) * SWATH
+        ( u, v ) = ( along / side, across / side )
+        depth = 200.0 + 150.0 * u + 20.0 * np.sin( 6.0 * math.pi * v ) * np.cos( 4.0 * math.pi * u ) \
+                - 120.0 * np.exp( -( np.square( u - 0.6 ) + np.square( v - 0.4 ) ) / 0.01 )
+        depth += rng.normal( 0.0, NOISE, len( index ) )
+        spikes = rng.random( len( index ) ) < SPIKE_FRACTION
+        depth[ spikes ] += rng.choice( [ -SPIKE_SIZE, SPIKE_SIZE ], int( np.count_nonzero( spikes ) ) )
+        ( lon, lat ) = Projection.GetDefaultProjection().Inverse( X0[0] - side / 2.0 + along, Y0[0] - side / 2.0 + across )
+        yield ( lon, lat, depth )
+
+# Writes a synthetic survey to a raw XYZ file, the way surveys arrive: a header line (which is discarded), then one 'lon lat depth' line per point
+# @param DELIMITER = The name of the delimiter between values: "comma", "space" or "tab"
+def WriteRawSurvey( FILE_PATH, Blocks, DELIMITER="comma" ):
+    with io.open( FILE_PATH, "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) as f:
+        f.write( DELIMITERS[ DELIMITER ].join( [ b"Longitude", b"Latitude", b"Depth" ] ) + b"\n" )
+        for ( lon, lat, depth ) in Blocks:
+            f.write( XYZParser.FormatXYZBlock( lon, lat, depth ).replace( b",", DELIMITERS[ DELIMITER ] ) )
+
+# Returns True if a survey of COUNT points fits within the size limit of a shapefile
+def FitsInShapefile( COUNT ):
+    return Shapefile.HEADER_SIZE + COUNT * Shapefile.RECORD_DTYPE.itemsize <= Shapefile.MAX_FILE_SIZE
+
+# Generates a survey into a directory, as raw text, a PointTile and a point shapefile of the same points.
+# Surveys too large for a shapefile don't get one, and the shapefile stages are skipped
+# @param Options = The parsed command line options
+# @return = A dict of the paths of the files, keyed by format
+def GenerateSurveyFiles( DIRECTORY, COUNT, Options ):
+    Paths = { "csv": os.path.join( DIRECTORY, "survey.csv" ), "bpt": os.path.join( DIRECTORY, "survey.bpt" ) }
+    if FitsInShapefile( COUNT ):
+        Paths[ "shp" ] = os.path.join( DIRECTORY, "survey.shp" )
+    Arguments = ( COUNT, Options.seed, Options.noise, Options.spikes )
+    WriteRawSurvey( Paths[ "csv" ], GenerateSurvey( *Arguments ), Options.delimiter )
+    Writers = [ PointIO.OpenPointWriter( Paths[ name ] ) for name in [ "bpt", "shp" ] if name in Paths ]
+    for ( lon, lat, depth ) in GenerateSurvey( *Arguments ):
+        for Writer in Writers:
+            Writer.Append( [ lon, lat, -depth ] )
+    for Writer in Writers:
+        Writer.Close()
+    return Paths
+
+# Reads every point of a file, and touches every value, so that memory-mapped formats are really read
+def ReadAll( FILE_PATH, OUT_DIRECTORY ):
+    ( x, y, z ) = PointIO.ReadPoints( FILE_PATH )
+    float( x.sum() + y.sum() + z.sum() )
+    return FILE_PATH
+
+# Projects the geographic coordinates of a file into the coordinate system specified in BathyConfig, block by block
+def ProjectFile( FILE_PATH, OUT_DIRECTORY ):
+    OUT_FILE = os.path.join( OUT_DIRECTORY, "projected" + PointTile.EXTENSION )
+    with PointIO.OpenPointWriter( OUT_FILE, BathyConfig.PROJECTION_WKT ) as Writer:
+        for ( lon, lat, z, badLines ) in PointIO.IterPointBlocks( FILE_PATH ):
+            ( x, y ) = Projection.ProjectArrays( lon, lat )
+            Writer.Append( [ x, y, z ] )
+    return OUT_FILE
+
+# Converts a file to the format given by EXTENSION
+def ConvertTo( EXTENSION ):
+    def Convert( FILE_PATH, OUT_DIRECTORY ):
+        return PointIO.ConvertPoints( FILE_PATH, os.path.join( OUT_DIRECTORY, "converted" + EXTENSION ) )
+    return Convert
+
+# Returns the function a stage runs, and the path of its input. The input is None if the stage can't run
+# @param Paths = The survey's files, keyed by format, and the outputs of the stages run so far, keyed by stage
+def GetStage( NAME, Paths ):
+    Stages = {
+        "parse_csv": ( BathyToolbox.AddHeaderToXYZFile, Paths[ "csv" ] ),
+        "parse_bpt": ( ReadAll, Paths[ "bpt" ] ),
+        "parse_shp": ( ReadAll, Paths.get( "shp" ) ),
+        "projection": ( ProjectFile, Paths.get( "parse_csv", Paths[ "bpt" ] ) ),
+        "zscores": ( ZScoreFilter.RemoveExtremeZScoresFromXYZFile, Paths.get( "projection" ) ),
+        "outliers": ( OutlierFilter.RemoveOutliersFromXYZFile, Paths.get( "zscores", Paths.get( "projection" ) ) ),
+        "write_bpt": ( ConvertTo( PointTile.EXTENSION ), Paths.get( "projection" ) ),
+        "write_shp": ( ConvertTo( ".shp" ), Paths.get( "projection" ) if "shp" in Paths else None ),
+        "write_csv": ( ConvertTo( ".csv" ), Paths.get( "projection" ) ),
+        "grid": ( Gridder.GridFile, Paths.get( "outliers", Paths.get( "projection" ) ) ) }
+    return Stages[ NAME ]
+
+# Runs a single stage and times it. Called in a fresh worker process
+# @param Arguments = A tuple of ( NAME, Paths, OUT_DIRECTORY, Settings ), where Settings are BathyConfig values to apply in the worker
+# @return = A dict of the stage's results
+def RunStage( Arguments ):
+    ( NAME, Paths, OUT_DIRECTORY, Settings ) = Arguments
+    RunConfig.RunConfig( Settings ).Apply()
+    ( Function, INPUT ) = GetStage( NAME, Paths )
+    if INPUT == None:
+        return None # A stage it depends on wasn't run
+    COUNT = PointIO.CountPoints( INPUT )
+    baseline = Metrics.PeakRSS()
+    startTime = time.perf_counter()
+    OUTPUT = Function( INPUT, OUT_DIRECTORY )
+    seconds = time.perf_counter() - startTime
+    return { "stage": NAME, "points": COUNT, "seconds": seconds, "points_per_second": COUNT / seconds if seconds > 0 else None,
+             "output": OUTPUT, "output_points": PointIO.CountPoints( OUTPUT ) if OUTPUT.endswith( Gridder.EXTENSION ) == False else None,
+             "peak_rss_bytes": Metrics.PeakRSS(), "baseline_rss_bytes": baseline }
+
+# Returns a description of the code and machine being benchmarked, so results from different versions can be told apart
+def DescribeEnvironment():
+    try:
+        commit = subprocess.check_output( [ "git", "rev-parse", "HEAD" ], cwd=os.path.dirname( os.path.abspath( __file__ ) ),
+                                          stderr=subprocess.DEVNULL ).decode( "ascii" ).strip()
+    except Exception:
+        commit = None
+    return { "commit": commit, "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+             "processor": platform.processor(), "cpus": os.cpu_count() }
+
+# Runs the benchmark at every scale
+# @param Options = The parsed command line options
+# @return = The results, as a dict ready to be written to JSON
+def RunBenchmark( Options ):
+    # Every stage writes the intermediate format, and every point is kept in memory the way it would be in production
+    Settings = { "CONDITIONAL_OUTPUT_ALLOWED": Options.verbose, "USE_THREADING": False, "POINT_PRECISION": Options.precision }
+    Results = { "environment": DescribeEnvironment(), "started": time.strftime( "%Y-%m-%dT%H:%M:%S" ),
+                "options": vars( Options ), "settings": dict( [ ( name, getattr( BathyConfig, name ) ) for name in
+                [ "READ_CHUNK_SIZE", "WRITE_BUFFER_SIZE", "INDEX_TILES", "TILE_INDEX_BLOCK_SIZE", "Z_SCORE_MAX_MIN", "OUTLIER_NEIGHBOR_RADIUS",
+                  "OUTLIER_TILE_SIZE", "MIN_BIN_SCORE", "GRID_CELL_SIZE", "MAX_IN_MEMORY_FILE_SIZE" ] ] ), "runs": list() }
+    Context = multiprocessing.get_context( "spawn" ) # A fresh interpreter for every stage, on every platform
+    for COUNT in Options.points:
+        DIRECTORY = tempfile.mkdtemp( prefix="bathy_benchmark_", dir=Options.work_dir )
+        try:
+            print( "Generating a survey of %s points..." % COUNT )
+            startTime = time.perf_counter()
+            Paths = GenerateSurveyFiles( DIRECTORY, COUNT, Options )
+            Run = { "points": COUNT, "generate_seconds": time.perf_counter() - startTime,
+                    "file_bytes": dict( [ ( name, os.path.getsize( path ) ) for ( name, path ) in Paths.items() ] ), "stages": list() }
+            for NAME in [ name for name in STAGE_NAMES if name in Options.stages ]:
+                OUT_DIRECTORY = os.path.join( DIRECTORY, NAME )
+                os.mkdir( OUT_DIRECTORY )
+                with Context.Pool( 1, maxtasksperchild=1 ) as Pool:
+                    Result = Pool.apply( RunStage, ( ( NAME, Paths, OUT_DIRECTORY, Settings ), ) )
+                if Result == None:
+                    continue
+                Paths[ NAME ] = Result.pop( "output" )
+                print( "%-10s %12s points %9.3f s %14.0f points/s  peak RSS %s MB" % ( NAME, Result[ "points" ], Result[ "seconds" ],
+                       Result[ "points_per_second" ] or 0, None if Result[ "peak_rss_bytes" ] == None else Result[ "peak_rss_bytes" ] // ( 1024 * 1024 ) ) )
+                Run[ "stages" ].append( Result )
+            Results[ "runs" ].append( Run )
+        finally:
+            if Options.keep == False:
+                shutil.rmtree( DIRECTORY, ignore_errors=True )
+    return Results
+
+def ParseArguments( Arguments=None ):
+    parser = argparse.ArgumentParser( description="Benchmarks the native processing stages on synthetic surveys." )
+    parser.add_argument( "--points", type=lambda value: int( float( value ) ), nargs="+", default=[ 100000, 1000000 ],
+                         help="The survey sizes to benchmark, in points. Accepts 1e6 and the like" )
+    parser.add_argument( "--stages", nargs="+", default=STAGE_NAMES, choices=STAGE_NAMES, help="The stages to run" )
+    parser.add_argument( "--noise", type=float, default=0.5, help="The standard deviation of the depth noise, in meters" )
+    parser.add_argument( "--spikes", type=float, default=0.001, help="The fraction of points which are spikes" )
+    parser.add_argument( "--seed", type=int, default=0 )
+    parser.add_argument( "--precision", default="float64", choices=[ "float64", "float32", "quantized" ],
+                         help="The precision the in-memory stages hold points in (BathyConfig.POINT_PRECISION)" )
+    parser.add_argument( "--delimiter", default="comma", choices=sorted( DELIMITERS ), help="The delimiter of the raw survey files" )
+    parser.add_argument( "--work-dir", default=None, help="Where surveys are generated. Defaults to the system's temporary directory" )
+    parser.add_argument( "--keep", action="store_true", help="Keep the generated surveys and stage outputs" )
+    parser.add_argument( "--verbose", action="store_true", help="Let the stages print their progress" )
+    parser.add_argument( "--output", default="Benchmark.json", help="The JSON file the results are written to" )
+    return parser.parse_args( Arguments )
+
+if __name__ == "__main__":
+    Options = ParseArguments()
+    Results = RunBenchmark( Options )
+    with io.open( Options.output, "w" ) as f:
+        f.write( json.dumps( Results, indent=2, sort_keys=True ) )
+    print( "Results written to %s" % Options.output )
@@ -0,0 +1,123 @@
+# Checkpoint
+# Crash-safe outputs. Every output is written under a temporary name (its path plus PARTIAL), and only renamed to its real name once it is
+# complete, so a file with an output's real name is always whole. The rename is atomic, so there is never a half-written file in its place.
+# Stages which stream a file block by block also save a checkpoint beside the partial output every CHECKPOINT_INTERVAL seconds: how far
+# through the input they have got, and what the output's writer needs to carry on from there. The output is flushed to disk before the
+# checkpoint is saved, so everything a checkpoint describes has been written. If the stage is interrupted, the next run truncates the partial
+# output back to the last checkpoint, and picks up where it left off.
+
+import io
+import json
+import os
+import time
+import BathyConfig
+
+PARTIAL = ".partial"
+CHECKPOINT = ".checkpoint"
+
+# Returns the path an output is written to until it is complete
+def PartialPath( FILE_PATH ):
+    return FILE_PATH + PARTIAL
+
+# Returns the path of the checkpoint of an output
+def CheckpointPath( FILE_PATH ):
+    return FILE_PATH + CHECKPOINT
+
+# Gives a complete output its real name. Replaces any older output of the same name
+# @param PARTIAL_PATH = The path the output was written to
+# @param FILE_PATH = The output's real path
+def Commit( PARTIAL_PATH, FILE_PATH ):
+    os.replace( PARTIAL_PATH, FILE_PATH )
+    return FILE_PATH
+
+# Removes a file, if it exists
+def Remove( FILE_PATH ):
+    try:
+        os.remove( FILE_PATH )
+    except OSError:
+        pass # If the file isn't there any more, then we don't care
+
+# Pushes everything written to an open file out to disk
+def Sync( File ):
+    File.flush()
+    os.fsync( File.fileno() )
+
+# Opens a partial output to carry on writing it, with everything past SIZE bytes (written after the last checkpoint) cut off
+# @return = The open file, positioned at its end
+def Reopen( PARTIAL_PATH, SIZE, buffering=-1 ):
+    File = io.open( PARTIAL_PATH, "r+b", buffering=buffering )
+    File.truncate( SIZE )
+    File.seek( SIZE )
+    return File
+
+# Describes an input, so that a checkpoint is only used against the same input it was saved for
+def DescribeInput( SOURCE_PATH ):
+    stat = os.stat( SOURCE_PATH )
+    return { "path": os.path.abspath( SOURCE_PATH ), "size": stat.st_size, "mtime": stat.st_mtime }
+
+# Saves a checkpoint. Written under a temporary name and renamed, so a checkpoint is never half-written either
+# @param FILE_PATH = The output's real path
+# @param SOURCE_PATH = The input the output is made from
+# @param State = A dict of everything needed to resume. Must be JSON-serializable
+def SaveCheckpoint( FILE_PATH, SOURCE_PATH, State ):
+    PATH = CheckpointPath( FILE_PATH )
+    with io.open( PATH + PARTIAL, "w", encoding="utf-8" ) as f:
+        json.dump( { "input": DescribeInput( SOURCE_PATH ), "state": State }, f )
+        Sync( f )
+    os.replace( PATH + PARTIAL, PATH )
+
+# Loads the checkpoint of an output
+# @return = The state saved with the checkpoint, or None if there is no checkpoint, it can't be read, or its input has changed since
+def LoadCheckpoint( FILE_PATH, SOURCE_PATH ):
+    try:
+        with io.open( CheckpointPath( FILE_PATH ), "r", encoding="utf-8" ) as f:
+            checkpoint = json.load( f )
+    except ( OSError, ValueError ):
+        return None
+    if checkpoint.get( "input" ) != DescribeInput( SOURCE_PATH ):
+        return None
+    return checkpoint.get( "state" )
+
+def RemoveCheckpoint( FILE_PATH ):
+    Remove( CheckpointPath( FILE_PATH ) )
+
+# Returns the real paths of the outputs in a directory which have checkpoints, i.e. which were interrupted and can be resumed
+# @param SOURCE_PATH = If given, only the outputs whose checkpoints were saved for this input, as it is now
+def FindCheckpointed( DIRECTORY, SOURCE_PATH=None ):
+    Outputs = [ os.path.join( DIRECTORY, name[ : -len( CHECKPOINT ) ] ) for name in os.listdir( DIRECTORY ) if name.endswith( CHECKPOINT ) ]
+    if SOURCE_PATH == None:
+        return Outputs
+    if os.path.exists( SOURCE_PATH ) == False:
+        return list()
+    return [ path for path in Outputs if LoadCheckpoint( path, SOURCE_PATH ) != None ]
+
+# The endings of the files which are only written on the way to an output: partial outputs, checkpoints, and the spilled columns of tile
+# writers. A file with any other ending is a complete output
+TEMPORARY = ( PARTIAL, CHECKPOINT, ".tmp" )
+
+def IsTemporary( FILE_PATH ):
+    return FILE_PATH.endswith( TEMPORARY )
+
+# True if a file is one of the temporary files of an output. These all start with the output's path without its extension, since some
+# outputs are written as several files (a shapefile's .shx and .dbf are written beside its .shp)
+def IsTemporaryFileOf( FILE_PATH, OUTPUT_PATH ):
+    return IsTemporary( FILE_PATH ) and FILE_PATH.startswith( os.path.splitext( OUTPUT_PATH )[0] + "." )
+
+# Decides when a streaming stage saves its next checkpoint
+# @param INTERVAL = The least time between checkpoints, in seconds. Defaults to the value specified in BathyConfig. If None there, no checkpoints are saved
+class CheckpointTimer( object ):
+    def __init__( self, INTERVAL=None ):
+        if INTERVAL == None:
+            INTERVAL = BathyConfig.CHECKPOINT_INTERVAL
+        self.Interval = INTERVAL
+        self.Last = time.monotonic()
+
+    # True if it is time for another checkpoint. Counts from the last time it said so
+    def IsDue( self ):
+        if self.Interval == None:
+            return False
+        now = time.monotonic()
+        if now - self.Last < self.Interval:
+            return False
+        self.Last = now
+        return True
@@ -2,70 +2,169 @@
 # Author: Tristan Sebens 
 # Contact: tristan.ng.sebens@gmail.com
 import os
+import threading
 import BathyConfig
+import FileIndex
+import ResultCache
 
 
+# Measures a directory tree
+# @return = A tuple of ( bytes, files ): the total size of the files in the tree, and the number of them
+def MeasureDirectory( DIRECTORY ):
+    ( size, count ) = ( 0, 0 )
+    for entry in os.scandir( DIRECTORY ):
+        try:
+            if entry.is_dir( follow_symlinks=False ):
+                ( subdirectorySize, subdirectoryCount ) = MeasureDirectory( entry.path )
+                size += subdirectorySize
+                count += subdirectoryCount
+            else:
+                size += entry.stat( follow_symlinks=False ).st_size
+                count += 1
+        except OSError:
+            pass # The entry has disappeared since the listing began
+    return ( size, count )
+
 # Class used to manage the creation and administration of subdirectories. Each DirectoryManager maintains a single larger directory comprised of multiple subdirectories
+# The size of each subdirectory is kept as a running count of the bytes and files written to it, so checking it never touches the disk.
+# The counts are only measured from disk once, at startup, for the subdirectory the manager carries on filling.
+# Every output is counted against its subdirectory from the moment the subdirectory is handed out, so the threads sharing a manager can't overfill
+# it between them. The size limit only holds within a single manager, though: separate managers of the same directory (in other processes, or
+# simply created separately) each carry on with the same last subdirectory and count only their own writes, so together they can take it past
+# MaxFolderSize. Share one manager between the threads of a process, and don't point managers in different processes at the same directory.
+# New subdirectories are claimed with os.mkdir, which only ever succeeds for one caller, so separate managers at least never roll over into the same one
 # @param CurrentDirectory = The directory which this instance manages. Will contain a series of incrementally named subdirectories.
 # @param FolderClassName = The default name of the subfolders. For example: If FolderClassName = 'shapes', then the subdirectories will be named 'shapes0', 'shapes1', 'shapes2', etc
-# @param MaxFolderSize = The maximum size a folder can reach before a new one is created
+#                          If None, files are created directly in the managed directory
+# @param MaxFolderSize = The maximum size a folder can reach before a new one is created. Expressed in bytes
+# @param MaxFolderFiles = The maximum number of files a folder can hold before a new one is created. If None, there is no limit
 class DirectoryManager( object ):
-	# Initializer
-    def __init__( self, Directory, FolderClassName=None, MaxFolderSize=None ):
-		BathyConfig.ConditionalPrint( "Initializing DirectoryManager for %s. Max folder size is %s", ( Directory, MFS ) )
-		self.DirectoryCounter = 0
-		self.FolderClassName = FolderClassName
-		self.Directory = Directory
-		self.CurrentSubdirectory = os.path.join( self.Directory, FolderClassName + str( self.DirectoryCounter) )
-		if MaxFolderSize == None: # If the maximum folder size wasn't specified, then we'll simply use the default as specified by BathyConfig
-			self.MaxFolderSize = BathyConfig.MAX_FOLDER_SIZE
-		else:
-			self.MaxFolderSize = MaxFolderSize
-		if self.FolderClassName != None:	
-			self.MakeNewSubdirectory()
-		
-    # Returns the size of the current subdirectory    
+    # Initializer
+    def __init__( self, Directory, FolderClassName=None, MaxFolderSize=None, MaxFolderFiles=None ):
+        if MaxFolderSize == None: # If the maximum folder size wasn't specified, then we'll simply use the default as specified by BathyConfig
+            self.MaxFolderSize = BathyConfig.MAX_FOLDER_SIZE
+        else:
+            self.MaxFolderSize = MaxFolderSize
+        if MaxFolderFiles == None:
+            self.MaxFolderFiles = BathyConfig.MAX_FOLDER_FILES
+        else:
+            self.MaxFolderFiles = MaxFolderFiles
+        BathyConfig.ConditionalPrint( "Initializing DirectoryManager for %s. Max folder size is %s", ( Directory, self.MaxFolderSize ) )
+        self.DirectoryCounter = 0
+        self.FolderClassName = FolderClassName
+        self.Directory = Directory
+        self.CurrentSubdirectory = Directory
+        self.Sizes = dict() # Maps each subdirectory to [ bytes, files ] written to it
+        self.Pending = dict() # Maps each subdirectory to the number of outputs which have been sent to it, but not yet recorded
+        self.Lock = threading.RLock() # Only one thread may hand out or roll over subdirectories at a time
+        if self.FolderClassName != None:
+            self.Reconcile()
+
+    # Returns the path of the Nth subdirectory
+    def SubdirectoryPath( self, N ):
+        return os.path.join( self.Directory, self.FolderClassName + str( N ) )
+
+    # Picks up where a previous run left off. The last existing subdirectory is measured, and carried on with if it has room left
+    def Reconcile( self ):
+        numbers = list()
+        for name in os.listdir( self.Directory ):
+            suffix = name[ len( self.FolderClassName ): ]
+            if name.startswith( self.FolderClassName ) and suffix.isdigit() and os.path.isdir( os.path.join( self.Directory, name ) ):
+                numbers.append( int( suffix ) )
+        if len( numbers ) == 0:
+            self.MakeNewSubdirectory()
+            return
+        self.DirectoryCounter = max( numbers ) + 1
+        self.CurrentSubdirectory = self.SubdirectoryPath( max( numbers ) )
+        self.Sizes[ self.CurrentSubdirectory ] = list( MeasureDirectory( self.CurrentSubdirectory ) )
+        BathyConfig.ConditionalPrint( "Current subdirectory size for %s is %s.\nMax folder size is %s", ( self.Directory, self.Sizes[ self.CurrentSubdirectory ][0], self.MaxFolderSize ) )
+        if self.IsFull( self.CurrentSubdirectory ):
+            BathyConfig.ConditionalPrint( "Directory too big. Creating new directory in %s", self.Directory )
+            self.MakeNewSubdirectory()
+
+    # Returns the size of the current subdirectory
     def GetCurrentSubdirectorySize( self ):
-		return os.path.getsize( self.CurrentSubdirectory )
-    
-    # Create a new subdirectory to create files in. Automatically generates a unique name 
+        with self.Lock:
+            return self.Sizes.get( self.CurrentSubdirectory, [ 0, 0 ] )[0]
+
+    # Returns True if a subdirectory has no room for another output. Outputs still being written, and the next one, are assumed to be the average
+    # size of those already written (to any of the subdirectories, if none have been written to this one yet)
+    def IsFull( self, SUBDIRECTORY ):
+        ( size, count ) = self.Sizes.get( SUBDIRECTORY, [ 0, 0 ] )
+        pending = self.Pending.get( SUBDIRECTORY, 0 )
+        ( totalSize, totalCount ) = ( size, count )
+        if count == 0:
+            totalSize = sum( [ counts[0] for counts in self.Sizes.values() ] )
+            totalCount = sum( [ counts[1] for counts in self.Sizes.values() ] )
+        if totalCount > 0:
+            size += ( pending + 1 ) * totalSize / float( totalCount )
+        if self.MaxFolderFiles != None and count + pending >= self.MaxFolderFiles:
+            return True
+        return size > self.MaxFolderSize
+
+    # Create a new subdirectory to create files in. Automatically generates a unique name
     def MakeNewSubdirectory( self ):
-		BathyConfig.ConditionalPrint( "Creating new subdirectory in %s", self.Directory )
-		self.CurrentSubdirectory = os.path.join( self.Directory, self.FolderClassName + str( self.DirectoryCounter ) ) # Generate a unique name for the new subdirectory
-		self.DirectoryCounter += 1
-		try:
-			os.mkdir( self.CurrentSubdirectory )
-			BathyConfig.ConditionalPrint( "Directory No.%s created successfully in %s.", ( self.DirectoryCounter - 1, self.Directory ) )
-		except: # The directory already exists. TODO: Should be specific to a FileExistsError
-			BathyConfig.ConditionalPrint( "Subdirectory already exists! Checking to see if directory is over size limit." )
-			BathyConfig.ConditionalPrint( "Current subdirectory size for %s is %s.\nMax folder size is %s", ( self.Directory, os.path.getsize( self.CurrentSubdirectory ), self.MaxFolderSize ) )
-
-			if self.GetCurrentSubdirectorySize() > self.MaxFolderSize: # If the directory already exists, we should first check to see if it's too big. If it isn't there's no need to make a new one
-				BathyConfig.ConditionalPrint( "Directory too big. Creating new directory in %s", self.Directory )
-				self.MakeNewSubdirectory() # If it is too big, however, then we do need to make a new one.
-			else:
-				BathyConfig.ConditionalPrint( "Current directory within limit. No need to make a new one." ) 	
-        
+        with self.Lock:
+            BathyConfig.ConditionalPrint( "Creating new subdirectory in %s", self.Directory )
+            while True:
+                SUBDIRECTORY = self.SubdirectoryPath( self.DirectoryCounter ) # Generate a unique name for the new subdirectory
+                self.DirectoryCounter += 1
+                try:
+                    os.mkdir( SUBDIRECTORY )
+                    break
+                except FileExistsError: # Claimed by another writer. Try the next name
+                    pass
+            BathyConfig.ConditionalPrint( "Directory No.%s created successfully in %s.", ( self.DirectoryCounter - 1, self.Directory ) )
+            self.CurrentSubdirectory = SUBDIRECTORY
+            self.Sizes[ SUBDIRECTORY ] = [ 0, 0 ]
+
     # Returns a directory to create files in. First checks to see if the current subdirectory has exceeded the MaxFolderSize.
     # If it has, then a new subdirectory is created, and that is the directory that is returned.
+    # The output is counted as pending in the directory until it is recorded with RecordOutput
     def GetDirectory( self ):
-        if self.GetCurrentSubdirectorySize() > self.MaxFolderSize:
-            self.MakeNewSubdirectory()
-        return self.CurrentSubdirectory
+        with self.Lock:
+            if self.FolderClassName == None:
+                return self.Directory
+            if self.IsFull( self.CurrentSubdirectory ):
+                self.MakeNewSubdirectory()
+            self.Pending[ self.CurrentSubdirectory ] = self.Pending.get( self.CurrentSubdirectory, 0 ) + 1
+            return self.CurrentSubdirectory
+
+    # Takes the place of GetDirectory for an output which was already being written to a directory before an interruption, and is to be
+    # finished there. Counts the output as pending in that directory
+    # @return = OUT_DIRECTORY
+    def ResumeDirectory( self, OUT_DIRECTORY ):
+        with self.Lock:
+            if self.FolderClassName != None:
+                self.Pending[ OUT_DIRECTORY ] = self.Pending.get( OUT_DIRECTORY, 0 ) + 1
+            return OUT_DIRECTORY
+
+    # Adds an output to the running counts of the directory it was written to. Must be called once for every call to GetDirectory (or ResumeDirectory)
+    # @param OUT_DIRECTORY = The directory returned by GetDirectory
+    # @param OUTPUT_PATH = The path of the output. If None, nothing was written (e.g. the stage failed)
+    def RecordOutput( self, OUT_DIRECTORY, OUTPUT_PATH ):
+        if OUTPUT_PATH != None:
+            Files = ResultCache.OutputFiles( OUTPUT_PATH )
+            size = sum( [ os.path.getsize( path ) for path in Files if os.path.exists( path ) ] )
+        with self.Lock:
+            if OUT_DIRECTORY in self.Pending:
+                self.Pending[ OUT_DIRECTORY ] -= 1
+            if OUTPUT_PATH != None:
+                counts = self.Sizes.setdefault( OUT_DIRECTORY, [ 0, 0 ] )
+                counts[0] += size
+                counts[1] += len( Files )
 
     # Returns a list of all files held in the directory tree managed by this DirectoryManager
     # @param EXTENSION = An optional parameter which allows you to specify an extension. If you do, only files with the specified extension will be returned
     def GetAllFiles( self, EXTENSION=None ):
-		return FindFiles( self.Directory, EXTENSION )
-		
-			
+        return FindFiles( self.Directory, EXTENSION )
 
-# Given a filename, this method returns a filepath for a file with that name, such that the file is being written to the correct directory (according to those rules governing 
-# directory creation for this particular instance of DirectoryManager)
-def CreateFilePath( self, filename ):
-    return os.path.join( self.GetDirectory, filename )
+    # Given a filename, this method returns a filepath for a file with that name, such that the file is being written to the correct directory (according to those rules governing
+    # directory creation for this particular instance of DirectoryManager)
+    def CreateFilePath( self, filename ):
+        return os.path.join( self.GetDirectory(), filename )
 
-def GetDirectoryManagerForDirectory( Directory, FolderClassName, MaxFolderSize=None ):
+def GetDirectoryManagerForDirectory( Directory, FolderClassName=None, MaxFolderSize=None ):
     if os.path.isdir( Directory ):
         pass
     else:
@@ -76,22 +175,10 @@ def GetDirectoryManagerForDirectory( Directory, FolderClassName, MaxFolderSize=N
 # Method that walks through a file tree recursively, looking for files.
 # It then returns a list containing all files in the directory tree
 # @param root = The root of the file tree to search through
-# @param ext = Optional parameter. If you specify an extension, only files with that extension will be returned.
+# @param ext = Optional parameter. If you specify an extension (or a list of extensions), only files with that extension will be returned.
+# Directories are listed in parallel, and unchanged directories aren't listed again at all. See FileIndex
 def FindFiles( root, ext=None ):
-    AllFiles = os.walk( root, True, None, False )
-    ReturnFiles = list()
-
-    for entry in AllFiles:
-        # entry is a tuple containing (path, directories, files)
-        for file in entry[2]:
-            ( layername, extension ) = os.path.splitext( file )
-            if ext != None:
-                if extension == ext:
-                    ReturnFiles.append( os.path.join( entry[0], file ) )
-            else:
-                ReturnFiles.append( os.path.join( entry[0], file ) )
-                
-    return ReturnFiles
+    return FileIndex.FindFiles( root, ext )
 
 """ For some reason, python thinks that this method is a part of the method above it. I'll deal with this later.
 	# Returns a list of all files under the jurisdiction of this DirectoryManager which have the same name as the given name
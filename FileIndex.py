@@ -0,0 +1,139 @@
+# FileIndex
+# Finds files in large directory trees quickly. Directories are listed with os.scandir, several at a time on a pool of threads, which hides the
+# latency of network-mounted drives. What every directory held is remembered in a SQLite index, along with the directory's modification time.
+# On later scans, a directory whose modification time hasn't changed is not listed again: its files and subdirectories are taken from the index,
+# and only its subdirectories are checked in turn. A directory's modification time changes whenever an entry is added to, removed from, or renamed
+# within it, so this finds every new and deleted file. It does not notice a file's contents changing, which the Manifest checks for separately.
+
+import concurrent.futures
+import os
+import sqlite3
+import time
+import BathyConfig
+
+# Directories modified this recently (in seconds) before they were listed are listed again on the next scan, even if their modification
+# time is unchanged. Covers file systems whose modification times are too coarse to show a change made in the same instant as the listing
+MTIME_GRANULARITY = 2.0
+
+# Separates the names stored in a single column of the index. Can't appear in a file name
+SEPARATOR = "\n"
+
+# Lists a single directory, unless its entry in the index is still current.
+# Runs on the scan's worker threads, so it must not touch the index itself
+# @param Cached = The directory's row in the index, as ( mtime, scanned, files, subdirectories ), or None if it has none
+# @return = A tuple of ( DIRECTORY, mtime, files, subdirectories, listed ). listed is False if the entry in the index was used.
+#           If the directory can't be read, mtime is None, and it is treated as empty
+def ScanDirectory( DIRECTORY, Cached ):
+    try:
+        mtime = os.stat( DIRECTORY ).st_mtime
+    except OSError:
+        return ( DIRECTORY, None, list(), list(), True )
+    if Cached != None and Cached[0] == mtime and mtime < Cached[1] - MTIME_GRANULARITY:
+        return ( DIRECTORY, mtime, Cached[2], Cached[3], False )
+    files = list()
+    subdirectories = list()
+    try:
+        for entry in os.scandir( DIRECTORY ):
+            try:
+                if entry.is_dir( follow_symlinks=False ): # Like os.walk, symbolic links to directories aren't followed
+                    subdirectories.append( entry.name )
+                else:
+                    files.append( entry.name )
+            except OSError:
+                pass # The entry has disappeared since the listing began
+    except OSError:
+        return ( DIRECTORY, None, list(), list(), True )
+    return ( DIRECTORY, mtime, files, subdirectories, True )
+
+# A persistent index of the contents of directory trees
+# @param DATABASE_PATH = The path of the SQLite database. Created if it doesn't exist. Defaults to the path specified in BathyConfig
+# @param Threads = The number of directories listed at once. Defaults to the value specified in BathyConfig
+class FileIndex( object ):
+    def __init__( self, DATABASE_PATH=None, Threads=None ):
+        if DATABASE_PATH == None:
+            DATABASE_PATH = BathyConfig.FILE_INDEX_PATH
+        if Threads == None:
+            Threads = BathyConfig.FILE_SCAN_THREADS
+        self.DatabasePath = DATABASE_PATH
+        self.Threads = Threads
+        self.Connection = sqlite3.connect( DATABASE_PATH, isolation_level=None )
+        self.Connection.execute( "PRAGMA journal_mode=WAL" )
+        self.Connection.execute( "PRAGMA synchronous=NORMAL" )
+        # scanned is the time the directory was last listed. files and subdirectories are the names of its entries, separated by SEPARATOR
+        self.Connection.execute( "CREATE TABLE IF NOT EXISTS directories ( path TEXT PRIMARY KEY, mtime REAL, scanned REAL, files TEXT, subdirectories TEXT )" )
+
+    # Returns the index's rows for a directory and everything under it, keyed by path
+    def LoadTree( self, ROOT ):
+        prefix = os.path.join( ROOT, "" )
+        rows = self.Connection.execute( "SELECT path, mtime, scanned, files, subdirectories FROM directories WHERE path = ? OR substr( path, 1, ? ) = ?",
+                                        ( ROOT, len( prefix ), prefix ) )
+        Tree = dict()
+        for ( path, mtime, scanned, files, subdirectories ) in rows:
+            Tree[ path ] = ( mtime, scanned, SplitNames( files ), SplitNames( subdirectories ) )
+        return Tree
+
+    # Walks a directory tree, listing every directory that has changed since the last scan, and brings the index up to date
+    # @return = A list of the paths of every file in the tree
+    def Scan( self, ROOT ):
+        ROOT = os.path.normpath( ROOT )
+        Tree = self.LoadTree( ROOT )
+        scanned = time.time()
+        Files = list()
+        Listed = list() # The directories whose entries in the index need to be replaced
+        Seen = set()
+        with concurrent.futures.ThreadPoolExecutor( max_workers=self.Threads ) as Executor:
+            Pending = set( [ Executor.submit( ScanDirectory, ROOT, Tree.get( ROOT ) ) ] )
+            while len( Pending ) > 0:
+                ( Done, Pending ) = concurrent.futures.wait( Pending, return_when=concurrent.futures.FIRST_COMPLETED )
+                for future in Done:
+                    ( DIRECTORY, mtime, files, subdirectories, listed ) = future.result()
+                    Seen.add( DIRECTORY )
+                    if listed == True and mtime != None:
+                        Listed.append( ( DIRECTORY, mtime, scanned, SEPARATOR.join( files ), SEPARATOR.join( subdirectories ) ) )
+                    for name in files:
+                        Files.append( os.path.join( DIRECTORY, name ) )
+                    for name in subdirectories:
+                        SUBDIRECTORY = os.path.join( DIRECTORY, name )
+                        Pending.add( Executor.submit( ScanDirectory, SUBDIRECTORY, Tree.get( SUBDIRECTORY ) ) )
+
+        # The index is updated in a single transaction. Directories which have been removed are dropped from it
+        self.Connection.execute( "BEGIN" )
+        try:
+            self.Connection.executemany( "INSERT OR REPLACE INTO directories VALUES ( ?, ?, ?, ?, ? )", Listed )
+            self.Connection.executemany( "DELETE FROM directories WHERE path = ?", [ ( path, ) for path in Tree if path not in Seen ] )
+            self.Connection.execute( "COMMIT" )
+        except:
+            self.Connection.execute( "ROLLBACK" )
+            raise
+        return Files
+
+    def Close( self ):
+        self.Connection.close()
+
+# Splits a column of names from the index back into a list
+def SplitNames( NAMES ):
+    if NAMES == "":
+        return list()
+    return NAMES.split( SEPARATOR )
+
+# Returns the paths of every file in a directory tree with one of the given extensions
+# @param ext = An extension, or a list of extensions, to look for. If None, every file is returned
+# @param UseIndex = If True, the scan is sped up by the persistent index. Defaults to the value specified in BathyConfig
+def FindFiles( ROOT, ext=None, UseIndex=None ):
+    if UseIndex == None:
+        UseIndex = BathyConfig.USE_FILE_INDEX
+    if UseIndex == True:
+        Index = FileIndex()
+    else:
+        Index = FileIndex( ":memory:" ) # Nothing to remember, so every directory is listed
+    try:
+        Files = Index.Scan( ROOT )
+    finally:
+        Index.Close()
+    Files.sort() # Directories are listed in whatever order the threads finish them
+    if ext == None:
+        return Files
+    if isinstance( ext, str ):
+        ext = [ ext ]
+    ext = set( ext )
+    return [ FILE for FILE in Files if os.path.splitext( FILE )[1] in ext ]
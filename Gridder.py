@@ -0,0 +1,214 @@
+# Gridder
+# Bins points into a grid of square cells, and keeps the count, mean, standard deviation, minimum and maximum depth of every cell.
+# Points are binned a block at a time with scatter-adds (np.bincount), so a file of any size is gridded in bounded memory.
+# Cells are counted from the origin of the coordinate system, so the grids of separate files always line up, and any number of them can be merged
+# into a single surface. Statistics are merged exactly: the mean and sum of squared deviations of each cell are combined the way parallel
+# variance is (Chan et al.), rather than from raw sums of squares, which lose precision for deep, tightly clustered cells.
+
+import os
+import numpy as np
+import BathyConfig
+import Checkpoint
+import OSToolbox
+import PointIO
+import Progress
+
+EXTENSION = ".npz"
+
+# A grid of cell statistics: the count, mean, m2 (sum of squared deviations from the mean), min and max of every cell. Row r and column c cover the cell [ ( COLUMN + c ) * CELL_SIZE, ( COLUMN + c + 1 ) * CELL_SIZE ) in x,
+# and [ ( ROW + r ) * CELL_SIZE, ( ROW + r + 1 ) * CELL_SIZE ) in y. Rows run from south to north
+# @param CELL_SIZE = The width of each cell. Expressed in the units of the points' coordinate system
+# @param COLUMN, ROW = The column and row of the grid's first cell, counted from the origin of the coordinate system
+# @param WIDTH, HEIGHT = The number of columns and rows in the grid
+# @param CRS = The well-known text of the points' coordinate system
+class Grid( object ):
+    def __init__( self, CELL_SIZE, COLUMN=0, ROW=0, WIDTH=0, HEIGHT=0, CRS="" ):
+        self.CellSize = float( CELL_SIZE )
+        self.Column = int( COLUMN )
+        self.Row = int( ROW )
+        self.CRS = CRS
+        shape = ( int( HEIGHT ), int( WIDTH ) )
+        self.Count = np.zeros( shape, dtype=np.int64 )
+        self.Mean = np.zeros( shape, dtype=np.float64 )
+        self.M2 = np.zeros( shape, dtype=np.float64 )
+        self.Min = np.full( shape, np.inf )
+        self.Max = np.full( shape, -np.inf )
+
+    @property
+    def Width( self ):
+        return self.Count.shape[1]
+
+    @property
+    def Height( self ):
+        return self.Count.shape[0]
+
+    # Returns the area the grid covers, as ( xmin, ymin, xmax, ymax )
+    def Extent( self ):
+        return ( self.Column * self.CellSize, self.Row * self.CellSize,
+                 ( self.Column + self.Width ) * self.CellSize, ( self.Row + self.Height ) * self.CellSize )
+
+    # Calculates the column and row of the cell every point falls in, counted from the origin of the coordinate system
+    # @return = A tuple of ( columns, rows ) integer arrays
+    def Cells( self, x, y ):
+        columns = np.floor( np.asarray( x, dtype=np.float64 ) / self.CellSize ).astype( np.int64 )
+        rows = np.floor( np.asarray( y, dtype=np.float64 ) / self.CellSize ).astype( np.int64 )
+        return ( columns, rows )
+
+    # Grows the grid so that it covers the given block of cells as well as its own. Cells already in the grid keep their statistics
+    # @param GROW = If True, the grid grows by at least its own width or height on every side it has to grow on, so that a grid built up a block
+    #               at a time is only reallocated a handful of times, rather than for every block. The empty margins this leaves are cut off by Trim
+    def Extend( self, COLUMN, ROW, WIDTH, HEIGHT, GROW=False ):
+        if self.Count.size == 0:
+            ( first, last ) = ( ( COLUMN, ROW ), ( COLUMN + WIDTH, ROW + HEIGHT ) )
+        else:
+            first = ( min( self.Column, COLUMN ), min( self.Row, ROW ) )
+            last = ( max( self.Column + self.Width, COLUMN + WIDTH ), max( self.Row + self.Height, ROW + HEIGHT ) )
+        if first == ( self.Column, self.Row ) and last == ( self.Column + self.Width, self.Row + self.Height ):
+            return
+        if GROW == True and self.Count.size > 0:
+            if first[0] < self.Column:
+                first = ( min( first[0], self.Column - self.Width ), first[1] )
+            if first[1] < self.Row:
+                first = ( first[0], min( first[1], self.Row - self.Height ) )
+            if last[0] > self.Column + self.Width:
+                last = ( max( last[0], self.Column + 2 * self.Width ), last[1] )
+            if last[1] > self.Row + self.Height:
+                last = ( last[0], max( last[1], self.Row + 2 * self.Height ) )
+        grown = Grid( self.CellSize, first[0], first[1], last[0] - first[0], last[1] - first[1], self.CRS )
+        block = grown.Block( self.Column, self.Row, self.Width, self.Height )
+        for ( name, values ) in self.Block( self.Column, self.Row, self.Width, self.Height ).items():
+            block[ name ][:] = values
+        ( self.Count, self.Mean, self.M2, self.Min, self.Max ) = ( grown.Count, grown.Mean, grown.M2, grown.Min, grown.Max )
+        ( self.Column, self.Row ) = first
+
+    # Shrinks the grid to the smallest block of cells which holds all of its points, cutting off the empty margins left by Extend( GROW=True ).
+    # Grids built from points never have empty margins otherwise, so a trimmed grid is the same as one built to size. Empty grids are left as they are
+    def Trim( self ):
+        rows = np.flatnonzero( self.Count.any( axis=1 ) )
+        columns = np.flatnonzero( self.Count.any( axis=0 ) )
+        if len( rows ) == 0 or ( len( rows ) == self.Height and len( columns ) == self.Width ):
+            return
+        ( COLUMN, ROW ) = ( self.Column + int( columns[0] ), self.Row + int( rows[0] ) )
+        block = self.Block( COLUMN, ROW, int( columns[-1] - columns[0] ) + 1, int( rows[-1] - rows[0] ) + 1 )
+        ( self.Count, self.Mean, self.M2, self.Min, self.Max ) = ( block[ "count" ].copy(), block[ "mean" ].copy(), block[ "m2" ].copy(),
+                                                                 block[ "min" ].copy(), block[ "max" ].copy() )
+        ( self.Column, self.Row ) = ( COLUMN, ROW )
+
+    # Returns views of the statistics of a block of cells within the grid, keyed by statistic
+    def Block( self, COLUMN, ROW, WIDTH, HEIGHT ):
+        rows = slice( ROW - self.Row, ROW - self.Row + HEIGHT )
+        columns = slice( COLUMN - self.Column, COLUMN - self.Column + WIDTH )
+        return { "count": self.Count[ rows, columns ], "mean": self.Mean[ rows, columns ], "m2": self.M2[ rows, columns ],
+                 "min": self.Min[ rows, columns ], "max": self.Max[ rows, columns ] }
+
+    # Merges another grid into this one. Afterwards, every cell holds the statistics of the points of both grids
+    # @param GROW = Passed on to Extend. For merging many grids in turn
+    def Merge( self, other, GROW=False ):
+        if other.CellSize != self.CellSize:
+            raise ValueError( "Can't merge a grid of %s cells into a grid of %s cells." % ( other.CellSize, self.CellSize ) )
+        if other.Count.size == 0:
+            return
+        self.Extend( other.Column, other.Row, other.Width, other.Height, GROW )
+        block = self.Block( other.Column, other.Row, other.Width, other.Height )
+        countA = block[ "count" ]
+        countB = other.Count
+        total = countA + countB
+        occupied = total > 0
+        weight = np.zeros( total.shape )
+        weight[ occupied ] = countB[ occupied ] / total[ occupied ].astype( np.float64 ) # The share of each cell's points that come from other
+        delta = other.Mean - block[ "mean" ]
+        block[ "mean" ] += delta * weight
+        block[ "m2" ] += other.M2 + delta * delta * countA * weight
+        block[ "count" ] += countB
+        np.minimum( block[ "min" ], other.Min, out=block[ "min" ] )
+        np.maximum( block[ "max" ], other.Max, out=block[ "max" ] )
+
+    # Bins a block of points into the grid. The grid grows geometrically to take them (see Extend), so call Trim once the last block is in
+    def Accumulate( self, x, y, z ):
+        self.Merge( GridPoints( x, y, z, self.CellSize, self.CRS ), GROW=True )
+
+    # Returns the per-cell statistics, as float arrays. Cells with no points in them are NaN (except for count, which is 0)
+    # @return = A dict of the count, mean, std (the population standard deviation), min and max of every cell
+    def Statistics( self ):
+        self.Trim()
+        empty = self.Count == 0
+        Statistics = { "count": self.Count.copy() }
+        with np.errstate( invalid="ignore", divide="ignore" ):
+            Statistics[ "std" ] = np.sqrt( np.maximum( self.M2, 0 ) / self.Count )
+        for ( name, values ) in [ ( "mean", self.Mean ), ( "min", self.Min ), ( "max", self.Max ), ( "std", Statistics[ "std" ] ) ]:
+            values = values.copy()
+            values[ empty ] = np.nan
+            Statistics[ name ] = values
+        return Statistics
+
+    # Saves the grid to a compressed .npz file. Everything needed to merge it into another grid is kept.
+    # The file is written under a temporary name, and renamed once complete
+    # @return = The path of the file
+    def Save( self, FILE_PATH ):
+        self.Trim()
+        PARTIAL_PATH = Checkpoint.PartialPath( FILE_PATH )
+        with open( PARTIAL_PATH, "wb" ) as f: # Written through a file object, which stops NumPy from adding an extension of its own
+            np.savez_compressed( f, cell_size=self.CellSize, origin=np.array( [ self.Column, self.Row ], dtype=np.int64 ),
+                                 crs=np.array( self.CRS ), count=self.Count, mean=self.Mean, m2=self.M2, min=self.Min, max=self.Max )
+        return Checkpoint.Commit( PARTIAL_PATH, FILE_PATH )
+
+# Bins an array of points into a new grid, which covers just the cells the points fall in
+# @param CELL_SIZE = The width of each cell
+# @return = The Grid
+def GridPoints( x, y, z, CELL_SIZE, CRS="" ):
+    grid = Grid( CELL_SIZE, CRS=CRS )
+    if len( z ) == 0:
+        return grid
+    ( columns, rows ) = grid.Cells( x, y )
+    ( COLUMN, ROW ) = ( int( columns.min() ), int( rows.min() ) )
+    ( WIDTH, HEIGHT ) = ( int( columns.max() ) - COLUMN + 1, int( rows.max() ) - ROW + 1 )
+    grid = Grid( CELL_SIZE, COLUMN, ROW, WIDTH, HEIGHT, CRS )
+    cells = ( rows - ROW ) * WIDTH + ( columns - COLUMN ) # The flat index of every point's cell
+    z = np.asarray( z, dtype=np.float64 )
+
+    counts = np.bincount( cells, minlength=WIDTH * HEIGHT )
+    sums = np.bincount( cells, weights=z, minlength=WIDTH * HEIGHT )
+    means = np.zeros( WIDTH * HEIGHT )
+    occupied = counts > 0
+    means[ occupied ] = sums[ occupied ] / counts[ occupied ]
+    deviations = z - means[ cells ]
+    grid.Count[:] = counts.reshape( HEIGHT, WIDTH )
+    grid.Mean[:] = means.reshape( HEIGHT, WIDTH )
+    grid.M2[:] = np.bincount( cells, weights=deviations * deviations, minlength=WIDTH * HEIGHT ).reshape( HEIGHT, WIDTH )
+    np.minimum.at( grid.Min.reshape( -1 ), cells, z )
+    np.maximum.at( grid.Max.reshape( -1 ), cells, z )
+    return grid
+
+# Loads a grid saved by Grid.Save
+def LoadGrid( FILE_PATH ):
+    with np.load( FILE_PATH ) as Arrays:
+        grid = Grid( float( Arrays[ "cell_size" ] ), Arrays[ "origin" ][0], Arrays[ "origin" ][1], CRS=str( Arrays[ "crs" ] ) )
+        ( grid.Count, grid.Mean, grid.M2, grid.Min, grid.Max ) = ( Arrays[ "count" ], Arrays[ "mean" ], Arrays[ "m2" ], Arrays[ "min" ], Arrays[ "max" ] )
+    return grid
+
+# Grids the points of a file, one block at a time, and saves the grid to OUT_DIRECTORY with the same name as the input
+# @param CELL_SIZE = The width of each cell. Defaults to the value specified in BathyConfig
+# @return = The path of the grid file
+def GridFile( FILE_PATH, OUT_DIRECTORY, CELL_SIZE=None ):
+    if CELL_SIZE == None:
+        CELL_SIZE = BathyConfig.GRID_CELL_SIZE
+    ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = OSToolbox.SplitFilePath( FILE_PATH )
+    grid = Grid( CELL_SIZE, CRS=PointIO.ReadCRS( FILE_PATH ) )
+    for ( x, y, z, badLines ) in PointIO.IterPointBlocks( FILE_PATH ):
+        grid.Accumulate( x, y, z )
+        Progress.Advance( len( z ) )
+    return grid.Save( os.path.join( OUT_DIRECTORY, FILE_NAME + EXTENSION ) )
+
+# Merges the grids saved in a number of files into a single grid, and saves it
+# @return = The path of the merged grid file
+def MergeGridFiles( FILE_PATHS, OUT_FILE ):
+    merged = None
+    for FILE_PATH in FILE_PATHS:
+        grid = LoadGrid( FILE_PATH )
+        if merged == None:
+            merged = grid
+        else:
+            merged.Merge( grid, GROW=True )
+    if merged == None:
+        merged = Grid( BathyConfig.GRID_CELL_SIZE )
+    return merged.Save( OUT_FILE )
@@ -0,0 +1,141 @@
+# Manifest
+# A durable record of which files have been through which pipeline stages, kept in a SQLite database.
+# Each input is keyed by its path, and remembered along with its size, modification time and content hash, so that checking whether a file
+# has already been processed is a single lookup rather than a scan of the output directories.
+# Stages are marked as started before they run and complete after, so that work interrupted by an improper shutdown can be found, and either
+# resumed from its last checkpoint (see Checkpoint) or redone.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import BathyConfig
+import Checkpoint
+
+# The number of bytes hashed at a time
+HASH_BLOCK_SIZE = 1024 * 1024
+
+STARTED = "started"
+COMPLETE = "complete"
+
+# Calculates the SHA-1 hash of a file's contents, reading it one block at a time
+# @return = The hash, as a hex string
+def FileContentHash( FILE_PATH ):
+    digest = hashlib.sha1()
+    with open( FILE_PATH, "rb" ) as f:
+        while True:
+            block = f.read( HASH_BLOCK_SIZE )
+            if not block:
+                break
+            digest.update( block )
+    return digest.hexdigest()
+
+# Wraps the manifest database. Safe to share between the threads of a single process
+# @param DATABASE_PATH = The path of the SQLite database. Created if it doesn't exist. Defaults to the path specified in BathyConfig
+class ProcessingManifest( object ):
+    def __init__( self, DATABASE_PATH=None ):
+        if DATABASE_PATH == None:
+            DATABASE_PATH = BathyConfig.MANIFEST_PATH
+        self.DatabasePath = DATABASE_PATH
+        self.Lock = threading.RLock() # Only one thread may use the connection at a time
+        self.Connection = sqlite3.connect( DATABASE_PATH, check_same_thread=False, isolation_level=None )
+        self.Connection.execute( "PRAGMA journal_mode=WAL" )
+        self.Connection.execute( "PRAGMA synchronous=NORMAL" )
+        # The size, modification time and content hash of every file seen so far. Lets a hash be reused until the file changes
+        self.Connection.execute( "CREATE TABLE IF NOT EXISTS files ( path TEXT PRIMARY KEY, size INTEGER, mtime REAL, content_hash TEXT )" )
+        # The state of every ( input, stage ) pair. out_directory is where a started stage is writing, output_path what a complete stage wrote
+        self.Connection.execute( "CREATE TABLE IF NOT EXISTS stages ( input_path TEXT, stage TEXT, size INTEGER, mtime REAL, content_hash TEXT, "
+                                 "status TEXT, out_directory TEXT, output_path TEXT, updated REAL, PRIMARY KEY ( input_path, stage ) )" )
+
+    # Returns the content hash of a file. Only rehashes the file if its size or modification time have changed since it was last hashed
+    def ContentHash( self, FILE_PATH ):
+        stat = os.stat( FILE_PATH )
+        with self.Lock:
+            row = self.Connection.execute( "SELECT size, mtime, content_hash FROM files WHERE path = ?", ( FILE_PATH, ) ).fetchone()
+        if row != None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+        contentHash = FileContentHash( FILE_PATH )
+        with self.Lock:
+            self.Connection.execute( "INSERT OR REPLACE INTO files VALUES ( ?, ?, ?, ? )", ( FILE_PATH, stat.st_size, stat.st_mtime, contentHash ) )
+        return contentHash
+
+    # Returns the output a stage produced for a file, or None if the stage hasn't completed for the file as it is now.
+    # If the file's size or modification time have changed, it only counts as processed if its contents are unchanged
+    def GetCompletedOutput( self, FILE_PATH, STAGE ):
+        with self.Lock:
+            row = self.Connection.execute( "SELECT size, mtime, content_hash, output_path FROM stages WHERE input_path = ? AND stage = ? AND status = ?",
+                                           ( FILE_PATH, STAGE, COMPLETE ) ).fetchone()
+        if row == None or os.path.exists( row[3] ) == False:
+            return None
+        stat = os.stat( FILE_PATH )
+        if row[0] != stat.st_size or ( row[1] != stat.st_mtime and row[2] != self.ContentHash( FILE_PATH ) ):
+            return None
+        return row[3]
+
+    # Records that a stage has started on a file, and which directory it is writing its output to
+    def MarkStarted( self, FILE_PATH, STAGE, OUT_DIRECTORY ):
+        with self.Lock:
+            self.Connection.execute( "INSERT OR REPLACE INTO stages VALUES ( ?, ?, NULL, NULL, NULL, ?, ?, NULL, ? )",
+                                     ( FILE_PATH, STAGE, STARTED, OUT_DIRECTORY, time.time() ) )
+
+    # Records that a stage has finished with a file, and where its output is
+    def MarkComplete( self, FILE_PATH, STAGE, OUTPUT_PATH ):
+        stat = os.stat( FILE_PATH )
+        contentHash = self.ContentHash( FILE_PATH )
+        with self.Lock:
+            self.Connection.execute( "INSERT OR REPLACE INTO stages VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ? )",
+                                     ( FILE_PATH, STAGE, stat.st_size, stat.st_mtime, contentHash, COMPLETE, os.path.dirname( OUTPUT_PATH ), OUTPUT_PATH, time.time() ) )
+
+    # Forgets a stage's record for a file, so that the file is processed again
+    def Forget( self, FILE_PATH, STAGE ):
+        with self.Lock:
+            self.Connection.execute( "DELETE FROM stages WHERE input_path = ? AND stage = ?", ( FILE_PATH, STAGE ) )
+
+    # Returns a list of ( input_path, stage, out_directory, started ) for every stage which was started but never completed
+    def GetIncompleteEntries( self ):
+        with self.Lock:
+            return self.Connection.execute( "SELECT input_path, stage, out_directory, updated FROM stages WHERE status = ?", ( STARTED, ) ).fetchall()
+
+    # Returns the directory a stage was writing a file's output to when it was interrupted, so that it can carry on there from its checkpoint.
+    # None if the stage wasn't interrupted while processing the file, or the directory is gone
+    def GetInterruptedDirectory( self, FILE_PATH, STAGE ):
+        with self.Lock:
+            row = self.Connection.execute( "SELECT out_directory FROM stages WHERE input_path = ? AND stage = ? AND status = ?",
+                                           ( FILE_PATH, STAGE, STARTED ) ).fetchone()
+        if row == None or row[0] == None or os.path.isdir( row[0] ) == False:
+            return None
+        return row[0]
+
+    # Cleans up after an improper shutdown. For every stage that was started but never completed, deletes the temporary files it left
+    # behind, and forgets the stage so that the file is processed again. Outputs whose checkpoints were saved for the stage's input are kept,
+    # with all of their temporary files, along with the stage's record of where it was writing them, so that the stage carries on from the
+    # last checkpoint instead. Outputs are only ever given their real names once complete (see Checkpoint), so only temporary files are
+    # removed, and the complete outputs of other files in the same directory are never touched
+    def RecoverIncompleteEntries( self ):
+        Entries = list()
+        Resumable = dict() # The outputs which will be resumed, by directory
+        for ( FILE_PATH, STAGE, OUT_DIRECTORY, STARTED_AT ) in self.GetIncompleteEntries():
+            if OUT_DIRECTORY == None or os.path.isdir( OUT_DIRECTORY ) == False:
+                self.Forget( FILE_PATH, STAGE )
+                continue
+            Outputs = Checkpoint.FindCheckpointed( OUT_DIRECTORY, FILE_PATH )
+            Resumable.setdefault( OUT_DIRECTORY, list() ).extend( Outputs )
+            Entries.append( ( FILE_PATH, STAGE, OUT_DIRECTORY, STARTED_AT, Outputs ) )
+        for ( FILE_PATH, STAGE, OUT_DIRECTORY, STARTED_AT, Outputs ) in Entries:
+            if len( Outputs ) > 0:
+                BathyConfig.ConditionalPrint( "%s was interrupted while processing %s. It will carry on from its last checkpoint.", ( STAGE, FILE_PATH ) )
+            else:
+                BathyConfig.ConditionalPrint( "%s was interrupted while processing %s. Removing its partial output.", ( STAGE, FILE_PATH ) )
+            for file in os.listdir( OUT_DIRECTORY ):
+                path = os.path.join( OUT_DIRECTORY, file )
+                if Checkpoint.IsTemporary( path ) == False or os.path.exists( path ) == False or os.path.getmtime( path ) < STARTED_AT:
+                    continue
+                if any( [ Checkpoint.IsTemporaryFileOf( path, output ) for output in Resumable[ OUT_DIRECTORY ] ] ) == False:
+                    Checkpoint.Remove( path )
+            if len( Outputs ) == 0:
+                self.Forget( FILE_PATH, STAGE )
+
+    def Close( self ):
+        with self.Lock:
+            self.Connection.close()
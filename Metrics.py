@@ -0,0 +1,174 @@
+# Metrics
+# Structured measurements of the work each pipeline stage does on each file: wall and CPU time, points in and out (and so the points each
+# filter rejects), bytes read and written, peak memory, and how long the file waited in the queue in front of the stage.
+# Every measurement is a record, handed to one or more sinks: a JSON-lines file, for looking at afterwards, and in-process counters, for a
+# summary at the end of the run. Any stage can also be run under cProfile.
+
+import cProfile
+import io
+import json
+import os
+import sys
+import threading
+import time
+import BathyConfig
+import PointIO
+import ResultCache
+
+# Returns the peak resident memory of this process so far, in bytes, or None if it can't be measured on this platform.
+# On Linux, the peak is read from /proc, because getrusage carries the peak of the parent process over into its children
+def PeakRSS():
+    if os.path.exists( "/proc/self/status" ):
+        with io.open( "/proc/self/status", "r" ) as f:
+            for line in f:
+                if line.startswith( "VmHWM:" ):
+                    return int( line.split()[1] ) * 1024 # Reported in kilobytes
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource != None:
+        peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024 # Reported in kilobytes everywhere but macOS
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr( info, "peak_wset", info.rss )
+
+# Returns the total size of a file, and of any files which go along with it (such as the parts of a shapefile)
+def FileBytes( FILE_PATH ):
+    return sum( [ os.path.getsize( path ) for path in ResultCache.OutputFiles( FILE_PATH ) ] )
+
+# Counts the points in a file, if it records its count. Text files would have to be read through, so their points aren't counted
+def RecordedPointCount( FILE_PATH ):
+    if PointIO.IsTile( FILE_PATH ) or PointIO.IsShapefile( FILE_PATH ):
+        return PointIO.CountPoints( FILE_PATH )
+    return None
+
+# Calls a stage's function, and measures it. Runs wherever the function runs, so that CPU time and memory are those of the worker doing the work.
+# Lives at module level so that it can be sent to pool processes
+# @param Arguments = The stage function's arguments, ( File, OUT_DIRECTORY )
+# @param PROFILE_DIRECTORY = If given, the call runs under cProfile, and its stats are saved to this directory
+# @return = A tuple of ( result, Measurements ), where Measurements is a dict
+def MeasuredCall( Function, Arguments, STAGE, PROFILE_DIRECTORY=None ):
+    ( File, OUT_DIRECTORY ) = Arguments
+    Measurements = { "points_in": RecordedPointCount( File ), "bytes_read": FileBytes( File ) }
+    Profile = None
+    if PROFILE_DIRECTORY != None:
+        if os.path.isdir( PROFILE_DIRECTORY ) == False:
+            os.makedirs( PROFILE_DIRECTORY, exist_ok=True ) # Several workers may get here at once
+        Profile = cProfile.Profile()
+    wallTime = time.perf_counter()
+    cpuTime = time.thread_time() # Only this thread's time, so tasks running alongside on other threads aren't counted
+    if Profile != None:
+        Profile.enable()
+    try:
+        result = Function( *Arguments )
+    finally:
+        if Profile != None:
+            Profile.disable()
+            Profile.dump_stats( os.path.join( PROFILE_DIRECTORY, "%s_%s_%s.prof" % ( STAGE, os.path.basename( File ), os.getpid() ) ) )
+    Measurements[ "cpu_seconds" ] = time.thread_time() - cpuTime
+    Measurements[ "wall_seconds" ] = time.perf_counter() - wallTime
+    Measurements[ "points_out" ] = RecordedPointCount( result )
+    Measurements[ "bytes_written" ] = FileBytes( result )
+    if Measurements[ "points_in" ] != None and Measurements[ "points_out" ] != None:
+        Measurements[ "points_rejected" ] = Measurements[ "points_in" ] - Measurements[ "points_out" ]
+    Measurements[ "peak_rss_bytes" ] = PeakRSS() # The high-water mark of the worker process, which may have done other work before this
+    Measurements[ "pid" ] = os.getpid()
+    return ( result, Measurements )
+
+# Writes every record as a line of JSON, appended to a file
+class JSONLinesSink( object ):
+    def __init__( self, FILE_PATH ):
+        self.FilePath = FILE_PATH
+        self.File = io.open( FILE_PATH, "a", encoding="utf-8" )
+        self.Lock = threading.RLock() # Only one thread may write a line at a time
+
+    def Write( self, Record ):
+        line = json.dumps( Record, sort_keys=True ) + "\n"
+        with self.Lock:
+            self.File.write( line )
+            self.File.flush()
+
+    def Close( self ):
+        with self.Lock:
+            self.File.close()
+
+# The measurements which CounterSink adds up for every stage
+SUMMED = [ "wall_seconds", "cpu_seconds", "queue_wait_seconds", "points_in", "points_out", "points_rejected", "bytes_read", "bytes_written" ]
+
+# Keeps running totals of the records of every stage, in memory
+class CounterSink( object ):
+    def __init__( self ):
+        self.Counters = dict() # Maps each stage to a dict of its totals
+        self.Lock = threading.RLock()
+
+    def Write( self, Record ):
+        with self.Lock:
+            Counters = self.Counters.setdefault( Record[ "stage" ], dict( [ ( name, 0 ) for name in SUMMED + [ "files", "cached", "failed" ] ] + [ ( "peak_rss_bytes", None ) ] ) )
+            Counters[ "files" ] += 1
+            if Record.get( "cached" ) == True:
+                Counters[ "cached" ] += 1
+            if Record.get( "error" ) != None:
+                Counters[ "failed" ] += 1
+            for name in SUMMED:
+                if Record.get( name ) != None:
+                    Counters[ name ] += Record[ name ]
+            if Record.get( "peak_rss_bytes" ) != None:
+                Counters[ "peak_rss_bytes" ] = max( Counters[ "peak_rss_bytes" ] or 0, Record[ "peak_rss_bytes" ] )
+
+    # Returns a copy of the totals, keyed by stage
+    def Summary( self ):
+        with self.Lock:
+            return dict( [ ( stage, dict( Counters ) ) for ( stage, Counters ) in self.Counters.items() ] )
+
+    # Prints a table of the totals of every stage. The stage which spent the longest working is the bottleneck
+    def Report( self ):
+        Summary = self.Summary()
+        print( "%-12s %7s %7s %7s %10s %10s %10s %14s %14s %10s" % ( "Stage", "Files", "Cached", "Failed", "Wall (s)", "CPU (s)", "Queued (s)",
+                                                                       "Points in", "Rejected", "Peak MB" ) )
+        for ( stage, Counters ) in Summary.items():
+            print( "%-12s %7s %7s %7s %10.1f %10.1f %10.1f %14s %14s %10s" % ( stage, Counters[ "files" ], Counters[ "cached" ], Counters[ "failed" ],
+                   Counters[ "wall_seconds" ], Counters[ "cpu_seconds" ], Counters[ "queue_wait_seconds" ], Counters[ "points_in" ], Counters[ "points_rejected" ],
+                   None if Counters[ "peak_rss_bytes" ] == None else Counters[ "peak_rss_bytes" ] // ( 1024 * 1024 ) ) )
+        if len( Summary ) > 0:
+            print( "Bottleneck: %s" % max( Summary, key=lambda stage: Summary[ stage ][ "wall_seconds" ] ) )
+
+    def Close( self ):
+        pass
+
+# Hands every record to each of a number of sinks
+# @param Sinks = The sinks. Anything with Write( Record ) and Close() methods will do
+class MetricsRecorder( object ):
+    def __init__( self, Sinks ):
+        self.Sinks = Sinks
+
+    # Records a measurement. Every record has at least a stage and a file
+    def Record( self, STAGE, File, **Fields ):
+        Record = dict( Fields )
+        Record[ "stage" ] = STAGE
+        Record[ "file" ] = File
+        Record[ "time" ] = time.time()
+        for Sink in self.Sinks:
+            Sink.Write( Record )
+
+    # Returns the first of the sinks which is a CounterSink, or None
+    def GetCounters( self ):
+        for Sink in self.Sinks:
+            if isinstance( Sink, CounterSink ):
+                return Sink
+        return None
+
+    def Close( self ):
+        for Sink in self.Sinks:
+            Sink.Close()
+
+# Creates a recorder with the sinks specified in BathyConfig: always in-process counters, and a JSON-lines file if one is given
+def CreateRecorder():
+    Sinks = [ CounterSink() ]
+    if BathyConfig.METRICS_PATH != None:
+        Sinks.append( JSONLinesSink( BathyConfig.METRICS_PATH ) )
+    return MetricsRecorder( Sinks )
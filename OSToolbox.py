@@ -2,21 +2,35 @@
 # Author: Tristan Sebens
 # Contact: tristan.ng.sebens@gmail.com
 
+import importlib
 import os
+import FileIndex
 
 # Method that walks through a file tree recursively, looking for files with the specified extension.
 # It then returns a list containing all files which mached the specified extension
 # @param root = The root of the file tree to search through
 # @param ext = The extension to look for
 def FindFilesByExtension( root, ext ):
-    AllFiles = os.walk( root, True, None, False )
-    ReturnFiles = list()
+    return FileIndex.FindFiles( root, ext )
 
-    for entry in AllFiles:
-        # entry is a tuple containing (path, directories, files)
-        for file in entry[2]:
-            ( layername, extension ) = os.path.splitext( file )
-            if extension == ext:
-                ReturnFiles.append( os.path.join( entry[0], file ) )
+# Helper function that takes in a filepath, and returns a list containing three items:
+# 0: The directory of the file
+# 1: The name of the file
+# 2: The extension of the file
+def SplitFilePath( INPUT ):
+    ( INPUT_DIRECTORY, FILE ) = INPUT.rsplit( os.sep, 1 ) # Split the input path into the filename, and the file's directory
+    ( FILE_NAME, EXTENSION ) = os.path.splitext( FILE )
+    return ( INPUT_DIRECTORY, FILE_NAME, EXTENSION )
 
-    return ReturnFiles
+# Stands in for a module which is only imported the first time one of its attributes is used. Lets modules which only sometimes need a heavy
+# dependency (such as arcpy, which loads ArcGIS) be imported without it
+# @param NAME = The name of the module
+class LazyImport( object ):
+    def __init__( self, NAME ):
+        self.Name = NAME
+        self.Module = None
+
+    def __getattr__( self, name ):
+        if self.__dict__.get( "Module" ) == None:
+            self.Module = importlib.import_module( self.__dict__[ "Name" ] )
+        return getattr( self.Module, name )
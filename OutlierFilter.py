@@ -0,0 +1,274 @@
+# OutlierFilter
+# Neighborhood-based outlier detection over point arrays, in place of arcpy.HotSpots_stats. Computes a Getis-Ord Gi* score for every point
+# from its neighbors within a fixed radius, bins the scores the way ArcGIS does (Gi_Bin), and keeps the points at or above MIN_BIN_SCORE.
+# Points are hashed into a uniform grid of cells one radius wide, so each point is only compared against the points in the 3x3 block of
+# cells around it. Hashing is a sort, so the whole analysis scales as O(n log n) rather than O(n^2).
+# Large datasets can be split into square tiles, each carrying a halo of neighboring points one radius wide. Every tile's neighbors are searched
+# on their own, and the results are stitched back together identically to analyzing the whole dataset at once.
+
+import os
+import numpy as np
+import BathyConfig
+import OSToolbox
+import PointIO
+import Precision
+import Progress
+
+# The most candidate neighbor pairs gathered from a single neighboring cell at a time. Each pair takes several int64 and float64 temporaries
+# (around 80 bytes), so this bounds the memory used to compare points against their neighbors however densely they are packed. Points are
+# batched by the size of the largest cell around them, so a single point whose cell alone holds more is still taken on its own
+PAIR_BATCH_SIZE = 256 * 1024
+
+# The |Gi*| thresholds for the 90%, 95% and 99% confidence levels. A point's Gi_Bin is +/-1, 2 or 3 for the highest level it reaches, and 0 otherwise
+GI_BIN_THRESHOLDS = ( 1.645, 1.960, 2.576 )
+
+# The offsets of the 3x3 block of cells around (and including) a point's own cell. Always visited in this order
+NEIGHBOR_CELL_OFFSETS = [ ( dx, dy ) for dx in ( -1, 0, 1 ) for dy in ( -1, 0, 1 ) ]
+
+# Calculates the grid cell of every point. Cells are RADIUS wide, and counted from ORIGIN
+# @return = A tuple of ( ix, iy ) integer arrays
+def GridCells( x, y, RADIUS, ORIGIN ):
+    ix = np.floor( ( np.asarray( x, dtype=np.float64 ) - ORIGIN[0] ) / RADIUS ).astype( np.int64 )
+    iy = np.floor( ( np.asarray( y, dtype=np.float64 ) - ORIGIN[1] ) / RADIUS ).astype( np.int64 )
+    return ( ix, iy )
+
+# Looks up cells by key among the occupied ones
+# @return = A tuple of ( slot, found ), where slot is the position of each key in cellKeys, and found is False for keys of empty cells
+def FindCells( cellKeys, KEYS ):
+    slot = np.minimum( np.searchsorted( cellKeys, KEYS ), len( cellKeys ) - 1 )
+    return ( slot, cellKeys[slot] == KEYS )
+
+# For every point, counts the points within RADIUS of it (itself included) and sums their values. x and y may be in any units (e.g. the int32 steps
+# of quantized points), as long as RADIUS is in the same units.
+# Each point's neighbors are always visited in the same order (by cell offset, then by original index), so the sums come out the same
+# for a point no matter which other points are in the arrays alongside it.
+# @param ORIGIN = The ( x, y ) corner the grid is anchored to. Defaults to the minimum x and y of the points
+# @return = A tuple of ( counts, sums ) arrays
+def NeighborSums( x, y, values, RADIUS, ORIGIN=None ):
+    n = len( x )
+    counts = np.zeros( n, dtype=np.int64 )
+    sums = np.zeros( n, dtype=np.float64 )
+    if n == 0:
+        return ( counts, sums )
+    # The points are kept in whatever dtype they come in (see Precision), and only the candidate pairs of each batch are widened to float64
+    ( x, y, values ) = ( np.asarray( x ), np.asarray( y ), np.asarray( values ) )
+    if ORIGIN == None:
+        ORIGIN = ( float( x.min() ), float( y.min() ) )
+
+    # Hash every point into its cell, and sort the points by cell so that each cell's points are contiguous
+    ( ix, iy ) = GridCells( x, y, RADIUS, ORIGIN )
+    ix -= ix.min() - 1 # Shift the cells so that every neighboring cell has a non-negative index as well
+    iy -= iy.min() - 1
+    width = int( iy.max() ) + 2
+    keys = ix * width + iy
+    order = np.argsort( keys, kind="stable" )
+    ( keys, x, y, values ) = ( keys[order], x[order], y[order], values[order] ) # From here on, we work in cell order
+    ( cellKeys, cellStarts, cellCounts ) = np.unique( keys, return_index=True, return_counts=True )
+
+    # The most candidates any cell around each cell holds. Every point of a cell shares it, and running totals of it over the points mark where
+    # each batch has to end
+    largestCell = np.zeros( len( cellKeys ), dtype=np.int64 )
+    for ( dx, dy ) in NEIGHBOR_CELL_OFFSETS:
+        ( slot, found ) = FindCells( cellKeys, cellKeys + ( dx * width + dy ) )
+        np.maximum( largestCell, np.where( found, cellCounts[slot], 0 ), out=largestCell )
+    pairTotals = np.cumsum( np.repeat( largestCell, cellCounts ) )
+
+    RADIUS_SQUARED = float( RADIUS ) * RADIUS
+    sortedCounts = np.zeros( n, dtype=np.int64 )
+    sortedSums = np.zeros( n, dtype=np.float64 )
+    batchStart = 0
+    while batchStart < n:
+        before = int( pairTotals[ batchStart - 1 ] ) if batchStart > 0 else 0
+        batchEnd = max( int( np.searchsorted( pairTotals, before + PAIR_BATCH_SIZE, "right" ) ), batchStart + 1 )
+        batch = np.arange( batchStart, batchEnd )
+        batchStart = batchEnd
+        for ( dx, dy ) in NEIGHBOR_CELL_OFFSETS:
+            ( slot, found ) = FindCells( cellKeys, keys[batch] + ( dx * width + dy ) )
+            starts = cellStarts[ slot[found] ]
+            sizes = cellCounts[ slot[found] ]
+            if len( sizes ) == 0:
+                continue
+
+            # Expand every ( point, neighbor cell ) pair into one candidate pair per point in that cell
+            source = batch[found]
+            firstOfRun = np.cumsum( sizes ) - sizes
+            neighbor = np.arange( int( sizes.sum() ) ) + np.repeat( starts - firstOfRun, sizes )
+
+            dx = np.subtract( np.repeat( x[source], sizes ), x[neighbor], dtype=np.float64 )
+            dy = np.subtract( np.repeat( y[source], sizes ), y[neighbor], dtype=np.float64 )
+            close = np.square( dx ) + np.square( dy ) <= RADIUS_SQUARED
+            closeSource = np.repeat( source - batch[0], sizes )[close]
+            sortedCounts[batch] += np.bincount( closeSource, minlength=len( batch ) )
+            sortedSums[batch] += np.bincount( closeSource, weights=values[ neighbor[close] ], minlength=len( batch ) )
+
+    counts[order] = sortedCounts
+    sums[order] = sortedSums
+    return ( counts, sums )
+
+# Calculates the Getis-Ord Gi* score of every point, using binary weights for every neighbor within RADIUS (the point itself included).
+# Gi* = ( SUM( x_j ) - MEAN * c ) / ( STD_DEV * SQRT( ( n * c - c^2 ) / ( n - 1 ) ) ), where c is the number of neighbors
+# @param Stats = Optional ( n, MEAN, STD_DEV ) of the whole dataset, for when the arrays only hold part of it. Defaults to those of z
+# @param ORIGIN = The ( x, y ) corner the neighbor grid is anchored to
+def CalculateGiStar( x, y, z, RADIUS, Stats=None, ORIGIN=None ):
+    if Stats == None:
+        Stats = ( len( z ), float( np.mean( z, dtype=np.float64 ) ) if len( z ) > 0 else 0.0, float( np.std( z, dtype=np.float64 ) ) if len( z ) > 0 else 0.0 )
+    ( n, MEAN, STD_DEV ) = Stats
+    ( counts, sums ) = NeighborSums( x, y, z, RADIUS, ORIGIN )
+    counts = counts.astype( np.float64 )
+
+    gi = np.zeros( len( z ), dtype=np.float64 )
+    if n < 2 or STD_DEV == 0:
+        return gi
+    denominator = STD_DEV * np.sqrt( np.maximum( n * counts - np.square( counts ), 0.0 ) / ( n - 1 ) )
+    valid = denominator > 0 # A point whose neighborhood is the whole dataset has nothing to be compared against
+    gi[valid] = ( sums[valid] - MEAN * counts[valid] ) / denominator[valid]
+    return gi
+
+# Bins Gi* scores by confidence level, the same way as the Gi_Bin field written by arcpy.HotSpots_stats
+# @return = An int8 array of bins from -3 to 3
+def GiBins( gi ):
+    bins = np.zeros( len( gi ), dtype=np.int8 )
+    magnitude = np.abs( gi )
+    for ( level, threshold ) in enumerate( GI_BIN_THRESHOLDS ):
+        bins[ magnitude >= threshold ] = level + 1
+    return bins * np.sign( gi ).astype( np.int8 )
+
+# Returns a boolean mask which is True for every point whose Gi_Bin is at least MIN_BIN_SCORE
+# @param RADIUS = The neighbor radius. Defaults to the value specified in BathyConfig
+# @param MIN_BIN_SCORE = The minimum Gi_Bin score that will be kept. Defaults to the value specified in BathyConfig
+def OutlierMask( x, y, z, RADIUS=None, MIN_BIN_SCORE=None, Stats=None, ORIGIN=None ):
+    if RADIUS == None:
+        RADIUS = BathyConfig.OUTLIER_NEIGHBOR_RADIUS
+    if MIN_BIN_SCORE == None:
+        MIN_BIN_SCORE = BathyConfig.MIN_BIN_SCORE
+    return GiBins( CalculateGiStar( x, y, z, RADIUS, Stats, ORIGIN ) ) >= int( MIN_BIN_SCORE )
+
+# Partitions points into square tiles TILE_SIZE wide, anchored at ORIGIN. Along with its own (core) points, each tile takes in every point
+# within HALO of its edges, so that every neighbor of a core point within HALO is in the tile as well. HALO must be smaller than TILE_SIZE.
+# The points are sorted by tile once, and each tile's core and halo are only gathered when it is reached, so only one tile is held at a time
+# @return = Yields a tuple of ( members, isCore ) for every tile with core points, in order of tile column and then row. members holds the indices
+#           of the tile's points in ascending order, and isCore flags which of them are the tile's core points
+def IterTiles( x, y, TILE_SIZE, HALO, ORIGIN ):
+    n = len( x )
+    if n == 0:
+        return
+    tx = np.floor( ( np.asarray( x, dtype=np.float64 ) - ORIGIN[0] ) / TILE_SIZE ).astype( np.int64 ) # As TileCells, without the distances
+    ty = np.floor( ( np.asarray( y, dtype=np.float64 ) - ORIGIN[1] ) / TILE_SIZE ).astype( np.int64 )
+    ( columnOffset, rowOffset ) = ( int( tx.min() ), int( ty.min() ) )
+    height = int( ty.max() ) - rowOffset + 1
+    keys = ( tx - columnOffset ) * height + ( ty - rowOffset )
+    del tx, ty
+    order = np.argsort( keys, kind="stable" ) # Groups the points by tile, keeping each tile's points in ascending index order
+    ( tileKeys, tileStarts, tileCounts ) = np.unique( keys[order], return_index=True, return_counts=True )
+    del keys
+    # The halo is widened by a hair, so that rounding in the distances below never drops a point that lies exactly one radius away.
+    # Extra halo points are harmless, since they aren't core points of the tile
+    HALO = HALO * ( 1 + 1e-9 ) + 1e-9 * TILE_SIZE
+
+    for ( key, start, count ) in zip( tileKeys.tolist(), tileStarts.tolist(), tileCounts.tolist() ):
+        ( column, row ) = divmod( key, height )
+        members = [ order[ start:start + count ] ]
+        for ( dx, dy ) in NEIGHBOR_CELL_OFFSETS:
+            if ( dx, dy ) == ( 0, 0 ) or row + dy < 0 or row + dy >= height:
+                continue
+            slot = int( np.searchsorted( tileKeys, key + dx * height + dy ) )
+            if slot == len( tileKeys ) or tileKeys[slot] != key + dx * height + dy:
+                continue
+            # The points of the neighboring tile which lie within HALO of this one: those near its high edge if it is below this tile, and those
+            # near its low edge if it is above
+            candidates = order[ tileStarts[slot]:tileStarts[slot] + tileCounts[slot] ]
+            ( cx, cy, lowX, highX, lowY, highY ) = TileCells( x, y, candidates, TILE_SIZE, ORIGIN )
+            near = np.ones( len( candidates ), dtype=bool )
+            for ( offset, low, high ) in ( ( dx, lowX, highX ), ( dy, lowY, highY ) ):
+                if offset == -1:
+                    near &= high <= HALO
+                elif offset == 1:
+                    near &= low <= HALO
+            members.append( candidates[near] )
+        isCore = np.zeros( sum( [ len( m ) for m in members ] ), dtype=bool )
+        isCore[ :count ] = True
+        members = np.concatenate( members )
+        ascending = np.argsort( members )
+        yield ( members[ascending], isCore[ascending] )
+
+# Calculates the tile of some of the points, and their distances from its edges
+# @param INDICES = The indices of the points
+# @return = A tuple of ( tx, ty, lowX, highX, lowY, highY ): the column and row of each point's tile, and its distance from the tile's low and high edges in x and y
+def TileCells( x, y, INDICES, TILE_SIZE, ORIGIN ):
+    fx = ( np.asarray( x[INDICES], dtype=np.float64 ) - ORIGIN[0] ) / TILE_SIZE
+    fy = ( np.asarray( y[INDICES], dtype=np.float64 ) - ORIGIN[1] ) / TILE_SIZE
+    tx = np.floor( fx ).astype( np.int64 )
+    ty = np.floor( fy ).astype( np.int64 )
+    return ( tx, ty, ( fx - tx ) * TILE_SIZE, ( tx + 1 - fx ) * TILE_SIZE, ( fy - ty ) * TILE_SIZE, ( ty + 1 - fy ) * TILE_SIZE )
+
+# Calculates the Gi* scores of a single tile's core points. Takes its arguments as one tuple, so that it can be handed to any map function
+# @param Arguments = A tuple of ( core, x, y, z, isCore, RADIUS, Stats, ORIGIN ), where core holds the indices of the tile's core points in the
+#                    whole dataset, and x, y and z the values of all of the tile's points
+# @return = A tuple of ( core, gi ): the indices of the tile's core points, and their scores
+def CalculateTileGiStar( Arguments ):
+    ( core, x, y, z, isCore, RADIUS, Stats, ORIGIN ) = Arguments
+    return ( core, CalculateGiStar( x, y, z, RADIUS, Stats, ORIGIN )[isCore] )
+
+# Calculates the Gi* score of every point, one tile at a time. The result is identical to CalculateGiStar over the whole dataset:
+# every tile uses the statistics of the whole dataset and the same grid origin, and holds every neighbor of its core points.
+# The neighbor search only ever works on a single tile's points, though the points of the whole dataset are still held in memory
+# @param TILE_SIZE = The width of the tiles. Must be larger than RADIUS, or a tile's halo can't hold every neighbor. Defaults to the value specified in BathyConfig
+# @param Map = The function used to process the tiles. Defaults to the builtin map, which processes one tile at a time as they are gathered.
+#              A pool's map can run them in parallel instead, at the cost of holding every tile waiting for it
+def CalculateGiStarTiled( x, y, z, RADIUS, TILE_SIZE=None, Map=map ):
+    if TILE_SIZE == None:
+        TILE_SIZE = BathyConfig.OUTLIER_TILE_SIZE
+    if TILE_SIZE <= RADIUS:
+        raise ValueError( "The outlier tile size (%s) must be larger than the neighbor radius (%s)" % ( TILE_SIZE, RADIUS ) )
+    gi = np.zeros( len( z ), dtype=np.float64 )
+    if len( z ) == 0:
+        return gi
+    Stats = ( len( z ), float( np.mean( z, dtype=np.float64 ) ), float( np.std( z, dtype=np.float64 ) ) )
+    ORIGIN = ( float( np.min( x ) ), float( np.min( y ) ) )
+
+    arguments = ( ( members[isCore], x[members], y[members], z[members], isCore, RADIUS, Stats, ORIGIN )
+                  for ( members, isCore ) in IterTiles( x, y, TILE_SIZE, RADIUS, ORIGIN ) )
+    for ( core, tileGi ) in Map( CalculateTileGiStar, arguments ):
+        gi[core] = tileGi
+    return gi
+
+# Returns a boolean mask which is True for every point whose Gi_Bin is at least MIN_BIN_SCORE.
+# If BathyConfig specifies a tile size, the neighbor search is done one tile at a time, which bounds the memory it uses by the size of a tile
+# @param SCALE = The size of a unit of x and y, in the units RADIUS and the tile size are given in. For points held in units of a quantized step
+def KeepMask( x, y, z, RADIUS=None, MIN_BIN_SCORE=None, SCALE=1.0 ):
+    if RADIUS == None:
+        RADIUS = BathyConfig.OUTLIER_NEIGHBOR_RADIUS
+    if MIN_BIN_SCORE == None:
+        MIN_BIN_SCORE = BathyConfig.MIN_BIN_SCORE
+    if BathyConfig.OUTLIER_TILE_SIZE == None:
+        return OutlierMask( x, y, z, RADIUS / SCALE, MIN_BIN_SCORE )
+    return GiBins( CalculateGiStarTiled( x, y, z, RADIUS / SCALE, BathyConfig.OUTLIER_TILE_SIZE / SCALE ) ) >= int( MIN_BIN_SCORE )
+
+# Removes all points whose Gi_Bin is below MIN_BIN_SCORE.
+# @return = A tuple of the filtered ( x, y, z ) arrays
+def RemoveOutliers( x, y, z, RADIUS=None, MIN_BIN_SCORE=None ):
+    keep = KeepMask( x, y, z, RADIUS, MIN_BIN_SCORE )
+    return ( x[keep], y[keep], z[keep] )
+
+# Performs the outlier analysis on an XYZ file (with header), PointTile or point shapefile, and saves the points which pass to the specified
+# directory, in the same format. The points are held in the precision specified in BathyConfig while they are analyzed
+# @param FILE_PATH = The path of the file to be processed
+# @param OUT_DIRECTORY = The directory to save the newly processed file
+# @param RADIUS = The neighbor radius. Defaults to the value specified in BathyConfig
+# @param MIN_BIN_SCORE = The minimum Gi_Bin score that will be kept. Defaults to the value specified in BathyConfig
+# @return = The path of the new file
+def RemoveOutliersFromXYZFile( FILE_PATH, OUT_DIRECTORY, RADIUS=None, MIN_BIN_SCORE=None ):
+    ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = OSToolbox.SplitFilePath( FILE_PATH )
+    OUT_FILE = os.path.join( OUT_DIRECTORY, FILE_NAME + "_HADone" + FILE_EXTENSION )
+
+    points = PointIO.ReadCompactPoints( FILE_PATH )
+    if points.Precision != Precision.FLOAT64:
+        BathyConfig.ConditionalPrint( "%s: %s", ( FILE_NAME, points.Describe() ) )
+    BathyConfig.ConditionalPrint( "Performing Hotspot Analysis on %s...", FILE_NAME )
+    keep = KeepMask( points.X, points.Y, points.Z, RADIUS, MIN_BIN_SCORE, SCALE=points.Scale )
+    Progress.Advance( points.Count )
+    ( x, y, z ) = points.XYZ( keep )
+    BathyConfig.ConditionalPrint( "Kept %s points of %s.", ( len( z ), FILE_NAME ) )
+
+    PointIO.WritePoints( OUT_FILE, x, y, z, PointIO.ReadCRS( FILE_PATH ) )
+    return OUT_FILE
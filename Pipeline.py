@@ -0,0 +1,236 @@
+# Pipeline
+# Streams files through a chain of processing stages. Each stage has its own workers and a bounded queue in front of it, so a file moves on
+# to the next stage as soon as it is done with the previous one, rather than waiting for every other file to catch up.
+# When a stage falls behind, the queue in front of it fills up, and the stage before it blocks until there is room again (backpressure).
+
+import os
+import queue
+import threading
+import time
+import BathyConfig
+import Metrics
+import OSToolbox
+import Progress
+import Threader
+
+# Placed on a stage's queue to tell one of its workers that no more files are coming
+STOP = object()
+
+# Returned for a file which a stage drops, rather than passing on
+DROPPED = object()
+
+# A single step of a Pipeline.
+# @param Name = The name of the stage. Used for display, and to look up the stage's worker count in BathyConfig
+# @param Function = The function that processes a file. Called as Function( File, OUT_DIRECTORY ), and must return the path of its output
+# @param DM = The DirectoryManager for the directory where the stage's outputs will be kept
+# @param Workers = The number of files the stage may process at once. Defaults to the value specified in BathyConfig for the stage. Always 1 without threading
+# @param EXT = If given, only files with this extension are processed. Any others are dropped with a message
+# @param Parameters = A dict of the settings the stage's output depends on, besides its input. Part of the stage's result cache key.
+#                     They aren't passed to Function, so bind the same values into it (e.g. with functools.partial), or the key can disagree with its output
+# @param Profile = If True, the stage's work is run under cProfile when metrics are collected. Defaults to whether BathyConfig lists the stage in PROFILE_STAGES
+class Stage( object ):
+    def __init__( self, Name, Function, DM, Workers=None, EXT="", Parameters=None, Profile=None ):
+        self.Name = Name
+        self.Function = Function
+        self.DM = DM
+        if Workers == None:
+            Workers = BathyConfig.PIPELINE_STAGE_WORKERS.get( Name, BathyConfig.MAX_ALLOWED_THREADS )
+        if BathyConfig.USE_THREADING == False:
+            Workers = 1
+        self.Workers = Workers
+        self.EXT = EXT
+        if Parameters == None:
+            Parameters = dict()
+        self.Parameters = Parameters
+        if Profile == None:
+            Profile = Name in BathyConfig.PROFILE_STAGES
+        self.Profile = Profile
+        self.ThreadingManager = None # Created when the pipeline starts, if BathyConfig asks for parallel processing
+        self.Queue = None
+        self.RemainingWorkers = 0
+        self.Lock = threading.RLock()
+
+    # Processes a single file, either on the stage's ThreadingManager or directly on the calling thread
+    # @param OUT_DIRECTORY = The directory the output will be written to
+    # @param Measure = If True, the work is measured where it runs (see Metrics.MeasuredCall)
+    # @return = The path of the output. If measured, a tuple of ( output, Measurements )
+    def Process( self, File, OUT_DIRECTORY, Measure=False ):
+        ( Function, Arguments ) = ( Progress.ForStage( self.Function, self.Name ), ( File, OUT_DIRECTORY ) ) # Points the function reports are counted towards the stage
+        if Measure == True:
+            PROFILE_DIRECTORY = BathyConfig.PROFILE_DIRECTORY if self.Profile == True else None
+            ( Function, Arguments ) = ( Metrics.MeasuredCall, ( Function, Arguments, self.Name, PROFILE_DIRECTORY ) )
+        if self.ThreadingManager == None:
+            return Function( *Arguments )
+        ( result, runTime ) = self.ThreadingManager.Submit( Function, Arguments ).result()
+        return result
+
+# A chain of Stages. The output of each stage is the input of the next
+# @param Stages = The stages, in order
+# @param QueueSize = The max number of files allowed to wait in front of each stage. Defaults to the value specified in BathyConfig
+# @param OnError = Called as OnError( e, File ) when a stage fails to process a file. The file goes no further down the pipeline
+# @param Manifest = The ProcessingManifest which records what each stage has done. Files a stage has already processed are passed straight through.
+#                   If not given, every file is processed by every stage
+# @param Cache = The ResultCache. If given, a file is only processed by a stage if the stage has never seen its contents with the stage's current
+#                parameters, in place of the manifest's check by path
+# @param Metrics = The Metrics.MetricsRecorder which every stage's work on every file is recorded to. If not given, nothing is measured
+# @param Reporter = The Progress.ProgressReporter which is told whenever a stage is done with a file. If not given, the one running (if any) is used
+class Pipeline( object ):
+    def __init__( self, Stages, QueueSize=None, OnError=None, Manifest=None, Cache=None, Metrics=None, Reporter=None ):
+        self.Stages = Stages
+        self.Metrics = Metrics
+        if Reporter == None:
+            Reporter = Progress.Reporter
+        self.Reporter = Reporter
+        self.Manifest = Manifest
+        self.Cache = Cache
+        if QueueSize == None:
+            QueueSize = BathyConfig.PIPELINE_QUEUE_SIZE
+        self.QueueSize = QueueSize
+        self.OnError = OnError
+        self.Outputs = list() # The outputs of the last stage
+        self.OutputLock = threading.RLock()
+
+    # Runs every file through every stage. Returns once every file has made it through (or failed)
+    # @param Files = The files to feed to the first stage
+    # @return = The outputs of the last stage
+    def Run( self, Files ):
+        self.Outputs = list()
+        Files = list( Files )
+        Threads = list()
+        for stage in self.Stages:
+            if self.Reporter != None:
+                self.Reporter.SetTotal( stage.Name, len( Files ) ) # At most. Files which fail go no further
+            stage.Queue = queue.Queue( maxsize=self.QueueSize )
+            stage.RemainingWorkers = stage.Workers
+            if BathyConfig.USE_THREADING == True:
+                stage.ThreadingManager = Threader.ThreadingManager( max=stage.Workers )
+            for i in range( stage.Workers ):
+                Threads.append( threading.Thread( target=self.Work, args=( stage, ), name="%s-%s" % ( stage.Name, i ) ) )
+        for thread in Threads:
+            thread.start()
+
+        # Feed the first stage. Blocks whenever its queue is full
+        for File in Files:
+            self.Stages[0].Queue.put( ( File, time.perf_counter() ) )
+        for i in range( self.Stages[0].Workers ):
+            self.Stages[0].Queue.put( STOP )
+
+        for thread in Threads:
+            thread.join()
+        for stage in self.Stages:
+            if stage.ThreadingManager != None:
+                stage.ThreadingManager.Shutdown()
+                stage.ThreadingManager = None
+        return self.Outputs
+
+    # Hands a file on to the stage after the given one, or collects it if the given stage is the last
+    def Forward( self, stage, File ):
+        index = self.Stages.index( stage )
+        if index + 1 < len( self.Stages ):
+            self.Stages[ index + 1 ].Queue.put( ( File, time.perf_counter() ) ) # Blocks while the next stage is backed up. Queued along with the time, to measure the wait
+        else:
+            with self.OutputLock:
+                self.Outputs.append( File )
+
+    # Tells the cache that a stage is done with its input, which may now be evicted (if it was a cached output of the previous stage)
+    def Release( self, File ):
+        if self.Cache != None:
+            self.Cache.Unpin( File )
+
+    # Tells the progress reporter, if there is one, that a stage is done with a file
+    def FileDone( self, stage ):
+        if self.Reporter != None:
+            self.Reporter.FileDone( stage.Name )
+
+    # Records a measurement of a stage's work on a file, if metrics are being collected
+    def RecordMetrics( self, stage, File, **Fields ):
+        if self.Metrics != None:
+            self.Metrics.Record( stage.Name, File, **Fields )
+
+    # Reports a stage's failure to process a file, and lets it go. A failing error handler is reported in turn, rather than killing the worker
+    def Fail( self, stage, File, e, QUEUE_WAIT ):
+        try:
+            self.RecordMetrics( stage, File, queue_wait_seconds=QUEUE_WAIT, error=repr( e ) )
+            if self.OnError != None:
+                self.OnError( e, File )
+        except Exception as handlerError:
+            print( "Error handler failed on %s: %r (while handling %r)" % ( File, handlerError, e ) )
+        finally:
+            self.Release( File )
+            self.FileDone( stage )
+
+    # The loop each of a stage's workers runs. Takes files off the stage's queue, processes them, and forwards the outputs.
+    # Nothing a single file does can stop the worker: however it exits, it hands STOP on to the next stage once it is the stage's last worker
+    def Work( self, stage ):
+        try:
+            while True:
+                item = stage.Queue.get()
+                if item is STOP:
+                    break
+                ( File, queuedTime ) = item
+                QUEUE_WAIT = time.perf_counter() - queuedTime
+                try:
+                    Output = self.WorkOn( stage, File, QUEUE_WAIT )
+                except Exception as e:
+                    self.Fail( stage, File, e, QUEUE_WAIT )
+                    continue
+                try:
+                    self.Release( File ) # Dropped files are let go too, or a cached input would stay pinned for good
+                    self.FileDone( stage )
+                    if Output is not DROPPED:
+                        self.Forward( stage, Output )
+                except Exception as e: # The file's work is done and recorded, so it is only reported
+                    print( "Failed to hand %s on from %s: %r" % ( Output, stage.Name, e ) )
+        finally:
+            # The last worker of a stage to finish tells the next stage that no more files are coming
+            with stage.Lock:
+                stage.RemainingWorkers -= 1
+                finished = stage.RemainingWorkers == 0
+            index = self.Stages.index( stage )
+            if finished and index + 1 < len( self.Stages ):
+                nextStage = self.Stages[ index + 1 ]
+                for i in range( nextStage.Workers ):
+                    nextStage.Queue.put( STOP )
+
+    # Has a stage deal with a single file: looks it up in the cache or manifest, and processes it if need be. Any exception is left to Work
+    # @return = The output to forward, or DROPPED if the file goes no further
+    def WorkOn( self, stage, File, QUEUE_WAIT ):
+        ( name, extension ) = os.path.splitext( File )
+        if stage.EXT != "" and stage.EXT != extension:
+            BathyConfig.ConditionalPrint( "%s is of the wrong format.", name )
+            return DROPPED
+        Output = None
+        if self.Cache != None:
+            KEY = self.Cache.Key( File, stage.Name, stage.Parameters )
+            Output = self.Cache.Lookup( KEY ) # Raises if e.g. the input has disappeared since it was queued
+        elif self.Manifest != None:
+            Output = self.Manifest.GetCompletedOutput( File, stage.Name )
+        if Output != None:
+            BathyConfig.ConditionalPrint( "%s has already been processed by %s.", ( File, stage.Name ) )
+            self.RecordMetrics( stage, File, queue_wait_seconds=QUEUE_WAIT, cached=True, output=Output )
+        else:
+            BathyConfig.ConditionalPrint( "%s is now processing %s", ( stage.Name, File ) )
+            # A file the stage was interrupted while processing is finished in the directory it was started in, from its last checkpoint
+            OUT_DIRECTORY = None
+            if self.Manifest != None:
+                OUT_DIRECTORY = self.Manifest.GetInterruptedDirectory( File, stage.Name )
+            if OUT_DIRECTORY != None:
+                stage.DM.ResumeDirectory( OUT_DIRECTORY )
+            else:
+                OUT_DIRECTORY = stage.DM.GetDirectory()
+            try:
+                if self.Manifest != None:
+                    self.Manifest.MarkStarted( File, stage.Name, OUT_DIRECTORY )
+                if self.Metrics != None:
+                    ( Output, Measurements ) = stage.Process( File, OUT_DIRECTORY, Measure=True )
+                else:
+                    Output = stage.Process( File, OUT_DIRECTORY )
+            finally:
+                stage.DM.RecordOutput( OUT_DIRECTORY, Output ) # Keeps the directory's running size up to date, even if nothing was written
+            if self.Manifest != None:
+                self.Manifest.MarkComplete( File, stage.Name, Output )
+            if self.Cache != None:
+                self.Cache.Store( KEY, stage.Name, Output )
+            if self.Metrics != None:
+                self.RecordMetrics( stage, File, queue_wait_seconds=QUEUE_WAIT, cached=False, output=Output, **Measurements )
+        return Output
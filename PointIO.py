@@ -0,0 +1,235 @@
+# PointIO
+# Reads and writes points in any of the formats files are handed between stages in: XYZ text, PointTile's binary tiles, or point shapefiles.
+# The format is chosen by the file's extension, so the numeric stages work the same on any of them
+
+import io
+import os
+import numpy as np
+import BathyConfig
+import Checkpoint
+import PointTile
+import Precision
+import Progress
+import Shapefile
+import XYZParser
+
+# The number of points yielded at a time when streaming a tile or shapefile
+TILE_BLOCK_SIZE = 1024 * 1024
+
+def IsTile( FILE_PATH ):
+    return os.path.splitext( FILE_PATH )[1].lower() == PointTile.EXTENSION
+
+def IsShapefile( FILE_PATH ):
+    return os.path.splitext( FILE_PATH )[1].lower() == ".shp"
+
+# Returns the extension a stage should give its output, given the extension of its input.
+# Text input is converted to the intermediate format specified in BathyConfig. Anything else keeps its format
+def IntermediateExtension( FILE_EXTENSION ):
+    if BathyConfig.INTERMEDIATE_FORMAT == PointTile.EXTENSION:
+        return PointTile.EXTENSION
+    return FILE_EXTENSION
+
+# Generator that streams the points of a file block by block
+# @return = Yields a tuple of ( x, y, z, badLines ) for every block. Only text files have bad lines
+def IterPointBlocks( FILE_PATH ):
+    for ( position, x, y, z, badLines ) in IterPointBlocksFrom( FILE_PATH ):
+        yield ( x, y, z, badLines )
+
+# Like IterPointBlocks, but starts from a given position, and tells where each block ends. Lets a stream be picked up again where it left off.
+# Positions are byte offsets in text files, and point indices in tiles and shapefiles
+# @param POSITION = The position to start from, which must be the end of a block yielded before. If None, the stream starts at the first point
+# @return = Yields a tuple of ( end, x, y, z, badLines ) for every block, where end is the position just after the block
+def IterPointBlocksFrom( FILE_PATH, POSITION=None ):
+    if IsTile( FILE_PATH ) == False and IsShapefile( FILE_PATH ) == False:
+        for block in XYZParser.IterXYZBlocksFrom( FILE_PATH, POSITION ):
+            yield block
+        return
+    ( x, y, z ) = ReadPoints( FILE_PATH )
+    for start in range( POSITION or 0, len( z ), TILE_BLOCK_SIZE ):
+        end = min( start + TILE_BLOCK_SIZE, len( z ) )
+        yield ( end, x[start:end], y[start:end], z[start:end], list() )
+
+# Reads every point of a file. The columns of a tile, and the records of a shapefile, are memory-mapped rather than read
+# @return = A tuple of ( x, y, z )
+def ReadPoints( FILE_PATH ):
+    if IsTile( FILE_PATH ):
+        return PointTile.ReadTile( FILE_PATH ).XYZ()
+    if IsShapefile( FILE_PATH ):
+        return Shapefile.ReadPoints( FILE_PATH )
+    ( x, y, z, errorCount ) = XYZParser.ReadXYZFile( FILE_PATH )
+    return ( x, y, z )
+
+# Reads every point of a file into the representation specified in BathyConfig (see Precision). Text files are parsed a block at a time,
+# so their points are never all held at full precision
+# @param PRECISION = One of the representations in Precision. Defaults to the value specified in BathyConfig
+# @return = The Precision.CompactPoints
+def ReadCompactPoints( FILE_PATH, PRECISION=None ):
+    if PRECISION == None:
+        PRECISION = BathyConfig.POINT_PRECISION
+    if PRECISION == Precision.FLOAT64 or IsTile( FILE_PATH ) or IsShapefile( FILE_PATH ):
+        ( x, y, z ) = ReadPoints( FILE_PATH )
+        return Precision.FromArrays( x, y, z, PRECISION )
+    points = Precision.CompactPoints( PRECISION, CAPACITY=max( CountPoints( FILE_PATH ), 0 ) )
+    for ( x, y, z, badLines ) in IterPointBlocks( FILE_PATH ):
+        points.Append( x, y, z )
+    return points
+
+# Counts the points in a file. Tiles and shapefiles record their counts, but text files have to be read through
+def CountPoints( FILE_PATH ):
+    if IsTile( FILE_PATH ):
+        return PointTile.ReadHeader( FILE_PATH )[ "count" ]
+    if IsShapefile( FILE_PATH ):
+        return Shapefile.ReadDBFHeader( os.path.splitext( FILE_PATH )[0] + ".dbf" )[0]
+    lines = 0
+    with io.open( FILE_PATH, "rb" ) as f:
+        for block in iter( lambda: f.read( BathyConfig.READ_CHUNK_SIZE ), b"" ):
+            lines += block.count( b"\n" )
+    return lines - 1 # Less the header
+
+# Returns the coordinate system of a file's points, as well-known text. Text files don't record one. Empty if unknown
+def ReadCRS( FILE_PATH ):
+    if IsTile( FILE_PATH ):
+        return PointTile.ReadHeader( FILE_PATH )[ "crs" ]
+    if IsShapefile( FILE_PATH ):
+        return Shapefile.ReadCRS( FILE_PATH )
+    return ""
+
+# Streams points into an XYZ text file, with an 'x,y,z' header. Has the same interface as PointTile.TileWriter. The file is written under a
+# temporary name, and renamed once complete
+# @param State = The state returned by Flush before an interruption. If given, the writer carries on from there, rather than starting afresh
+class XYZWriter( object ):
+    def __init__( self, FILE_PATH, State=None ):
+        self.FilePath = FILE_PATH
+        self.PartialPath = Checkpoint.PartialPath( FILE_PATH )
+        if State == None:
+            self.File = io.open( self.PartialPath, "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE )
+            self.File.write( b"x,y,z\n" )
+        else:
+            self.File = Checkpoint.Reopen( self.PartialPath, State[ "size" ], BathyConfig.WRITE_BUFFER_SIZE )
+
+    def Append( self, Arrays ):
+        ( x, y, z ) = Arrays
+        self.File.write( XYZParser.FormatXYZBlock( x, y, z ) )
+
+    # Pushes every point appended so far out to disk
+    # @return = The state to carry on from, if the writer is interrupted before it is closed
+    def Flush( self ):
+        Checkpoint.Sync( self.File )
+        return { "size": self.File.tell() }
+
+    def Close( self ):
+        self.File.close()
+        return Checkpoint.Commit( self.PartialPath, self.FilePath )
+
+    def Abort( self ):
+        self.File.close()
+        Checkpoint.Remove( self.PartialPath )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, type, value, traceback ):
+        if type == None:
+            self.Close()
+        else:
+            self.Abort()
+
+# Opens a writer for the format given by the file's extension. Blocks are added with Append( [ x, y, z ] )
+# @param CRS = The well-known text of the points' coordinate system. Recorded by tiles and shapefiles
+# @param State = The state returned by the writer's Flush before an interruption. If given, the writer carries on from there
+def OpenPointWriter( FILE_PATH, CRS="", State=None ):
+    if IsTile( FILE_PATH ):
+        return PointTile.TileWriter( FILE_PATH, CRS=CRS, State=State )
+    if IsShapefile( FILE_PATH ):
+        return Shapefile.ShapefileWriter( FILE_PATH, CRS, State )
+    return XYZWriter( FILE_PATH, State )
+
+# Writes points held in memory to a file, in the format given by the file's extension
+# @param CRS = The well-known text of the points' coordinate system. Recorded by tiles and shapefiles
+def WritePoints( FILE_PATH, x, y, z, CRS="" ):
+    if IsTile( FILE_PATH ):
+        PointTile.WriteTile( FILE_PATH, [ ( "x", x ), ( "y", y ), ( "z", z ) ], CRS )
+    elif IsShapefile( FILE_PATH ):
+        Shapefile.WriteShapefile( FILE_PATH, x, y, z, CRS )
+    else:
+        XYZParser.WriteXYZFile( FILE_PATH, x, y, z )
+
+# Streams the points of one file into another, saving checkpoints as it goes (see Checkpoint). If a checkpoint of the output is found, the
+# stream carries on from it, rather than starting over. Used as:
+#     with CheckpointedStream( FILE_PATH, OUT_FILE, CRS ) as Stream:
+#         for ( x, y, z, badLines ) in Stream.Blocks():
+#             Stream.Append( [ x, y, z ] )
+# A block counts as done once the loop asks for the next one, so everything the loop does with a block must come before that.
+# Anything else the stage needs to carry on (e.g. running totals) can be kept in the dict Extra, which is saved with every checkpoint
+# @param CRS = The well-known text of the points' coordinate system. Recorded by tiles and shapefiles
+class CheckpointedStream( object ):
+    def __init__( self, FILE_PATH, OUT_FILE, CRS="" ):
+        self.FilePath = FILE_PATH
+        self.OutFile = OUT_FILE
+        self.Writer = None
+        State = Checkpoint.LoadCheckpoint( OUT_FILE, FILE_PATH )
+        if State != None:
+            try:
+                self.Writer = OpenPointWriter( OUT_FILE, CRS, State[ "writer" ] )
+            except OSError: # The partial output has gone missing
+                State = None
+        if State == None:
+            Checkpoint.RemoveCheckpoint( OUT_FILE )
+            self.Writer = OpenPointWriter( OUT_FILE, CRS )
+            State = { "position": None, "extra": dict() }
+        else:
+            BathyConfig.ConditionalPrint( "Resuming %s from its last checkpoint.", OUT_FILE )
+        self.Resumed = State[ "position" ] != None
+        self.Position = State[ "position" ] # Where in the input the next block starts
+        self.Extra = State[ "extra" ]
+        self.Timer = Checkpoint.CheckpointTimer()
+
+    # Generator that streams the blocks of the input which haven't been done yet
+    # @return = Yields a tuple of ( x, y, z, badLines ) for every block
+    def Blocks( self ):
+        for ( end, x, y, z, badLines ) in IterPointBlocksFrom( self.FilePath, self.Position ):
+            yield ( x, y, z, badLines )
+            self.Position = end
+            if self.Timer.IsDue():
+                self.Save()
+
+    def Append( self, Arrays ):
+        self.Writer.Append( Arrays )
+
+    # Saves a checkpoint. The output is pushed out to disk first, so that the checkpoint never gets ahead of it
+    def Save( self ):
+        Checkpoint.SaveCheckpoint( self.OutFile, self.FilePath, { "position": self.Position, "writer": self.Writer.Flush(), "extra": self.Extra } )
+
+    # Completes the output, and removes its checkpoint
+    # @return = The path of the output
+    def Close( self ):
+        OUT_FILE = self.Writer.Close()
+        Checkpoint.RemoveCheckpoint( self.OutFile )
+        return OUT_FILE
+
+    # Abandons the output, and its checkpoint
+    def Abort( self ):
+        self.Writer.Abort()
+        Checkpoint.RemoveCheckpoint( self.OutFile )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, type, value, traceback ):
+        if type == None:
+            self.Close()
+        elif issubclass( type, Exception ):
+            self.Abort()
+        # Otherwise the stream was interrupted (e.g. by Ctrl+C), and the last checkpoint is kept to carry on from
+
+# Converts the points of a file from one format to another, one block at a time. Carries on from the last checkpoint if interrupted
+# @param CRS = The well-known text of the points' coordinate system. Defaults to the one recorded in the input, if any
+# @return = The path of the new file
+def ConvertPoints( FILE_PATH, OUT_FILE, CRS=None ):
+    if CRS == None:
+        CRS = ReadCRS( FILE_PATH )
+    with CheckpointedStream( FILE_PATH, OUT_FILE, CRS ) as Stream:
+        for ( x, y, z, badLines ) in Stream.Blocks():
+            Stream.Append( [ x, y, z ] )
+            Progress.Advance( len( z ) )
+    return OUT_FILE
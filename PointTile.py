@@ -0,0 +1,437 @@
+# PointTile
+# A compact columnar binary format for passing points between stages, in place of XYZ text.
+# A tile file is laid out as:
+#   MAGIC (8 bytes) | header length (little-endian uint32) | header (JSON) | padding | column | padding | column | ...
+# The header holds the number of points, their bounding box, the well-known text of their coordinate system, and the name, dtype and byte
+# offset of every column. Columns are stored one after another, each starting on an ALIGNMENT byte boundary, so that every column can be
+# memory-mapped and used as a NumPy array directly, without parsing or copying anything.
+# Every tile has x, y and z columns. Any number of extra columns (flags, scores) may follow.
+# An indexed tile is sorted along the Morton curve, and followed by a block index: the bounding box (and depth range) of every block of
+# BLOCK_SIZE consecutive points. A query only reads the blocks whose extents overlap it, so a small subset of a huge tile comes back without
+# the rest of the tile ever leaving the disk
+
+import io
+import json
+import os
+import shutil
+import struct
+import numpy as np
+import BathyConfig
+import Checkpoint
+import SpatialKeys
+
+EXTENSION = ".bpt"
+MAGIC = b"BPTILE01"
+ALIGNMENT = 64
+
+# The columns every tile has, and their default dtypes
+XYZ_COLUMNS = [ ( "x", "<f8" ), ( "y", "<f8" ), ( "z", "<f8" ) ]
+
+# The arrays of the block index. Each holds one value per block
+INDEX_COLUMNS = [ ( "xmin", "<f8" ), ( "ymin", "<f8" ), ( "zmin", "<f8" ), ( "xmax", "<f8" ), ( "ymax", "<f8" ), ( "zmax", "<f8" ) ]
+
+# The number of points sorted into place, or scanned by a query, at a time
+SCAN_SIZE = 1024 * 1024
+
+# Rounds an offset up to the next column boundary
+def Align( offset ):
+    return ( offset + ALIGNMENT - 1 ) // ALIGNMENT * ALIGNMENT
+
+# Builds the header of a tile
+# @param Columns = A list of ( name, dtype ) for every column, in the order they are stored
+# @param COUNT = The number of points in the tile
+# @param BBOX = The bounding box of the points, as [ xmin, ymin, zmin, xmax, ymax, zmax ]. None if the tile is empty
+# @param CRS = The well-known text of the points' coordinate system. Empty if unknown
+# @param BLOCK_SIZE = The number of points per block of the block index. If None, the tile has no index
+# @return = A tuple of ( header, offsets, indexOffsets ), where header is the bytes which precede the first column, offsets the byte offset
+#           of every column, and indexOffsets the byte offset of every array of the block index
+def BuildHeader( Columns, COUNT, BBOX, CRS, BLOCK_SIZE=None ):
+    BLOCKS = 0 if BLOCK_SIZE == None else ( COUNT + BLOCK_SIZE - 1 ) // BLOCK_SIZE
+    # The offsets depend on the length of the header, and the length of the header on the offsets. Both settle after a pass or two
+    offsets = [ 0 ] * len( Columns )
+    indexOffsets = [ 0 ] * len( INDEX_COLUMNS )
+    while True:
+        header = { "count": COUNT, "bbox": BBOX, "crs": CRS, "index": None,
+                   "columns": [ { "name": name, "dtype": np.dtype( dtype ).str, "offset": offset } for ( ( name, dtype ), offset ) in zip( Columns, offsets ) ] }
+        if BLOCK_SIZE != None:
+            header[ "index" ] = { "block_size": BLOCK_SIZE, "blocks": BLOCKS,
+                                  "columns": [ { "name": name, "dtype": dtype, "offset": offset } for ( ( name, dtype ), offset ) in zip( INDEX_COLUMNS, indexOffsets ) ] }
+        encoded = json.dumps( header, sort_keys=True ).encode( "utf-8" )
+        offset = Align( len( MAGIC ) + 4 + len( encoded ) )
+        newOffsets = list()
+        for ( name, dtype ) in Columns:
+            newOffsets.append( offset )
+            offset = Align( offset + COUNT * np.dtype( dtype ).itemsize )
+        newIndexOffsets = list()
+        if BLOCK_SIZE != None:
+            for ( name, dtype ) in INDEX_COLUMNS:
+                newIndexOffsets.append( offset )
+                offset = Align( offset + BLOCKS * np.dtype( dtype ).itemsize )
+        else:
+            newIndexOffsets = indexOffsets
+        if newOffsets == offsets and newIndexOffsets == indexOffsets:
+            break
+        ( offsets, indexOffsets ) = ( newOffsets, newIndexOffsets )
+    preamble = MAGIC + struct.pack( "<I", len( encoded ) ) + encoded
+    return ( preamble + b"\0" * ( offsets[0] - len( preamble ) ), offsets, indexOffsets )
+
+# Calculates the min and max of every block of BLOCK_SIZE consecutive values. The last block may be short
+# @return = A tuple of ( mins, maxs )
+def BlockExtents( values, BLOCK_SIZE ):
+    starts = np.arange( 0, len( values ), BLOCK_SIZE )
+    return ( np.minimum.reduceat( values, starts ), np.maximum.reduceat( values, starts ) )
+
+# Returns True if two boxes overlap. A bound of None is unbounded
+def Overlaps( MIN, MAX, LOW, HIGH ):
+    return ( HIGH == None or MIN <= HIGH ) and ( LOW == None or MAX >= LOW )
+
+# Reads the header of a tile
+# @return = The header, as a dict with the keys 'count', 'bbox', 'crs' and 'columns'
+def ReadHeader( FILE_PATH ):
+    with io.open( FILE_PATH, "rb" ) as f:
+        if f.read( len( MAGIC ) ) != MAGIC:
+            raise ValueError( "%s is not a point tile." % FILE_PATH )
+        ( length, ) = struct.unpack( "<I", f.read( 4 ) )
+        return json.loads( f.read( length ).decode( "utf-8" ) )
+
+# Writes points held in memory to a tile
+# @param Columns = A list of ( name, array ) for every column. The first three must be x, y and z
+# @param CRS = The well-known text of the points' coordinate system. Empty if unknown
+# @param Indexed = If True, the points are sorted and indexed. Defaults to the value specified in BathyConfig
+def WriteTile( FILE_PATH, Columns, CRS="", Indexed=None ):
+    Writer = TileWriter( FILE_PATH, [ ( name, np.asarray( array ).dtype ) for ( name, array ) in Columns ], CRS, Indexed )
+    try:
+        Writer.Append( [ array for ( name, array ) in Columns ] )
+    except Exception:
+        Writer.Abort()
+        raise
+    Writer.Close()
+
+# Streams points into a tile block by block. As the number of points isn't known until the end, each column is spilled to its own temporary
+# file as it grows, and the columns are copied into the tile, one after another, when the writer is closed. The tile is written under a
+# temporary name, and renamed once complete
+# @param Columns = A list of ( name, dtype ) for every column. The first three must be x, y and z. Defaults to float64 x, y and z
+# @param CRS = The well-known text of the points' coordinate system. Empty if unknown
+# @param Indexed = If True, the points are sorted along the Morton curve and indexed by block as they are copied into the tile.
+#                  Defaults to the value specified in BathyConfig
+# @param State = The state returned by Flush before an interruption. If given, the writer carries on from there, rather than starting afresh
+class TileWriter( object ):
+    def __init__( self, FILE_PATH, Columns=None, CRS="", Indexed=None, State=None ):
+        if Columns == None:
+            Columns = XYZ_COLUMNS
+        if [ name for ( name, dtype ) in Columns[:3] ] != [ "x", "y", "z" ]:
+            raise ValueError( "The first three columns of a tile must be x, y and z." )
+        self.FilePath = FILE_PATH
+        self.Columns = [ ( name, np.dtype( dtype ) ) for ( name, dtype ) in Columns ]
+        self.CRS = CRS
+        if Indexed == None:
+            Indexed = BathyConfig.INDEX_TILES
+        self.Indexed = Indexed
+        self.Count = 0
+        self.Min = None
+        self.Max = None
+        self.SpillPaths = [ "%s.%s.tmp" % ( FILE_PATH, name ) for ( name, dtype ) in self.Columns ]
+        self.RunPaths = [ "%s.%s.sorted.tmp" % ( FILE_PATH, name ) for ( name, dtype ) in self.Columns ] # The columns sorted into runs, if indexed
+        if State == None:
+            self.Spills = [ io.open( path, "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) for path in self.SpillPaths ]
+        else:
+            ( self.Count, self.Min, self.Max ) = ( State[ "count" ], State[ "min" ], State[ "max" ] )
+            self.Spills = list()
+            try:
+                for ( path, ( name, dtype ) ) in zip( self.SpillPaths, self.Columns ):
+                    self.Spills.append( Checkpoint.Reopen( path, self.Count * dtype.itemsize, BathyConfig.WRITE_BUFFER_SIZE ) )
+            except Exception:
+                for spill in self.Spills:
+                    spill.close()
+                raise
+
+    # Adds a block of points to the tile
+    # @param Arrays = One array for every column, in order. All must be the same length
+    def Append( self, Arrays ):
+        if len( Arrays ) != len( self.Columns ):
+            raise ValueError( "Expected %s columns, got %s." % ( len( self.Columns ), len( Arrays ) ) )
+        n = len( Arrays[0] )
+        if n == 0:
+            return
+        for ( ( name, dtype ), array, spill ) in zip( self.Columns, Arrays, self.Spills ):
+            if len( array ) != n:
+                raise ValueError( "Column %s has %s values rather than %s." % ( name, len( array ), n ) )
+            spill.write( np.ascontiguousarray( array, dtype=dtype ).tobytes() )
+        blockMin = [ float( np.min( a ) ) for a in Arrays[:3] ]
+        blockMax = [ float( np.max( a ) ) for a in Arrays[:3] ]
+        if self.Min == None:
+            ( self.Min, self.Max ) = ( blockMin, blockMax )
+        else:
+            self.Min = [ min( a, b ) for ( a, b ) in zip( self.Min, blockMin ) ]
+            self.Max = [ max( a, b ) for ( a, b ) in zip( self.Max, blockMax ) ]
+        self.Count += n
+
+    # Pushes every point appended so far out to disk
+    # @return = The state to carry on from, if the writer is interrupted before it is closed
+    def Flush( self ):
+        for spill in self.Spills:
+            Checkpoint.Sync( spill )
+        return { "count": self.Count, "min": self.Min, "max": self.Max }
+
+    # Writes the tile, and removes the temporary column files
+    # @return = The path of the tile
+    def Close( self ):
+        for spill in self.Spills:
+            spill.close()
+        BBOX = None if self.Min == None else self.Min + self.Max
+        BLOCK_SIZE = BathyConfig.TILE_INDEX_BLOCK_SIZE if self.Indexed == True else None
+        ( header, offsets, indexOffsets ) = BuildHeader( self.Columns, self.Count, BBOX, self.CRS, BLOCK_SIZE )
+        PARTIAL_PATH = Checkpoint.PartialPath( self.FilePath )
+        try:
+            with io.open( PARTIAL_PATH, "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) as f:
+                f.write( header )
+                if BLOCK_SIZE != None and self.Count > 0:
+                    self.WriteSorted( f, offsets, indexOffsets, BLOCK_SIZE )
+                else:
+                    for ( offset, path ) in zip( offsets, self.SpillPaths ):
+                        f.write( b"\0" * ( offset - f.tell() ) )
+                        with io.open( path, "rb" ) as spill:
+                            shutil.copyfileobj( spill, f, BathyConfig.WRITE_BUFFER_SIZE )
+        except Exception:
+            Checkpoint.Remove( PARTIAL_PATH )
+            raise
+        finally:
+            self.RemoveSpills()
+        return Checkpoint.Commit( PARTIAL_PATH, self.FilePath )
+
+    # Copies the columns into the tile in Morton order, then writes the block index. Tiles may be far bigger than memory, so they are sorted in
+    # two passes: runs of SCAN_SIZE points are sorted and spilled to disk (SortRuns), and the runs are then merged into the tile (MergeRuns).
+    # Only one run, or one window of every run, is held in memory at a time, and the spills are only ever read in order
+    def WriteSorted( self, f, offsets, indexOffsets, BLOCK_SIZE ):
+        BBOX = ( self.Min[0], self.Min[1], self.Max[0], self.Max[1] )
+        self.MergeRuns( f, offsets, self.SortRuns( BBOX ), BBOX )
+        f.flush()
+        # The block index is read back from the sorted columns. Chunks are a whole number of blocks, so that the extents of each block can be
+        # found from a single chunk
+        CHUNK = max( 1, SCAN_SIZE // BLOCK_SIZE ) * BLOCK_SIZE
+        Extents = list()
+        for ( offset, ( name, dtype ) ) in zip( offsets[:3], self.Columns[:3] ):
+            column = np.memmap( f.name, dtype=dtype, mode="r", offset=offset, shape=( self.Count, ) )
+            chunks = [ BlockExtents( np.asarray( column[ start:start + CHUNK ] ), BLOCK_SIZE ) for start in range( 0, self.Count, CHUNK ) ]
+            Extents.append( ( np.concatenate( [ mins for ( mins, maxs ) in chunks ] ), np.concatenate( [ maxs for ( mins, maxs ) in chunks ] ) ) )
+            del column # Release the map before the file is renamed
+        # The index arrays are stored in the order of INDEX_COLUMNS: the three mins, then the three maxes
+        Arrays = [ Extents[0][0], Extents[1][0], Extents[2][0], Extents[0][1], Extents[1][1], Extents[2][1] ]
+        for ( offset, ( name, dtype ), array ) in zip( indexOffsets, INDEX_COLUMNS, Arrays ):
+            f.seek( offset )
+            f.write( np.ascontiguousarray( array, dtype=dtype ).tobytes() )
+
+    # Sorts the spilled columns along the Morton curve SCAN_SIZE points at a time, and writes the sorted runs one after another to a second set
+    # of temporary column files
+    # @param BBOX = The box the Morton keys span, as ( xmin, ymin, xmax, ymax )
+    # @return = A list of the ( start, end ) of every run
+    def SortRuns( self, BBOX ):
+        Spills = [ np.memmap( path, dtype=dtype, mode="r", shape=( self.Count, ) ) for ( path, ( name, dtype ) ) in zip( self.SpillPaths, self.Columns ) ]
+        Runs = list()
+        Outputs = list()
+        try:
+            for path in self.RunPaths:
+                Outputs.append( io.open( path, "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) )
+            for start in range( 0, self.Count, SCAN_SIZE ):
+                end = min( start + SCAN_SIZE, self.Count )
+                order = SpatialKeys.MortonOrder( Spills[0][ start:end ], Spills[1][ start:end ], BBOX )
+                for ( spill, output ) in zip( Spills, Outputs ):
+                    output.write( np.asarray( spill[ start:end ] )[ order ].tobytes() )
+                Runs.append( ( start, end ) )
+        finally:
+            for output in Outputs:
+                output.close()
+        del Spills # Release the maps, so that the spill files can be removed
+        return Runs
+
+    # Merges the sorted runs into the tile's columns. A window of the next points of every run is held in memory. Nothing still on disk can
+    # come before the smallest of the windows' last points, so everything in the windows up to it is sorted and written out, and the emptied
+    # windows are refilled. Points with the same key are kept in the order they were appended in, as a stable sort of the whole tile would
+    # @param Runs = The ( start, end ) of every run, as returned by SortRuns
+    def MergeRuns( self, f, offsets, Runs, BBOX ):
+        Sorted = [ np.memmap( path, dtype=dtype, mode="r", shape=( self.Count, ) ) for ( path, ( name, dtype ) ) in zip( self.RunPaths, self.Columns ) ]
+        WINDOW = max( 1024, SCAN_SIZE // len( Runs ) ) # The windows of all of the runs together hold about SCAN_SIZE points
+        Cursors = [ start for ( start, end ) in Runs ] # The position of the first unwritten point of every run
+        Windows = [ np.zeros( 0, dtype=np.uint64 ) for run in Runs ] # The keys of the points of every run from its cursor on, as far as has been read
+        written = 0
+        while written < self.Count:
+            ( BOUND_KEY, BOUND_POSITION ) = ( None, None ) # The last point of the window which ends soonest, among the runs with more on disk
+            for ( j, ( start, end ) ) in enumerate( Runs ):
+                if len( Windows[j] ) == 0 and Cursors[j] < end:
+                    stop = min( Cursors[j] + WINDOW, end )
+                    Windows[j] = SpatialKeys.MortonKeys( Sorted[0][ Cursors[j]:stop ], Sorted[1][ Cursors[j]:stop ], BBOX )
+                last = Cursors[j] + len( Windows[j] ) - 1
+                if last + 1 < end and ( BOUND_KEY == None or ( Windows[j][-1], last ) < ( BOUND_KEY, BOUND_POSITION ) ):
+                    ( BOUND_KEY, BOUND_POSITION ) = ( Windows[j][-1], last )
+            Counts = list()
+            for ( j, keys ) in enumerate( Windows ):
+                if BOUND_KEY == None:
+                    Counts.append( len( keys ) )
+                    continue
+                # The keys are sorted, and points with equal keys are in the order they were appended, so the points to write are a prefix
+                ( below, through ) = ( int( np.searchsorted( keys, BOUND_KEY, "left" ) ), int( np.searchsorted( keys, BOUND_KEY, "right" ) ) )
+                Counts.append( below + min( max( BOUND_POSITION - ( Cursors[j] + below ) + 1, 0 ), through - below ) )
+            keys = np.concatenate( [ Windows[j][ :count ] for ( j, count ) in enumerate( Counts ) ] )
+            positions = np.concatenate( [ np.arange( Cursors[j], Cursors[j] + count ) for ( j, count ) in enumerate( Counts ) ] )
+            order = np.lexsort( ( positions, keys ) )
+            for ( offset, ( name, dtype ), column ) in zip( offsets, self.Columns, Sorted ):
+                values = np.concatenate( [ column[ Cursors[j]:Cursors[j] + count ] for ( j, count ) in enumerate( Counts ) ] )
+                f.seek( offset + written * dtype.itemsize )
+                f.write( values[ order ].tobytes() )
+            for ( j, count ) in enumerate( Counts ):
+                Windows[j] = Windows[j][ count: ]
+                Cursors[j] += count
+            written += len( keys )
+        del Sorted # Release the maps, so that the run files can be removed
+
+    # Abandons the tile, removing the temporary column files
+    def Abort( self ):
+        for spill in self.Spills:
+            spill.close()
+        self.RemoveSpills()
+
+    def RemoveSpills( self ):
+        for path in self.SpillPaths + self.RunPaths:
+            try:
+                os.remove( path )
+            except OSError:
+                pass # If the file isn't there any more, then we don't care
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, type, value, traceback ):
+        if type == None:
+            self.Close()
+        else:
+            self.Abort()
+
+# A tile opened for reading. Every column is a read-only view straight onto the memory-mapped file, so nothing is read until it is used.
+# Subsets of the points can be pulled out by bounding box and depth range with Query()
+class Tile( object ):
+    def __init__( self, FILE_PATH ):
+        header = ReadHeader( FILE_PATH )
+        self.FilePath = FILE_PATH
+        self.Count = header[ "count" ]
+        self.BBox = header[ "bbox" ]
+        self.CRS = header[ "crs" ]
+        self.Columns = dict()
+        self.ColumnNames = list()
+        size = os.path.getsize( FILE_PATH )
+        Map = np.memmap( FILE_PATH, dtype=np.uint8, mode="r", shape=( size, ) ) if size > 0 else None
+        for column in header[ "columns" ]:
+            dtype = np.dtype( column[ "dtype" ] )
+            start = column[ "offset" ]
+            end = start + self.Count * dtype.itemsize
+            if end > size:
+                raise ValueError( "%s is truncated." % FILE_PATH )
+            self.Columns[ column[ "name" ] ] = Map[ start:end ].view( dtype )
+            self.ColumnNames.append( column[ "name" ] )
+        # The block index, if the tile has one. Maps the name of each index array to a view of it
+        self.Index = None
+        self.BlockSize = None
+        if header.get( "index" ) != None:
+            self.BlockSize = header[ "index" ][ "block_size" ]
+            BLOCKS = header[ "index" ][ "blocks" ]
+            self.Index = dict()
+            for column in header[ "index" ][ "columns" ]:
+                dtype = np.dtype( column[ "dtype" ] )
+                start = column[ "offset" ]
+                end = start + BLOCKS * dtype.itemsize
+                if end > size:
+                    raise ValueError( "%s is truncated." % FILE_PATH )
+                self.Index[ column[ "name" ] ] = Map[ start:end ].view( dtype ) if BLOCKS > 0 else np.empty( 0, dtype=dtype )
+
+    def __getitem__( self, name ):
+        return self.Columns[ name ]
+
+    def __len__( self ):
+        return self.Count
+
+    # @return = A tuple of the ( x, y, z ) columns
+    def XYZ( self ):
+        return ( self.Columns[ "x" ], self.Columns[ "y" ], self.Columns[ "z" ] )
+
+    # Returns True if some of the tile's points might fall within the given bounds, judging by the tile's bounding box
+    def MightContain( self, BBOX=None, ZRANGE=None ):
+        return BBoxMightContain( self.BBox, BBOX, ZRANGE )
+
+    # Finds the runs of rows which have to be scanned to answer a query. Without an index, that's every row
+    # @return = A list of ( start, end ) row ranges
+    def CandidateRanges( self, BBOX=None, ZRANGE=None ):
+        if self.MightContain( BBOX, ZRANGE ) == False:
+            return list()
+        if self.Index == None:
+            return [ ( 0, self.Count ) ]
+        ( XMIN, YMIN, XMAX, YMAX ) = BBOX if BBOX != None else ( None, None, None, None )
+        ( ZMIN, ZMAX ) = ZRANGE if ZRANGE != None else ( None, None )
+        keep = np.ones( len( self.Index[ "xmin" ] ), dtype=bool )
+        for ( axis, LOW, HIGH ) in ( ( "x", XMIN, XMAX ), ( "y", YMIN, YMAX ), ( "z", ZMIN, ZMAX ) ):
+            if HIGH != None:
+                keep &= self.Index[ axis + "min" ] <= HIGH
+            if LOW != None:
+                keep &= self.Index[ axis + "max" ] >= LOW
+        blocks = np.flatnonzero( keep )
+        if len( blocks ) == 0:
+            return list()
+        # Consecutive blocks are merged into a single run, so that each run is one contiguous read
+        breaks = np.flatnonzero( np.diff( blocks ) != 1 ) + 1
+        firsts = blocks[ np.concatenate( ( [ 0 ], breaks ) ) ]
+        lasts = blocks[ np.concatenate( ( breaks - 1, [ len( blocks ) - 1 ] ) ) ]
+        return [ ( int( first ) * self.BlockSize, min( ( int( last ) + 1 ) * self.BlockSize, self.Count ) ) for ( first, last ) in zip( firsts, lasts ) ]
+
+    # Pulls out the points within a bounding box and depth range. Bounds are inclusive
+    # @param BBOX = The box, as ( xmin, ymin, xmax, ymax ). Any bound may be None, for unbounded. If None, x and y are unbounded
+    # @param ZRANGE = The depth range, as ( zmin, zmax ). Either bound may be None. If None, z is unbounded
+    # @param Columns = The names of the columns to return. Defaults to x, y and z
+    # @return = A dict mapping the name of each column to an array of its values for the selected points
+    def Query( self, BBOX=None, ZRANGE=None, Columns=None ):
+        if Columns == None:
+            Columns = [ "x", "y", "z" ]
+        ( XMIN, YMIN, XMAX, YMAX ) = BBOX if BBOX != None else ( None, None, None, None )
+        ( ZMIN, ZMAX ) = ZRANGE if ZRANGE != None else ( None, None )
+        Selected = dict( [ ( name, list() ) for name in Columns ] )
+        for ( START, END ) in self.CandidateRanges( BBOX, ZRANGE ):
+            for start in range( START, END, SCAN_SIZE ):
+                end = min( start + SCAN_SIZE, END )
+                keep = np.ones( end - start, dtype=bool )
+                for ( axis, LOW, HIGH ) in ( ( "x", XMIN, XMAX ), ( "y", YMIN, YMAX ), ( "z", ZMIN, ZMAX ) ):
+                    if LOW != None or HIGH != None:
+                        values = self.Columns[ axis ][ start:end ]
+                        if LOW != None:
+                            keep &= values >= LOW
+                        if HIGH != None:
+                            keep &= values <= HIGH
+                for name in Columns:
+                    Selected[ name ].append( self.Columns[ name ][ start:end ][ keep ] )
+        return dict( [ ( name, np.concatenate( Selected[ name ] ) if len( Selected[ name ] ) > 0 else np.empty( 0, dtype=self.Columns[ name ].dtype ) )
+                       for name in Columns ] )
+
+# Returns True if points within a tile's bounding box might fall within the given bounds
+# @param TILE_BBOX = The tile's bounding box, as [ xmin, ymin, zmin, xmax, ymax, zmax ]. None if the tile is empty
+def BBoxMightContain( TILE_BBOX, BBOX=None, ZRANGE=None ):
+    if TILE_BBOX == None:
+        return False
+    ( XMIN, YMIN, XMAX, YMAX ) = BBOX if BBOX != None else ( None, None, None, None )
+    ( ZMIN, ZMAX ) = ZRANGE if ZRANGE != None else ( None, None )
+    return ( Overlaps( TILE_BBOX[0], TILE_BBOX[3], XMIN, XMAX ) and Overlaps( TILE_BBOX[1], TILE_BBOX[4], YMIN, YMAX )
+             and Overlaps( TILE_BBOX[2], TILE_BBOX[5], ZMIN, ZMAX ) )
+
+# Opens a tile for reading
+def ReadTile( FILE_PATH ):
+    return Tile( FILE_PATH )
+
+# Pulls out the points within a bounding box and depth range from every tile of a survey. Tiles whose bounding boxes miss the query are
+# skipped after reading only their headers
+# @param FILE_PATHS = The tiles to query
+# @return = A dict mapping the name of each column to an array of its values for the selected points, from every tile in turn
+def QueryTiles( FILE_PATHS, BBOX=None, ZRANGE=None, Columns=None ):
+    if Columns == None:
+        Columns = [ "x", "y", "z" ]
+    Results = list()
+    for FILE_PATH in FILE_PATHS:
+        if BBoxMightContain( ReadHeader( FILE_PATH )[ "bbox" ], BBOX, ZRANGE ):
+            Results.append( ReadTile( FILE_PATH ).Query( BBOX, ZRANGE, Columns ) )
+    if len( Results ) == 0:
+        return dict( [ ( name, np.empty( 0, dtype=np.float64 ) ) for name in Columns ] )
+    return dict( [ ( name, np.concatenate( [ result[ name ] for result in Results ] ) ) for name in Columns ] )
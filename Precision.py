@@ -0,0 +1,151 @@
+# Precision
+# Compact in-memory representations of points, for the numeric stages which hold a whole file at once (z-score filtering, outlier analysis).
+# Full precision keeps x, y and z as float64, at 24 bytes a point. The compact representations take 12 bytes a point, so twice as much of a
+# survey fits in memory:
+#   FLOAT32   - x and y as float32 offsets from an origin near the points, and z as float32. The error grows with the distance from the origin:
+#               half a float32 step, which is about 4mm at 100km
+#   QUANTIZED - x and y as int32 multiples of a fixed step (LAS-style scaled integers) from the origin, and z as float32. The error in x and y is
+#               at most half a step, wherever the points are
+# z is float32 in both, which is exact to within half a millimeter at the depth of the deepest trench.
+# Compact points are only ever compared with each other (neighbor distances, z statistics), so the numeric stages work on them directly, in
+# units of Scale, and only turn them back into coordinates for the points they keep.
+
+import math
+import numpy as np
+import BathyConfig
+
+FLOAT64 = "float64"
+FLOAT32 = "float32"
+QUANTIZED = "quantized"
+
+# The bytes taken by a single point in each representation
+POINT_BYTES = { FLOAT64: 24, FLOAT32: 12, QUANTIZED: 12 }
+
+# The widest range of int32 multiples a quantized coordinate may take
+INT32_LIMIT = 2 ** 31 - 1
+
+# The number of points converted at a time by FromArrays
+BLOCK_SIZE = 1024 * 1024
+
+# Points held in one of the representations above. Points are added a block at a time with Append, and the arrays grow as needed.
+# X and Y are in units of Scale, counted from Origin: the coordinates of a point are ( Origin[0] + X * Scale, Origin[1] + Y * Scale )
+# @param PRECISION = One of FLOAT64, FLOAT32 or QUANTIZED. Defaults to the value specified in BathyConfig
+# @param QUANTUM = The step x and y are quantized to, in the units of the points' coordinate system. Defaults to the value specified in BathyConfig
+# @param CAPACITY = The number of points to make room for at first
+class CompactPoints( object ):
+    def __init__( self, PRECISION=None, QUANTUM=None, CAPACITY=0 ):
+        if PRECISION == None:
+            PRECISION = BathyConfig.POINT_PRECISION
+        if PRECISION not in POINT_BYTES:
+            raise ValueError( "Unknown point precision: %s" % PRECISION )
+        if QUANTUM == None:
+            QUANTUM = BathyConfig.POINT_QUANTUM
+        self.Precision = PRECISION
+        self.Scale = float( QUANTUM ) if PRECISION == QUANTIZED else 1.0
+        self.Origin = None # Set from the first block of points. Always ( 0, 0 ) at full precision
+        XY_DTYPE = { FLOAT64: np.float64, FLOAT32: np.float32, QUANTIZED: np.int32 }[ PRECISION ]
+        Z_DTYPE = np.float64 if PRECISION == FLOAT64 else np.float32
+        self.Arrays = [ np.empty( CAPACITY, dtype=XY_DTYPE ), np.empty( CAPACITY, dtype=XY_DTYPE ), np.empty( CAPACITY, dtype=Z_DTYPE ) ]
+        self.Count = 0
+        self.MaxError = [ 0.0, 0.0, 0.0 ] # The largest difference between a point as given and as held, in x, y and z
+
+    @property
+    def X( self ):
+        return self.Arrays[0][ :self.Count ]
+
+    @property
+    def Y( self ):
+        return self.Arrays[1][ :self.Count ]
+
+    @property
+    def Z( self ):
+        return self.Arrays[2][ :self.Count ]
+
+    # The bytes the points take up
+    def Bytes( self ):
+        return self.Count * POINT_BYTES[ self.Precision ]
+
+    # Adds a block of points
+    def Append( self, x, y, z ):
+        n = len( z )
+        if n == 0:
+            return
+        if self.Origin == None:
+            # Whole units, so that the origin is exact in any representation
+            self.Origin = ( 0.0, 0.0 ) if self.Precision == FLOAT64 else ( math.floor( float( np.min( x ) ) ), math.floor( float( np.min( y ) ) ) )
+        if self.Count + n > len( self.Arrays[0] ):
+            capacity = max( self.Count + n, 2 * len( self.Arrays[0] ) )
+            self.Arrays = [ np.resize( array, capacity ) for array in self.Arrays ]
+        block = slice( self.Count, self.Count + n )
+        for ( axis, values ) in enumerate( ( x, y ) ):
+            self.Arrays[ axis ][ block ] = self.Encode( values, self.Origin[ axis ] )
+        self.Arrays[2][ block ] = z
+        if self.Precision != FLOAT64:
+            for ( axis, values ) in enumerate( ( x, y, z ) ):
+                decoded = self.Decode( self.Arrays[ axis ][ block ], axis )
+                self.MaxError[ axis ] = max( self.MaxError[ axis ], float( np.max( np.abs( decoded - values ) ) ) )
+        self.Count += n
+
+    # Converts coordinates along x or y into units from the origin, in the dtype they are held in
+    def Encode( self, values, ORIGIN ):
+        if self.Precision == FLOAT64:
+            return values
+        units = ( np.asarray( values, dtype=np.float64 ) - ORIGIN ) / self.Scale
+        if self.Precision == FLOAT32:
+            return units
+        units = np.rint( units )
+        if np.any( np.abs( units ) > INT32_LIMIT ):
+            raise ValueError( "Points span more than %s steps of %s from their origin, too many to quantize. Use a larger POINT_QUANTUM, or "
+                              "FLOAT32 precision." % ( INT32_LIMIT, self.Scale ) )
+        return units
+
+    # Converts values held along an axis (0, 1 or 2 for x, y or z) back into float64 coordinates
+    def Decode( self, values, axis ):
+        if self.Precision == FLOAT64:
+            return values
+        if axis == 2:
+            return values.astype( np.float64 )
+        return self.Origin[ axis ] + values.astype( np.float64 ) * self.Scale
+
+    # Returns the coordinates of the points, as float64 arrays
+    # @param selection = Picks out the points to return, e.g. a boolean mask. Defaults to every point
+    # @return = A tuple of ( x, y, z )
+    def XYZ( self, selection=None ):
+        if selection is None: # selection may be an array, which can't be compared to None
+            selection = slice( None )
+        return tuple( [ self.Decode( array[ selection ], axis ) for ( axis, array ) in enumerate( ( self.X, self.Y, self.Z ) ) ] )
+
+    # Returns the largest error the representation can introduce, in x, y and z, given the extent of the points. The errors actually
+    # introduced are in MaxError
+    def ErrorBounds( self ):
+        if self.Precision == FLOAT64 or self.Count == 0:
+            return [ 0.0, 0.0, 0.0 ]
+        Bounds = list()
+        for ( axis, array ) in enumerate( ( self.X, self.Y, self.Z ) ):
+            if array.dtype.kind == "i":
+                Bounds.append( self.Scale / 2 ) # Half a step, wherever the point is
+            else:
+                Bounds.append( float( np.spacing( np.max( np.abs( array ) ) ) ) / 2 * ( self.Scale if axis < 2 else 1.0 ) ) # Half a step at the largest magnitude held
+        return Bounds
+
+    # Describes the representation and its errors, for reporting
+    def Describe( self ):
+        return "%s points held at %s precision (%.1f MB). Error bound x/y/z: %s, largest error: %s" % (
+            self.Count, self.Precision, self.Bytes() / 1e6, "/".join( [ "%.3g" % e for e in self.ErrorBounds() ] ),
+            "/".join( [ "%.3g" % e for e in self.MaxError ] ) )
+
+# Holds points given as float64 arrays. At full precision the arrays are held as they are, without copying (so memory-mapped columns
+# stay memory-mapped)
+# @return = The CompactPoints
+def FromArrays( x, y, z, PRECISION=None, QUANTUM=None ):
+    if PRECISION == None:
+        PRECISION = BathyConfig.POINT_PRECISION
+    points = CompactPoints( PRECISION, QUANTUM, 0 if PRECISION == FLOAT64 else len( z ) )
+    if PRECISION == FLOAT64:
+        points.Arrays = [ x, y, z ]
+        ( points.Count, points.Origin ) = ( len( z ), ( 0.0, 0.0 ) )
+        return points
+    for start in range( 0, len( z ), BLOCK_SIZE ): # A block at a time, which bounds the float64 temporaries
+        end = start + BLOCK_SIZE
+        points.Append( x[start:end], y[start:end], z[start:end] )
+    return points
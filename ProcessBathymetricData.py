@@ -1,48 +1,57 @@
 # Process Bathymetric Data
 # Main script for the larger program.
-# TODO: Add logic to handle an improper shutdown. Specifically, finding the last file the system was editing, and rewriting it
+# Progress is recorded in a manifest as files move through the stages. Outputs are written under temporary names, and only renamed once
+# complete. Stages which stream their input save checkpoints as they go, and after an improper shutdown they carry on from the last one.
+# Other partially written outputs are removed, and the affected files are processed again.
+# Each stage's outputs are cached by the contents of its input and its parameters, so rerunning the script only redoes the work whose inputs
+# or settings have changed
 
 import BathyConfig
 import BathyToolbox
 import OSToolbox
-import Threader
+import Pipeline
+import Manifest
+import ResultCache
+import ZScoreFilter
+import OutlierFilter
+import Gridder
+import Metrics
+import Progress
+import Projection
 import DirectoryManager
 import shutil
+import functools
 import os
 import time
-import arcpy
 import sys
-
-# The root of the directory which the script will walk through looking for all raw data (raw data meaning all data which has yet to be used by this script)
-INPUT_FILE_DIRECTORY_ROOT = BathyConfig.INPUT_ROOT_FOLDER
-
-# The root directory where all intermediate file subdirectories will be held.
-OUTPUT_DIRECTORY = BathyConfig.OUTPUT_ROOT_FOLDER
-
-# Directories where intermediate files will be held
-XYZ_HEADER_OUTPUT_DIRECTORY = os.path.join( OUTPUT_DIRECTORY, "XYZ_Headers_Added" ) # Where XYZ files will go after having headers added to them
-SHAPEFILE_OUTPUT_DIRECTORY = os.path.join( OUTPUT_DIRECTORY, "Unprojected_Shapefiles" ) # Where Shapefiles processed from XYZ files will go
-PROJ_OUTPUT_DIRECTORY = os.path.join( OUTPUT_DIRECTORY, "Projected_Shapefiles" ) # Where Shapefiles will go after being projected to the desired coordinate system
-OL_OUTPUT_DIRECTORY = os.path.join( OUTPUT_DIRECTORY, "Outlier_Analysis_Performed" ) # Where Shapefiles will go after having an outlier analysis performed on them
-
-UNPROJECTABLE_DIRECTORY = os.path.join( OUTPUT_DIRECTORY, "Unprojectable_Files" ) # Where Shapefiles go if they cannot be projected. For whatever reason
-if os.path.isdir( UNPROJECTABLE_DIRECTORY ):
-	pass
-else:
-	os.mkdir( UNPROJECTABLE_DIRECTORY )
-
-INPUT_FILE_FORMAT = BathyConfig.INPUT_FILE_FORMAT
-
-# The threading manager we will use to provide multi-threading capability
-ThreadingManager = Threader.ThreadingManager( max=BathyConfig.MAX_ALLOWED_THREADS )
-
-# Directory Managers. Used to make sure that the new files are arranged neatly and cleanly in their new directories
-INPUTDirectoryManager = DirectoryManager.GetDirectoryManagerForDirectory( INPUT_FILE_DIRECTORY_ROOT )
-XYZDirectoryManager = DirectoryManager.GetDirectoryManagerForDirectory( XYZ_HEADER_OUTPUT_DIRECTORY, FolderClassName="XYZHeader_" )
-SHPDirectoryManager = DirectoryManager.GetDirectoryManagerForDirectory( SHAPEFILE_OUTPUT_DIRECTORY, FolderClassName="Shapefile_" )
-PRJDirectoryManager = DirectoryManager.GetDirectoryManagerForDirectory( PROJ_OUTPUT_DIRECTORY, FolderClassName="Projected_To_AA_" )
-OLDirectoryManager  = DirectoryManager.GetDirectoryManagerForDirectory( OL_OUTPUT_DIRECTORY, FolderClassName="Outliers_Removed_" )
-# For each of the following methods, the DirectoryManager passed to the method should refer to the directory where the files will be processed to, not from
+import RunConfig
+
+# The subdirectories of the output root where intermediate files will be held, by the stage which writes them, as ( subdirectory, FolderClassName )
+STAGE_DIRECTORIES = {
+	"Headers": ( "XYZ_Headers_Added", "XYZHeader_" ), # Where XYZ files will go after having headers added to them
+	"ZScores": ( "Z_Scores_Filtered", "ZScores_Filtered_" ), # Where XYZ files will go after having their extreme z-scores removed
+	"Shapefiles": ( "Unprojected_Shapefiles", "Shapefile_" ), # Where Shapefiles processed from XYZ files will go
+	"Projection": ( "Projected_Shapefiles", "Projected_To_AA_" ), # Where Shapefiles will go after being projected to the desired coordinate system
+	"Outliers": ( "Outlier_Analysis_Performed", "Outliers_Removed_" ), # Where Shapefiles will go after having an outlier analysis performed on them
+	"Grid": ( "Gridded", "Gridded_" ) } # Where the grids of depth statistics made from each file will go
+
+UNPROJECTABLE_DIRECTORY_NAME = "Unprojectable_Files" # Where Shapefiles go if they cannot be projected. For whatever reason
+
+# Creates the output directories under OUTPUT_DIRECTORY, and the Directory Managers which make sure that the new files are arranged neatly and
+# cleanly in them. Nothing is created until the script runs, so importing this module touches no files
+# @return = A dict of the DirectoryManager of each stage, by stage name
+def CreateDirectoryManagers( OUTPUT_DIRECTORY ):
+	if os.path.isdir( OUTPUT_DIRECTORY ) == False:
+		os.makedirs( OUTPUT_DIRECTORY )
+	UNPROJECTABLE_DIRECTORY = os.path.join( OUTPUT_DIRECTORY, UNPROJECTABLE_DIRECTORY_NAME )
+	if os.path.isdir( UNPROJECTABLE_DIRECTORY ):
+		pass
+	else:
+		os.mkdir( UNPROJECTABLE_DIRECTORY )
+	Managers = dict()
+	for ( STAGE, ( SUBDIRECTORY, FolderClassName ) ) in STAGE_DIRECTORIES.items():
+		Managers[ STAGE ] = DirectoryManager.GetDirectoryManagerForDirectory( os.path.join( OUTPUT_DIRECTORY, SUBDIRECTORY ), FolderClassName=FolderClassName )
+	return Managers
 
 # Accepts a list of filepaths, and returns a list containing only the names of the files those paths pointed to.
 # Containing directories and extensions are removed
@@ -54,21 +63,6 @@ def PruneDownToFilenames( list ):
 	
 	return PrunedList
 	
-# Accepts a pair of filepath lists, and removes from the first list all elements whose names appear in the second list
-# Names do not have to be an exact match, the second list element only has to contain the first list element. Additional name tags can be present
-def RemoveCommonElements( List1, List2 ):
-	List1Copy = list(List1) # Workaround for shitty python logic
-	for entry1 in List1Copy:
-		for entry2 in List2:
-			( ENTRY1DIR, ENTRY1NAME, ENTRY1EXT ) = BathyToolbox.SplitFilePath( entry1 )
-			( ENTRY2DIR, ENTRY2NAME, ENTRY2EXT ) = BathyToolbox.SplitFilePath( entry2 )
-			# This loop covers every possible pairing of elements between list 1 and 2
-			if ENTRY1NAME in ENTRY2NAME:
-				List1.remove( entry1 )
-				BathyConfig.ConditionalPrint( "%s has already been processed." % ENTRY1NAME )
-				break
-	return List1
-
 def ParseErrorCode( exception ):
 	index = exception.find( "ERROR" ) + 6
 	error_code = exception[index:index+6]
@@ -78,89 +72,106 @@ def ParseErrorCode( exception ):
 def HandleGeoprocessingError( ERROR_CODE, File ):
 	BathyConfig.ConditionalPrint( "Error code %s occurred while processing %s.", ( ERROR_CODE, File ) )
 	
-# Finds all entries in Files which have corresponding entries somewhere in the directory managed by DM and removes them from the list of files to be processed.
-# Then calls Function on each entry of Files.
-# Uses threading if activated by BathyConfig
-def ProcessUnprocessedFiles( Function, Files, DM, EXT="" ):
-	Files = RemoveCommonElements( Files, DM.GetAllFiles() ) # Remove from the list of files to be processed all those files which have already been processed
-	for File in Files:
-		# For each of the files in the passed list...
-		( name, extension ) = os.path.splitext( File )
-		if EXT != "" and EXT != extension:
-			BathyConfig.ConditionalPrint( "%s is of the wrong format.", name )
-			continue
-        # Here we pass to the function the file we want processed, and the directory we want the file processed to via the DirectoryManager		
-		BathyConfig.ConditionalPrint( "Now processing %s", File )
-		try:
-			if BathyConfig.USE_THREADING == True:
-				StartThreadedProcess( Function, ( File, DM.GetDirectory() ) )
-			else:
-				Function( File, DM.GetDirectory() )
-		except arcpy.ExecuteError:
-			e = sys.exc_info()[1]
-			ERROR_CODE = ParseErrorCode( e.args[0] )
-			HandleGeoprocessingError( ERROR_CODE, File )
-		except Exception:
-			print( "Runtime error has occurred." )
-			
-	
-# Add a header to all of the XYZ Files
-# @param XYZFiles = A list of all XYZ Files to be processed. Expressed as filepaths
-# @param XYZDM = The appropriate DirectoryManager
-def AddHeadersToXYZFiles( XYZFiles, XYZDM ):
-	BathyConfig.ConditionalPrint( "Adding headers to XYZFiles..." )
-	ProcessUnprocessedFiles( BathyToolbox.AddHeaderToXYZFile, XYZFiles, XYZDM )
-		
-# Process the XYZFiles to Shapefiles
-# @param XYZDM = The DirectoryManager for the directory containing all of the XYZ files with headers
-# @param SHPDM = The DirectoryManager for the directory where all un projected shapefiles will be kept
-def ProcessXYZFilesToShapefiles( XYZDM, SHPDM ):
-	BathyConfig.ConditionalPrint( "Processing XYZ Files to Shapefiles..." )
-	ProcessUnprocessedFiles( BathyToolbox.ProcessXYZtoShapefile, XYZDM.GetAllFiles(), SHPDM )
-
-# Project the Shapefiles into the proper projection (Which projection to use is specified in BathyConfig)
-# @param SHPDM = The DirectoryManager for the directory containing all of the unprojected Shapefiles
-# @param PRJDM = The DirectoryManager for the directory where all projected shapefiles will be kept
-def ProjectShapefiles( SHPDM, PRJDM ):
-	BathyConfig.ConditionalPrint( "Projecting Shapefiles..." )
-	ProcessUnprocessedFiles( BathyToolbox.ProjectShapefile, SHPDM.GetAllFiles(), PRJDM, EXT=".shp" )
-
-# Function that repeatedly attempts to create a thread until it is successfully created
-# Respects the maximum number of allowable threads
-def StartThreadedProcess( Function, Args ):
-    created = False
-    while created == False: # Until the thread is successfully created, we must keep trying to create it. Periodically though, so as not to hog processor cycles
-        try:
-			BathyConfig.ConditionalPrint( "Attempting to create thread." )
-			ThreadingManager.CreateNewFunctionThread( Function, Args )
-			created = True # The thread has been created, so we can exit the while loop
-			BathyConfig.ConditionalPrint( "Thread created." )
-        except Exception as e: # TODO: Should be specific to a TooManyThreadsActive Exception
-			BathyConfig.ConditionalPrint( "Too many threads active. Waiting for threads to finish." )
-            # There are too many threads active at the moment, so we need to wait a while, and then try again.
-			time.sleep( BathyConfig.WAIT_TIME_AFTER_THREAD_CREATION_FAILURE ) # Wait the amount of time specified by the BathyConfig file
+# An exception was raised while processing File, either directly or in a worker. Deal with it
+def HandleProcessingError( e, File ):
+	# Only a geoprocessing error if arcpy has been loaded, and an error is no reason to load it
+	if "arcpy" in sys.modules and isinstance( e, sys.modules[ "arcpy" ].ExecuteError ):
+		ERROR_CODE = ParseErrorCode( e.args[0] )
+		HandleGeoprocessingError( ERROR_CODE, File )
+	else:
+		print( "Runtime error has occurred while processing %s: %r" % ( File, e ) )
 
 # Main script ------------------------------------------------------------------>
-# First we have to satisfy ESRI that we're not stealing from them
-BathyToolbox.GetNecessaryLicenses()
-
-
-# First, we generate a list of all files in the directory tree, rooted at INPUT_FILE_DIRECTORY_ROOT, which are of the specified format
-XYZ_FILES = DirectoryManager.FindFiles( INPUT_FILE_DIRECTORY_ROOT, ext=".csv" ) # A list of file paths, each pointing to a separate file which we're going to process
-SHP_FILES = DirectoryManager.FindFiles( INPUT_FILE_DIRECTORY_ROOT, ext=".shp" )
-
-AddHeadersToXYZFiles( XYZ_FILES, XYZDirectoryManager )
-
-# Wait for the threads to finish
-while ThreadingManager.isBusy():
-    time.sleep( BathyConfig.MAIN_THREAD_SLEEP_TIME_WHILE_PROCESSING ) # The main thread checks in at intervals >= the value specified in BathyConfig
-	
-# Here we process the XYZ files into Shapefiles
-ProcessXYZFilesToShapefiles( XYZDirectoryManager, SHPDirectoryManager )
-
-# Wait for the threads to finish
-while ThreadingManager.isBusy():
-    time.sleep( BathyConfig.MAIN_THREAD_SLEEP_TIME_WHILE_PROCESSING ) # The main thread checks in at intervals >= the value specified in BathyConfig
-
-# Here we project the files into the desired coordinate system
-ProjectShapefiles( SHPDirectoryManager, PRJDirectoryManager )
\ No newline at end of file
+# Runs the whole process with the settings of a run. The settings are applied to BathyConfig for as long as the run lasts
+# @param Config = The RunConfig of the run. Defaults to the settings in BathyConfig
+# @return = The paths of the final outputs
+def Main( Config=None ):
+	if Config == None:
+		Config = RunConfig.RunConfig()
+	with Config.Applied():
+		return Run()
+
+# The body of the script. Every setting is read from BathyConfig
+def Run():
+	INPUT_FILE_DIRECTORY_ROOT = BathyConfig.INPUT_ROOT_FOLDER # The root of the directory which the script will walk through looking for all raw data
+	OUTPUT_DIRECTORY = BathyConfig.OUTPUT_ROOT_FOLDER # The root directory where all intermediate file subdirectories will be held
+	SURFACE_FILE = os.path.join( OUTPUT_DIRECTORY, "Surface" + Gridder.EXTENSION ) # The grids of every file, merged together
+	DMs = CreateDirectoryManagers( OUTPUT_DIRECTORY )
+
+	# First we have to satisfy ESRI that we're not stealing from them
+	BathyToolbox.GetNecessaryLicenses()
+
+	# First, we generate a list of all files in the directory tree, rooted at INPUT_FILE_DIRECTORY_ROOT, which are of the specified format
+	# The tree is scanned once for both formats
+	INPUT_FILES = DirectoryManager.FindFiles( INPUT_FILE_DIRECTORY_ROOT, ext=[ ".csv", ".shp" ] )
+	XYZ_FILES = [ File for File in INPUT_FILES if File.endswith( ".csv" ) ] # A list of file paths, each pointing to a separate file which we're going to process
+	SHP_FILES = [ File for File in INPUT_FILES if File.endswith( ".shp" ) ]
+
+	# The manifest records which files each stage has already processed. Anything left half-finished by an improper shutdown is cleaned up first
+	ProcessingManifest = Manifest.ProcessingManifest()
+	ProcessingManifest.RecoverIncompleteEntries()
+	Cache = ResultCache.ResultCache( ProcessingManifest )
+	Recorder = Metrics.CreateRecorder() # Measures every stage's work on every file
+	Reporter = Progress.CreateReporter() # Shows how far along every stage is. The pipelines report to it while it runs
+
+	# Each file flows through the stages on its own: headers are added, (extreme z-scores are removed,) it is processed into a shapefile,
+	# the shapefile is projected into the desired coordinate system, (its outliers are removed, and it is binned into a grid.)
+	# With native projection, the points are projected in memory as their headers are added, and there is no separate projection stage
+	Files = XYZ_FILES
+	if BathyConfig.USE_NATIVE_PROJECTION == True:
+		Projection.VerifyReferencePoints()
+		Stages = [ Pipeline.Stage( "Headers", functools.partial( BathyToolbox.AddHeaderToXYZFile, PROJECT=True ), DMs[ "Headers" ],
+			Parameters={ "INTERMEDIATE_FORMAT": BathyConfig.INTERMEDIATE_FORMAT, "INDEX_TILES": BathyConfig.INDEX_TILES,
+				"TILE_INDEX_BLOCK_SIZE": BathyConfig.TILE_INDEX_BLOCK_SIZE, "PROJECTION_WKT": BathyConfig.PROJECTION_WKT } ) ]
+	else:
+		Stages = [ Pipeline.Stage( "Headers", BathyToolbox.AddHeaderToXYZFile, DMs[ "Headers" ],
+			Parameters={ "INTERMEDIATE_FORMAT": BathyConfig.INTERMEDIATE_FORMAT, "INDEX_TILES": BathyConfig.INDEX_TILES,
+				"TILE_INDEX_BLOCK_SIZE": BathyConfig.TILE_INDEX_BLOCK_SIZE } ) ]
+
+	if BathyConfig.REMOVE_EXTREME_Z_SCORES == True:
+		Function = functools.partial( ZScoreFilter.RemoveExtremeZScoresFromXYZFile, MAX_MIN=BathyConfig.Z_SCORE_MAX_MIN )
+		# The points are held in POINT_PRECISION while they are filtered, which in float32 or quantized form rounds those written out
+		Parameters = { "Z_SCORE_MAX_MIN": BathyConfig.Z_SCORE_MAX_MIN, "POINT_PRECISION": BathyConfig.POINT_PRECISION, "POINT_QUANTUM": BathyConfig.POINT_QUANTUM,
+			"INDEX_TILES": BathyConfig.INDEX_TILES, "TILE_INDEX_BLOCK_SIZE": BathyConfig.TILE_INDEX_BLOCK_SIZE }
+		if BathyConfig.Z_SCORE_SURVEY_WIDE == True:
+			# Survey-wide statistics need the headers of every file to be added first, so the header stage runs to completion on its own
+			BathyConfig.ConditionalPrint( "Adding headers to XYZFiles..." )
+			Files = Pipeline.Pipeline( Stages, OnError=HandleProcessingError, Manifest=ProcessingManifest, Cache=Cache, Metrics=Recorder ).Run( Files )
+			Stats = ZScoreFilter.AccumulateSurveyZStatistics( Files )
+			BathyConfig.ConditionalPrint( "Survey z statistics: %s", Stats )
+			Function = functools.partial( Function, Stats=Stats )
+			Parameters[ "Stats" ] = Stats
+			Stages = list()
+		Stages.append( Pipeline.Stage( "ZScores", Function, DMs[ "ZScores" ], Parameters=Parameters ) )
+
+	Stages.append( Pipeline.Stage( "Shapefiles", BathyToolbox.ProcessXYZtoShapefile, DMs[ "Shapefiles" ],
+		Parameters={ "USE_NATIVE_SHAPEFILE_WRITER": BathyConfig.USE_NATIVE_SHAPEFILE_WRITER } ) )
+	if BathyConfig.USE_NATIVE_PROJECTION == False:
+		Stages.append( Pipeline.Stage( "Projection", BathyToolbox.ProjectShapefile, DMs[ "Projection" ], EXT=".shp",
+			Parameters={ "PROJECTION_WKT": BathyConfig.PROJECTION_WKT } ) )
+	if BathyConfig.REMOVE_OUTLIERS == True:
+		# The projected shapefiles are read straight into arrays, with no arcpy involved
+		Function = functools.partial( OutlierFilter.RemoveOutliersFromXYZFile, RADIUS=BathyConfig.OUTLIER_NEIGHBOR_RADIUS, MIN_BIN_SCORE=BathyConfig.MIN_BIN_SCORE )
+		Stages.append( Pipeline.Stage( "Outliers", Function, DMs[ "Outliers" ], EXT=".shp",
+			Parameters={ "OUTLIER_NEIGHBOR_RADIUS": BathyConfig.OUTLIER_NEIGHBOR_RADIUS, "MIN_BIN_SCORE": BathyConfig.MIN_BIN_SCORE,
+				"POINT_PRECISION": BathyConfig.POINT_PRECISION, "POINT_QUANTUM": BathyConfig.POINT_QUANTUM } ) )
+	if BathyConfig.GRID_SURFACE == True:
+		Function = functools.partial( Gridder.GridFile, CELL_SIZE=BathyConfig.GRID_CELL_SIZE )
+		Stages.append( Pipeline.Stage( "Grid", Function, DMs[ "Grid" ], Parameters={ "GRID_CELL_SIZE": BathyConfig.GRID_CELL_SIZE } ) )
+
+	BathyConfig.ConditionalPrint( "Processing %s files through %s stages...", ( len( Files ), len( Stages ) ) )
+	Outputs = Pipeline.Pipeline( Stages, OnError=HandleProcessingError, Manifest=ProcessingManifest, Cache=Cache, Metrics=Recorder ).Run( Files )
+	if BathyConfig.GRID_SURFACE == True:
+		# The grids line up cell for cell, so the survey's surface is just their merge
+		BathyConfig.ConditionalPrint( "Merging %s grids into %s...", ( len( Outputs ), SURFACE_FILE ) )
+		Gridder.MergeGridFiles( Outputs, SURFACE_FILE )
+	if Reporter != None:
+		Reporter.Stop()
+	Recorder.GetCounters().Report()
+	Recorder.Close()
+	ProcessingManifest.Close()
+	return Outputs
+
+# Guarded, so that worker processes which import this module don't run the script themselves. Settings can be given on the command line (see RunConfig)
+if __name__ == "__main__":
+	Main( RunConfig.FromArguments() )
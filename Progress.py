@@ -0,0 +1,221 @@
+# Progress
+# Live progress of the pipeline, shown on a single console line: for every stage, the files it has finished, the points per second it is
+# getting through, and an estimate of the time it has left.
+# Stage functions report the points they get through with Advance(), from their hot loops. Advance only adds to a counter local to the calling
+# thread, and hands the total on at most every FLUSH_INTERVAL seconds, so it costs next to nothing per call. Totals from worker threads go
+# straight to the ProgressReporter; totals from worker processes are sent to it through a queue.
+# The reporter redraws the line on its own thread at a fixed rate, so a flood of updates never turns into a flood of output.
+
+import functools
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+import BathyConfig
+import Display
+
+# The longest a worker holds on to its count of points before handing it on, in seconds
+FLUSH_INTERVAL = 0.25
+
+# How much each new measurement of the rate counts for, against the average of those before it. Smooths the points per second shown
+RATE_SMOOTHING = 0.3
+
+# Where the current process sends its totals: ProgressReporter.Add in the main process, or a queue's put in a worker process.
+# None when no reporter is running, in which case nothing is counted
+Sink = None
+
+# The stage the current thread is working for, and the points it hasn't yet handed on
+Local = threading.local()
+
+# Counts points towards the progress of the stage the calling thread is working for. Cheap enough to call once per block in any hot loop
+# @param POINTS = The number of points just processed
+def Advance( POINTS ):
+    STAGE = getattr( Local, "Stage", None )
+    if STAGE == None:
+        return
+    Local.Pending += POINTS
+    now = time.monotonic()
+    if now - Local.LastFlush >= FLUSH_INTERVAL:
+        Flush( now )
+
+# Hands the calling thread's count of points on to the reporter
+def Flush( now=None ):
+    if Local.Pending > 0 and Sink != None:
+        Sink( ( Local.Stage, Local.Pending ) )
+    Local.Pending = 0
+    Local.LastFlush = time.monotonic() if now == None else now
+
+# Runs a stage's function, with the points it reports counted towards the stage. Lives at module level so that it can be sent to pool processes
+# @param STAGE = The name of the stage
+# @param Arguments = The arguments of the stage's function
+def StageCall( Function, STAGE, *Arguments ):
+    ( Local.Stage, Local.Pending, Local.LastFlush ) = ( STAGE, 0, time.monotonic() )
+    try:
+        return Function( *Arguments )
+    finally:
+        Flush()
+        Local.Stage = None
+
+# Wraps a stage's function so that the points it reports are counted towards the stage
+# @return = A picklable function, taking the same arguments as Function
+def ForStage( Function, STAGE ):
+    return functools.partial( StageCall, Function, STAGE )
+
+# Prepares a worker process to send its totals to the reporter. Run by the pools of worker processes as they start
+# @param Queue = The reporter's queue, or None if no reporter is running
+def InitializeWorker( Queue ):
+    global Sink
+    Sink = None if Queue == None else Queue.put
+
+# Returns the queue which worker processes should send their totals through, or None if no reporter is running
+def GetWorkerQueue():
+    if Reporter == None:
+        return None
+    return Reporter.Queue
+
+# The reporter which is currently running, if any
+Reporter = None
+
+# The running totals of a single stage
+class StageProgress( object ):
+    def __init__( self ):
+        self.Files = 0
+        self.Total = None # The number of files the stage is expected to see. None if unknown
+        self.Points = 0
+        self.Started = None # The time the stage's files were first queued, or it first reported points
+        self.Rate = None # Points per second, smoothed
+        self.LastPoints = 0 # The points counted when the line was last drawn
+
+    # True once the stage has seen every file it was expecting
+    def IsFinished( self ):
+        return self.Total != None and self.Files >= self.Total
+
+    # Describes the stage's progress, e.g. "ZScores 12/40 1.5M/s ETA 00:03:10"
+    def Describe( self, STAGE, now ):
+        description = "%s %s" % ( STAGE, self.Files )
+        if self.Total != None:
+            description += "/%s" % self.Total
+        if self.Rate != None:
+            description += " %s/s" % FormatCount( self.Rate )
+        if self.Total != None and self.Files > 0 and self.Started != None and self.IsFinished() == False:
+            remaining = ( self.Total - self.Files ) * ( now - self.Started ) / self.Files # From the average time taken per file so far
+            description += " ETA %s" % time.strftime( "%H:%M:%S", time.gmtime( remaining ) )
+        return description
+
+# Collects the progress of every stage, and draws it to the console at a fixed rate. Only the stages which are under way are shown
+# @param REFRESH_RATE = The number of times a second the progress line is redrawn. Defaults to the value specified in BathyConfig
+class ProgressReporter( object ):
+    def __init__( self, REFRESH_RATE=None ):
+        if REFRESH_RATE == None:
+            REFRESH_RATE = BathyConfig.PROGRESS_REFRESH_RATE
+        self.Interval = 1.0 / REFRESH_RATE
+        self.Progress = dict() # Maps the name of each stage to its StageProgress, in the order the stages were first heard from
+        self.Lock = threading.RLock()
+        self.Display = Display.DisplayManager()
+        self.Queue = None # Created when the reporter starts, if stages run in worker processes
+        self.Stopped = threading.Event()
+        self.Thread = None
+        self.LastDraw = None
+
+    # Starts drawing, and begins collecting totals from this process and its worker processes
+    def Start( self ):
+        global Sink, Reporter
+        if BathyConfig.USE_PROCESSES == True:
+            self.Queue = multiprocessing.Queue()
+        ( Reporter, Sink ) = ( self, self.Add )
+        self.LastDraw = time.monotonic()
+        self.Thread = threading.Thread( target=self.Run, name="Progress" )
+        self.Thread.daemon = True
+        self.Thread.start()
+        return self
+
+    # Stops drawing, and prints the final progress of every stage on its own line
+    def Stop( self ):
+        global Sink, Reporter
+        self.Stopped.set()
+        if self.Thread != None:
+            self.Thread.join()
+        self.Drain()
+        self.Draw( Everything=True )
+        sys.stdout.write( "\n" )
+        if Reporter is self:
+            ( Reporter, Sink ) = ( None, None )
+        if self.Queue != None:
+            self.Queue.close()
+
+    # Returns the progress of a stage, creating it if need be. Must be called under the lock
+    def Get( self, STAGE ):
+        if STAGE not in self.Progress:
+            self.Progress[ STAGE ] = StageProgress()
+        return self.Progress[ STAGE ]
+
+    # Sets the number of files a stage is expected to see, and starts its count of files over
+    def SetTotal( self, STAGE, TOTAL ):
+        with self.Lock:
+            progress = self.Get( STAGE )
+            ( progress.Files, progress.Total, progress.Started ) = ( 0, TOTAL, time.monotonic() )
+
+    # Adds points to a stage's total
+    # @param Update = A tuple of ( STAGE, POINTS )
+    def Add( self, Update ):
+        ( STAGE, POINTS ) = Update
+        with self.Lock:
+            progress = self.Get( STAGE )
+            progress.Points += POINTS
+            if progress.Started == None:
+                progress.Started = time.monotonic()
+
+    # Counts a file as done by a stage, whether it was processed, already cached, dropped, or failed
+    def FileDone( self, STAGE ):
+        with self.Lock:
+            progress = self.Get( STAGE )
+            progress.Files += 1
+
+    # Takes every total waiting in the queue from the worker processes
+    def Drain( self ):
+        if self.Queue == None:
+            return
+        while True:
+            try:
+                self.Add( self.Queue.get_nowait() )
+            except queue.Empty:
+                return
+
+    # The loop of the drawing thread
+    def Run( self ):
+        while self.Stopped.wait( self.Interval ) == False:
+            self.Drain()
+            self.Draw()
+
+    # Draws the progress of the stages on a single line
+    # @param Everything = If True, every stage is shown, including those which haven't started or have finished
+    def Draw( self, Everything=False ):
+        now = time.monotonic()
+        elapsed = max( now - self.LastDraw, 1e-9 )
+        self.LastDraw = now
+        Parts = list()
+        with self.Lock:
+            for ( STAGE, progress ) in self.Progress.items():
+                rate = ( progress.Points - progress.LastPoints ) / elapsed
+                progress.LastPoints = progress.Points
+                if progress.Points > 0:
+                    progress.Rate = rate if progress.Rate == None else RATE_SMOOTHING * rate + ( 1 - RATE_SMOOTHING ) * progress.Rate
+                if Everything == True or ( ( progress.Files > 0 or progress.Points > 0 ) and progress.IsFinished() == False ):
+                    Parts.append( progress.Describe( STAGE, now ) )
+        if len( Parts ) > 0:
+            self.Display.Display( " | ".join( Parts ) )
+
+# Formats a count with a metric suffix, e.g. 1.2M
+def FormatCount( value ):
+    for ( size, suffix ) in [ ( 1e9, "G" ), ( 1e6, "M" ), ( 1e3, "k" ) ]:
+        if abs( value ) >= size:
+            return "%.1f%s" % ( value / size, suffix )
+    return "%.0f" % value
+
+# Creates and starts a ProgressReporter, if BathyConfig asks for progress to be shown
+# @return = The reporter, or None
+def CreateReporter():
+    if BathyConfig.SHOW_PROGRESS == False:
+        return None
+    return ProgressReporter().Start()
@@ -0,0 +1,143 @@
+# Projection
+# Vectorized Albers equal-area conic projection, on the ellipsoid (Snyder, "Map Projections: A Working Manual", 1987, pp. 98-103).
+# Whole arrays of coordinates are projected in one pass with NumPy, so data can be projected in memory as it streams between stages, without
+# arcpy and without writing an intermediate file. The projection's parameters are read from the well-known text in BathyConfig, so this and
+# arcpy.Project_management always agree on the target coordinate system.
+
+import math
+import re
+import numpy as np
+import BathyConfig
+
+# The number of iterations used to invert the authalic latitude. Converges to well under a millimeter in 3, so this is more than enough
+INVERSE_ITERATIONS = 6
+
+# Points with known projected coordinates, as ( WKT, longitude, latitude, x, y ). The first is the worked example in Snyder (p. 292), on the
+# Clarke 1866 ellipsoid. The others (with no WKT) are on the projection specified in BathyConfig, and were computed with PROJ
+REFERENCE_POINTS = [
+    ( "PROJCS['Snyder_Example',GEOGCS['GCS_North_American_1927',DATUM['D_North_American_1927',SPHEROID['Clarke_1866',6378206.4,294.9786982]]],"
+      "PROJECTION['Albers'],PARAMETER['False_Easting',0.0],PARAMETER['False_Northing',0.0],PARAMETER['Central_Meridian',-96.0],"
+      "PARAMETER['Standard_Parallel_1',29.5],PARAMETER['Standard_Parallel_2',45.5],PARAMETER['Latitude_Of_Origin',23.0]]",
+      -75.0, 35.0, 1885472.7, 1535925.0 ),
+    ( None, -154.0, 50.0, 0.0, 0.0 ), # The projection's origin
+    ( None, -149.9003, 61.2181, 219349.5792, 1255301.5397 ), # Anchorage
+    ( None, -131.6461, 55.3422, 1391073.1746, 828570.9458 ), # Ketchikan
+    ( None, 178.0, 51.8, -1884608.5894, 602126.2498 ), # West of the antimeridian, in the Aleutians
+    ( None, -156.79, 71.29, -102402.0344, 2367964.7705 ), # Utqiagvik
+]
+
+# The max distance, in meters, a projected reference point may be from its known coordinates
+REFERENCE_TOLERANCE = 0.1
+
+# Pulls the parameters of an Albers projection out of its well-known text
+# @return = A dict with the semi-major axis 'a', the inverse flattening 'rf', and each PARAMETER[] by name (e.g. 'Central_Meridian')
+def ParseWKT( WKT ):
+    spheroid = re.search( r"SPHEROID\[\s*'[^']*'\s*,\s*([-0-9.eE+]+)\s*,\s*([-0-9.eE+]+)", WKT )
+    if spheroid == None or re.search( r"PROJECTION\[\s*'Albers'", WKT ) == None:
+        raise ValueError( "Not an Albers projection: %s" % WKT )
+    Parameters = { "a": float( spheroid.group( 1 ) ), "rf": float( spheroid.group( 2 ) ) }
+    for ( name, value ) in re.findall( r"PARAMETER\[\s*'([^']*)'\s*,\s*([-0-9.eE+]+)\s*\]", WKT ):
+        Parameters[ name ] = float( value )
+    return Parameters
+
+# The constants of an Albers projection. Calculated once, then used to project any number of points
+# @param WKT = The well-known text of the projection. Defaults to the projection specified in BathyConfig
+class Albers( object ):
+    def __init__( self, WKT=None ):
+        if WKT == None:
+            WKT = BathyConfig.PROJECTION_WKT
+        Parameters = ParseWKT( WKT )
+        self.a = Parameters[ "a" ]
+        f = 1.0 / Parameters[ "rf" ]
+        self.e2 = 2 * f - f * f
+        self.e = math.sqrt( self.e2 )
+        self.Lon0 = math.radians( Parameters[ "Central_Meridian" ] )
+        self.FalseEasting = Parameters.get( "False_Easting", 0.0 )
+        self.FalseNorthing = Parameters.get( "False_Northing", 0.0 )
+        phi0 = math.radians( Parameters[ "Latitude_Of_Origin" ] )
+        phi1 = math.radians( Parameters[ "Standard_Parallel_1" ] )
+        phi2 = math.radians( Parameters.get( "Standard_Parallel_2", Parameters[ "Standard_Parallel_1" ] ) )
+
+        ( m1, m2 ) = ( self.m( phi1 ), self.m( phi2 ) )
+        ( q0, q1, q2 ) = ( self.q( phi0 ), self.q( phi1 ), self.q( phi2 ) )
+        if phi1 == phi2:
+            self.n = math.sin( phi1 )
+        else:
+            self.n = ( m1 * m1 - m2 * m2 ) / ( q2 - q1 )
+        self.C = m1 * m1 + self.n * q1
+        self.Rho0 = self.a * math.sqrt( self.C - self.n * q0 ) / self.n
+        # q at the poles. Used to clamp the inverse
+        self.qPole = self.q( math.pi / 2 )
+
+    # Snyder 14-15. Works on scalars and arrays alike
+    def m( self, phi ):
+        sinPhi = np.sin( phi )
+        return np.cos( phi ) / np.sqrt( 1 - self.e2 * sinPhi * sinPhi )
+
+    # Snyder 3-12. Works on scalars and arrays alike
+    def q( self, phi ):
+        sinPhi = np.sin( phi )
+        eSinPhi = self.e * sinPhi
+        return ( 1 - self.e2 ) * ( sinPhi / ( 1 - eSinPhi * eSinPhi ) - np.log( ( 1 - eSinPhi ) / ( 1 + eSinPhi ) ) / ( 2 * self.e ) )
+
+    # Projects geographic coordinates
+    # @param lon, lat = Arrays of longitudes and latitudes, in degrees
+    # @return = A tuple of ( x, y ) arrays, in meters
+    def Forward( self, lon, lat ):
+        phi = np.radians( np.asarray( lat, dtype=np.float64 ) )
+        # Longitudes are taken relative to the central meridian, wrapped into [-180, 180), so that data crossing the antimeridian stays contiguous
+        dLon = np.radians( ( np.asarray( lon, dtype=np.float64 ) - math.degrees( self.Lon0 ) + 180.0 ) % 360.0 - 180.0 )
+        rho = self.a * np.sqrt( self.C - self.n * self.q( phi ) ) / self.n
+        theta = self.n * dLon
+        x = self.FalseEasting + rho * np.sin( theta )
+        y = self.FalseNorthing + self.Rho0 - rho * np.cos( theta )
+        return ( x, y )
+
+    # Unprojects projected coordinates. The inverse of Forward()
+    # @param x, y = Arrays of projected coordinates, in meters
+    # @return = A tuple of ( lon, lat ) arrays, in degrees
+    def Inverse( self, x, y ):
+        x = np.asarray( x, dtype=np.float64 ) - self.FalseEasting
+        y = self.Rho0 - ( np.asarray( y, dtype=np.float64 ) - self.FalseNorthing )
+        if self.n < 0:
+            ( x, y ) = ( -x, -y )
+        rho = np.hypot( x, y )
+        theta = np.arctan2( x, y )
+        q = np.clip( ( self.C - ( rho * self.n / self.a ) ** 2 ) / self.n, -self.qPole, self.qPole )
+        # Snyder 3-16, iterated from the spherical approximation
+        phi = np.arcsin( np.clip( q / 2, -1.0, 1.0 ) )
+        for i in range( INVERSE_ITERATIONS ):
+            sinPhi = np.sin( phi )
+            eSinPhi = self.e * sinPhi
+            oneMinus = 1 - eSinPhi * eSinPhi
+            phi = phi + oneMinus * oneMinus / ( 2 * np.cos( phi ) ) * ( q / ( 1 - self.e2 ) - sinPhi / oneMinus
+                                                                       + np.log( ( 1 - eSinPhi ) / ( 1 + eSinPhi ) ) / ( 2 * self.e ) )
+        lon = np.degrees( self.Lon0 + theta / self.n )
+        return ( ( lon + 180.0 ) % 360.0 - 180.0, np.degrees( phi ) )
+
+# The projection specified in BathyConfig, created when first needed
+DefaultProjection = None
+
+def GetDefaultProjection():
+    global DefaultProjection
+    if DefaultProjection == None:
+        DefaultProjection = Albers()
+    return DefaultProjection
+
+# Projects arrays of geographic coordinates into the coordinate system specified in BathyConfig
+# @param lon, lat = Arrays of longitudes and latitudes, in degrees
+# @return = A tuple of ( x, y ) arrays, in meters
+def ProjectArrays( lon, lat ):
+    return GetDefaultProjection().Forward( lon, lat )
+
+# Checks the projection math against points with known projected coordinates, and checks that every one survives a round trip.
+# Raises a ValueError naming the first point that doesn't match
+def VerifyReferencePoints():
+    for ( WKT, lon, lat, X, Y ) in REFERENCE_POINTS:
+        projection = Albers( WKT )
+        ( x, y ) = projection.Forward( np.array( [ lon ] ), np.array( [ lat ] ) )
+        if math.hypot( x[0] - X, y[0] - Y ) > REFERENCE_TOLERANCE:
+            raise ValueError( "Projecting ( %r, %r ) gave ( %r, %r ) rather than ( %r, %r )" % ( lon, lat, x[0], y[0], X, Y ) )
+        ( LON, LAT ) = projection.Inverse( x, y )
+        if abs( LON[0] - lon ) > 1e-9 or abs( LAT[0] - lat ) > 1e-9:
+            raise ValueError( "( %r, %r ) came back from a round trip as ( %r, %r )" % ( lon, lat, LON[0], LAT[0] ) )
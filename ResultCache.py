@@ -0,0 +1,129 @@
+# ResultCache
+# Remembers the output each stage produced for each input, keyed by the content hash of the input and the parameters the stage ran with.
+# Work is only redone when the input's contents or the stage's parameters change, so a changed input is always reprocessed and a renamed
+# (but otherwise unchanged) input reuses the output of its old name.
+# The cached outputs are the intermediate files under OUTPUT_ROOT_FOLDER. Once they grow past the configured size, the least recently used
+# are deleted to make room.
+
+import glob
+import hashlib
+import os
+import time
+import BathyConfig
+
+# Lists the files which make up an output. Most outputs are a single file, but a shapefile is several files sharing its base name
+def OutputFiles( OUTPUT_PATH ):
+    ( base, extension ) = os.path.splitext( OUTPUT_PATH )
+    Files = [ OUTPUT_PATH ] if os.path.exists( OUTPUT_PATH ) else list()
+    for path in glob.glob( glob.escape( base ) + ".*" ):
+        if path != OUTPUT_PATH:
+            Files.append( path )
+    return Files
+
+# The cache's records are kept in the same database as the ProcessingManifest, and share its connection
+# @param Manifest = The ProcessingManifest. Also used to look up the content hashes of inputs
+# @param MaxBytes = The max total size of the evictable outputs. Defaults to the value specified in BathyConfig, where None means nothing is evicted
+class ResultCache( object ):
+    def __init__( self, Manifest, MaxBytes=None ):
+        self.Manifest = Manifest
+        if MaxBytes == None:
+            MaxBytes = BathyConfig.RESULT_CACHE_MAX_BYTES
+        self.MaxBytes = MaxBytes
+        self.Lock = Manifest.Lock
+        self.Connection = Manifest.Connection
+        self.Pins = dict() # Maps each output still waiting to be used (by the next stage) to the number of times it is waiting. Pinned outputs are never evicted
+        # output_size and output_mtime identify the output as it was written, so that an output overwritten since is not mistaken for it
+        with self.Lock:
+            self.Connection.execute( "CREATE TABLE IF NOT EXISTS results ( key TEXT PRIMARY KEY, stage TEXT, output_path TEXT, output_size INTEGER, "
+                                     "output_mtime REAL, bytes INTEGER, last_used REAL )" )
+        # The limit may have been lowered since the last run
+        if self.MaxBytes != None:
+            self.Evict( self.MaxBytes )
+
+    # Builds the cache key for running a stage on a file
+    # @param Parameters = A dict of the values the stage's output depends on, besides its input (e.g. { "Z_SCORE_MAX_MIN": 1.98 })
+    # @return = The key, as a hex string
+    def Key( self, FILE_PATH, STAGE, Parameters=None ):
+        digest = hashlib.sha1()
+        digest.update( STAGE.encode( "utf-8" ) )
+        digest.update( self.Manifest.ContentHash( FILE_PATH ).encode( "ascii" ) )
+        if Parameters != None:
+            for name in sorted( Parameters ):
+                digest.update( ( "%s=%r;" % ( name, Parameters[ name ] ) ).encode( "utf-8" ) )
+        return digest.hexdigest()
+
+    # Protects an output from eviction until it has been unpinned as many times as it was pinned
+    def Pin( self, OUTPUT_PATH ):
+        with self.Lock:
+            self.Pins[ OUTPUT_PATH ] = self.Pins.get( OUTPUT_PATH, 0 ) + 1
+
+    def Unpin( self, OUTPUT_PATH ):
+        with self.Lock:
+            if OUTPUT_PATH in self.Pins:
+                self.Pins[ OUTPUT_PATH ] -= 1
+                if self.Pins[ OUTPUT_PATH ] == 0:
+                    del self.Pins[ OUTPUT_PATH ]
+
+    # Returns the cached output for a key, or None if there isn't one. An output which has been deleted or overwritten is forgotten.
+    # The output is pinned, and must be unpinned once it has been used
+    def Lookup( self, KEY ):
+        with self.Lock:
+            row = self.Connection.execute( "SELECT output_path, output_size, output_mtime FROM results WHERE key = ?", ( KEY, ) ).fetchone()
+        if row == None:
+            return None
+        ( OUTPUT_PATH, OUTPUT_SIZE, OUTPUT_MTIME ) = row
+        if os.path.exists( OUTPUT_PATH ) == False or os.path.getsize( OUTPUT_PATH ) != OUTPUT_SIZE or os.path.getmtime( OUTPUT_PATH ) != OUTPUT_MTIME:
+            with self.Lock:
+                self.Connection.execute( "DELETE FROM results WHERE key = ?", ( KEY, ) )
+            return None
+        with self.Lock:
+            self.Connection.execute( "UPDATE results SET last_used = ? WHERE key = ?", ( time.time(), KEY ) )
+            self.Pin( OUTPUT_PATH )
+        return OUTPUT_PATH
+
+    # Records the output a stage produced, then evicts old outputs if the cache has grown too large.
+    # The output is pinned, and must be unpinned once it has been used
+    def Store( self, KEY, STAGE, OUTPUT_PATH ):
+        stat = os.stat( OUTPUT_PATH )
+        size = sum( [ os.path.getsize( path ) for path in OutputFiles( OUTPUT_PATH ) ] )
+        with self.Lock:
+            # Any other key pointing at the same path refers to whatever was there before, which has just been overwritten
+            self.Connection.execute( "DELETE FROM results WHERE output_path = ?", ( OUTPUT_PATH, ) )
+            self.Connection.execute( "INSERT OR REPLACE INTO results VALUES ( ?, ?, ?, ?, ?, ?, ? )",
+                                     ( KEY, STAGE, OUTPUT_PATH, stat.st_size, stat.st_mtime, size, time.time() ) )
+            self.Pin( OUTPUT_PATH )
+        if self.MaxBytes != None:
+            self.Evict( self.MaxBytes )
+
+    # Returns the total size of the cached outputs which may be evicted. Expressed in bytes
+    def EvictableBytes( self ):
+        Stages = BathyConfig.RESULT_CACHE_EVICTABLE_STAGES
+        with self.Lock:
+            row = self.Connection.execute( "SELECT SUM( bytes ) FROM results WHERE stage IN ( %s )" % ",".join( "?" * len( Stages ) ), Stages ).fetchone()
+        return row[0] or 0
+
+    # Deletes the least recently used outputs of the evictable stages until they take up no more than MAX_BYTES. Pinned outputs are skipped
+    # @return = The number of bytes freed
+    def Evict( self, MAX_BYTES ):
+        Stages = BathyConfig.RESULT_CACHE_EVICTABLE_STAGES
+        freed = 0
+        with self.Lock:
+            total = self.EvictableBytes()
+            if total <= MAX_BYTES:
+                return 0
+            rows = self.Connection.execute( "SELECT key, output_path, bytes FROM results WHERE stage IN ( %s ) ORDER BY last_used" % ",".join( "?" * len( Stages ) ),
+                                            Stages ).fetchall()
+            for ( KEY, OUTPUT_PATH, BYTES ) in rows:
+                if total - freed <= MAX_BYTES:
+                    break
+                if OUTPUT_PATH in self.Pins:
+                    continue
+                BathyConfig.ConditionalPrint( "Evicting %s from the result cache.", OUTPUT_PATH )
+                for path in OutputFiles( OUTPUT_PATH ):
+                    try:
+                        os.remove( path )
+                    except OSError:
+                        pass # If the file isn't there any more, then we don't care
+                self.Connection.execute( "DELETE FROM results WHERE key = ?", ( KEY, ) )
+                freed += BYTES
+        return freed
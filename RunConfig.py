@@ -0,0 +1,200 @@
+# RunConfig
+# The settings of a single run, gathered into one picklable object. BathyConfig holds the defaults; a RunConfig starts from them, takes
+# overrides from a JSON file, the command line, or a dict, and checks every value before anything is run.
+# The rest of the program reads its settings from BathyConfig, so a RunConfig takes effect by being applied to it: Apply() for the rest of
+# the process, or Applied() for the length of a with block, so that several runs with different settings can be made in one process.
+# Worker processes start with BathyConfig's defaults, so the pools apply the parent's settings to each worker as it starts (InitializeWorker).
+# A RunConfig is only a dict of plain values, so it is cheap to send to them.
+
+import argparse
+import ast
+import contextlib
+import io
+import json
+import os
+import BathyConfig
+import Progress
+
+# Returns every setting in BathyConfig, by name. Settings are the module's upper case globals
+def ReadSettings():
+    return dict( [ ( name, value ) for ( name, value ) in vars( BathyConfig ).items() if name.isupper() and callable( value ) == False ] )
+
+# The values BathyConfig was written with, before any RunConfig was applied
+DEFAULTS = ReadSettings()
+
+# The types of the settings whose default is None, or which may be set to None. Every other setting has the type of its default
+NULLABLE = { "METRICS_PATH": str, "CHECKPOINT_INTERVAL": float, "MAX_FOLDER_FILES": int, "RESULT_CACHE_MAX_BYTES": int, "OUTLIER_TILE_SIZE": float }
+
+# Settings which must be greater than zero (when not None)
+POSITIVE = [ "MAX_ALLOWED_THREADS", "FILE_SCAN_THREADS", "PIPELINE_QUEUE_SIZE", "READ_CHUNK_SIZE", "WRITE_BUFFER_SIZE", "MAX_IN_MEMORY_FILE_SIZE",
+             "TILE_INDEX_BLOCK_SIZE", "MAX_FOLDER_SIZE", "MAX_FOLDER_FILES", "RESULT_CACHE_MAX_BYTES", "CHECKPOINT_INTERVAL", "PROGRESS_REFRESH_RATE",
+             "GRID_CELL_SIZE", "Z_SCORE_MAX_MIN", "OUTLIER_NEIGHBOR_RADIUS", "OUTLIER_TILE_SIZE", "POINT_QUANTUM" ]
+
+# Settings which must take one of a fixed set of values
+CHOICES = { "POINT_PRECISION": [ "float64", "float32", "quantized" ], "SPLIT_MODE": [ "OID", "MORTON", "HILBERT" ],
+            "MIN_BIN_SCORE": [ -3, -2, -1, 0, 1, 2, 3 ] }
+
+# Paths kept under OUTPUT_ROOT_FOLDER, by the name they are given there. They move with OUTPUT_ROOT_FOLDER unless they are set themselves
+OUTPUT_PATHS = { "MANIFEST_PATH": "ProcessingManifest.sqlite", "METRICS_PATH": "Metrics.jsonl", "PROFILE_DIRECTORY": "Profiles",
+                 "FILE_INDEX_PATH": "FileIndex.sqlite" }
+
+# The settings of a run. Settings can be read as attributes, e.g. Config.MAX_ALLOWED_THREADS
+# @param Overrides = A dict of the settings which differ from the defaults in BathyConfig
+class RunConfig( object ):
+    def __init__( self, Overrides=None ):
+        self.Settings = dict( DEFAULTS )
+        self.Overrides = dict() # The settings which have been set, rather than taken from the defaults
+        if Overrides != None:
+            self.Update( Overrides )
+        else:
+            self.Validate() # The defaults themselves may have been edited into something invalid
+
+    def __getattr__( self, name ):
+        Settings = self.__dict__.get( "Settings" ) # Not yet set while unpickling
+        if Settings == None or name not in Settings:
+            raise AttributeError( name )
+        return Settings[ name ]
+
+    def __repr__( self ):
+        return "RunConfig(%r)" % self.Overrides
+
+    # Sets some of the settings, and checks the result
+    # @param Overrides = A dict of the new values, by setting name
+    # @return = The RunConfig
+    def Update( self, Overrides ):
+        Problems = list()
+        for ( name, value ) in Overrides.items():
+            if name not in DEFAULTS:
+                Problems.append( "%s is not a setting" % name )
+                continue
+            try:
+                self.Settings[ name ] = Coerce( name, value )
+                self.Overrides[ name ] = self.Settings[ name ]
+            except ValueError as e:
+                Problems.append( str( e ) )
+        if len( Problems ) > 0:
+            raise ValueError( "Invalid settings: " + "; ".join( Problems ) )
+        if "OUTPUT_ROOT_FOLDER" in self.Overrides:
+            for ( name, FILE_NAME ) in OUTPUT_PATHS.items():
+                if name not in self.Overrides and DEFAULTS[ name ] != None: # Paths turned off in BathyConfig stay off
+                    self.Settings[ name ] = os.path.join( self.Settings[ "OUTPUT_ROOT_FOLDER" ], FILE_NAME )
+        self.Validate()
+        return self
+
+    # Checks that the settings make sense together. Raises a ValueError describing every problem found
+    def Validate( self ):
+        Problems = list()
+        for name in POSITIVE:
+            if self.Settings[ name ] != None and self.Settings[ name ] <= 0:
+                Problems.append( "%s must be greater than zero, not %s" % ( name, self.Settings[ name ] ) )
+        for ( name, choices ) in CHOICES.items():
+            if self.Settings[ name ] not in choices:
+                Problems.append( "%s must be one of %s, not %r" % ( name, choices, self.Settings[ name ] ) )
+        for ( STAGE, workers ) in self.Settings[ "PIPELINE_STAGE_WORKERS" ].items():
+            if isinstance( workers, int ) == False or workers <= 0:
+                Problems.append( "PIPELINE_STAGE_WORKERS for %s must be a whole number greater than zero, not %r" % ( STAGE, workers ) )
+        TILE_SIZE = self.Settings[ "OUTLIER_TILE_SIZE" ]
+        if TILE_SIZE != None and TILE_SIZE <= self.Settings[ "OUTLIER_NEIGHBOR_RADIUS" ]:
+            Problems.append( "OUTLIER_TILE_SIZE (%s) must be larger than OUTLIER_NEIGHBOR_RADIUS (%s)" % ( TILE_SIZE, self.Settings[ "OUTLIER_NEIGHBOR_RADIUS" ] ) )
+        if len( Problems ) > 0:
+            raise ValueError( "Invalid settings: " + "; ".join( Problems ) )
+
+    # Puts the settings into BathyConfig, where the rest of the program reads them, for the rest of the process
+    # @return = The settings BathyConfig held before, as a dict
+    def Apply( self ):
+        Previous = ReadSettings()
+        for ( name, value ) in self.Settings.items():
+            setattr( BathyConfig, name, value )
+        return Previous
+
+    # Applies the settings for the length of a with block, and then puts back the ones BathyConfig held before
+    @contextlib.contextmanager
+    def Applied( self ):
+        Previous = self.Apply()
+        try:
+            yield self
+        finally:
+            for ( name, value ) in Previous.items():
+                setattr( BathyConfig, name, value )
+
+    # Saves the overridden settings to a JSON file, which Load can read back
+    def Save( self, FILE_PATH ):
+        with io.open( FILE_PATH, "w", encoding="utf-8" ) as f:
+            json.dump( self.Overrides, f, indent=4, sort_keys=True )
+
+# Checks a value against the type of the setting, and converts it if need be (whole numbers are accepted for decimal settings)
+# @return = The value, as it should be stored
+def Coerce( name, value ):
+    default = DEFAULTS[ name ]
+    expected = NULLABLE.get( name, type( default ) )
+    if value == None:
+        if name in NULLABLE:
+            return None
+        raise ValueError( "%s can't be None" % name )
+    if expected == float and isinstance( value, ( int, float ) ) and isinstance( value, bool ) == False:
+        return float( value )
+    if expected == int and isinstance( value, bool ):
+        raise ValueError( "%s must be a whole number, not %r" % ( name, value ) )
+    if isinstance( value, expected ) == False:
+        raise ValueError( "%s must be a %s, not %r" % ( name, expected.__name__, value ) )
+    return value
+
+# Reads a RunConfig from a JSON file of settings, by name. Settings not in the file keep their defaults
+def Load( FILE_PATH ):
+    with io.open( FILE_PATH, "r", encoding="utf-8" ) as f:
+        Overrides = json.load( f )
+    if isinstance( Overrides, dict ) == False:
+        raise ValueError( "%s must hold a JSON object of settings" % FILE_PATH )
+    return RunConfig( Overrides )
+
+# Reads the value of a --set option. Python literals (numbers, True, None, lists...) are read as such, and anything else is taken as a string
+def ParseValue( TEXT ):
+    try:
+        return ast.literal_eval( TEXT )
+    except ( ValueError, SyntaxError ):
+        return TEXT
+
+# Builds a RunConfig from the command line. A config file is read first, and the other options override it
+# @param Arguments = The command line arguments. Defaults to those the script was run with
+def FromArguments( Arguments=None ):
+    parser = argparse.ArgumentParser( description="Processes raw bathymetric survey files. Settings default to those in BathyConfig." )
+    parser.add_argument( "--config", default=None, help="A JSON file of settings, by BathyConfig name" )
+    parser.add_argument( "--input", default=None, help="The root folder of the raw input data (INPUT_ROOT_FOLDER)" )
+    parser.add_argument( "--output", default=None, help="The root folder of the outputs (OUTPUT_ROOT_FOLDER)" )
+    parser.add_argument( "--threads", type=int, default=None, help="The number of files processed at once (MAX_ALLOWED_THREADS). Turns on USE_THREADING" )
+    parser.add_argument( "--set", action="append", default=list(), metavar="NAME=VALUE", help="Sets any BathyConfig setting. May be given more than once" )
+    Options = parser.parse_args( Arguments )
+
+    Overrides = dict()
+    if Options.config != None:
+        Overrides.update( Load( Options.config ).Overrides )
+    for ( name, value ) in [ ( "INPUT_ROOT_FOLDER", Options.input ), ( "OUTPUT_ROOT_FOLDER", Options.output ), ( "MAX_ALLOWED_THREADS", Options.threads ) ]:
+        if value != None:
+            Overrides[ name ] = value
+    if Options.threads != None:
+        Overrides[ "USE_THREADING" ] = True
+    for setting in Options.set:
+        if "=" not in setting:
+            parser.error( "--set takes NAME=VALUE, not %s" % setting )
+        ( name, value ) = setting.split( "=", 1 )
+        Overrides[ name.strip() ] = ParseValue( value.strip() )
+    try:
+        return RunConfig( Overrides )
+    except ValueError as e:
+        parser.error( str( e ) )
+
+# Returns a RunConfig holding the settings BathyConfig holds now, whether they came from a RunConfig or were set directly
+def Current():
+    Settings = ReadSettings()
+    Overrides = dict( [ ( name, value ) for ( name, value ) in Settings.items() if name in DEFAULTS and value != DEFAULTS[ name ] ] )
+    if "OUTPUT_ROOT_FOLDER" in Overrides:
+        # Paths under the output root are taken as they are, rather than moved with it
+        Overrides.update( [ ( name, Settings[ name ] ) for name in OUTPUT_PATHS ] )
+    return RunConfig( Overrides )
+
+# Prepares a pool's worker process: applies the parent's settings, and connects it to the progress reporter. Run by the pools as each worker starts
+# @param Config = The parent's RunConfig
+# @param Queue = The progress reporter's queue, or None if no reporter is running
+def InitializeWorker( Config, Queue ):
+    Config.Apply()
+    Progress.InitializeWorker( Queue )
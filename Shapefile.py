@@ -0,0 +1,448 @@
+# Shapefile
+# Writes PointZ shapefiles (.shp, .shx, .dbf and .prj) straight from NumPy arrays, in place of arcpy.ASCII3DToFeatureClass_3d, and reads
+# point shapefiles straight back into NumPy arrays, in place of arcpy cursors.
+# Every record of a PointZ shapefile is the same size, so a whole block of records is built at once as a structured array and written
+# with a single call. The headers are written up front with placeholder values, and patched with the final record count and bounding box
+# when the writer is closed, so points can be streamed in without knowing how many there will be.
+# Reading works the same way in reverse: the record stream is memory-mapped and viewed as a structured array, so the coordinates are
+# never turned into Python objects.
+# Layouts follow the ESRI Shapefile Technical Description (1998) and the dBASE III table format.
+
+import datetime
+import io
+import os
+import struct
+import numpy as np
+import BathyConfig
+import Checkpoint
+
+FILE_CODE = 9994
+VERSION = 1000
+SHAPE_TYPE_NULL = 0
+SHAPE_TYPE_POINT = 1
+SHAPE_TYPE_POINTZ = 11
+HEADER_SIZE = 100
+
+# The largest a .shp file may be. Offsets are stored as signed 32-bit counts of 16-bit words
+MAX_FILE_SIZE = 2 ** 31 - 1
+
+# A PointZ record: the record header (big-endian), then the shape type, x, y, z and m (little-endian). 44 bytes, with no padding
+RECORD_DTYPE = np.dtype( [ ( "number", ">i4" ), ( "length", ">i4" ), ( "type", "<i4" ), ( "x", "<f8" ), ( "y", "<f8" ), ( "z", "<f8" ), ( "m", "<f8" ) ] )
+RECORD_CONTENT_WORDS = ( RECORD_DTYPE.itemsize - 8 ) // 2
+
+# An index record: the offset of a record in the .shp, and the length of its content, both in 16-bit words (big-endian)
+INDEX_DTYPE = np.dtype( [ ( "offset", ">i4" ), ( "length", ">i4" ) ] )
+
+# Returns the attribute written for every point, as ( name, width, decimals ). A numeric (N) dBASE field holding z, as ArcGIS lays out a double.
+# Read when used, so that the column name follows the settings of the run
+def ZField():
+    return ( BathyConfig.Z_FIELD_COLUMN_NAME, 19, 11 )
+
+# Builds the 100 byte header shared by the .shp and .shx files
+# @param FILE_SIZE = The size of the file, in bytes
+# @param BBOX = The bounding box of the points, as [ xmin, ymin, zmin, xmax, ymax, zmax ]. All zeros if the file is empty
+def BuildShapeHeader( FILE_SIZE, BBOX ):
+    if BBOX == None:
+        BBOX = [ 0.0 ] * 6
+    ( xmin, ymin, zmin, xmax, ymax, zmax ) = BBOX
+    return ( struct.pack( ">7i", FILE_CODE, 0, 0, 0, 0, 0, FILE_SIZE // 2 )
+             + struct.pack( "<2i", VERSION, SHAPE_TYPE_POINTZ )
+             + struct.pack( "<8d", xmin, ymin, xmax, ymax, zmin, zmax, 0.0, 0.0 ) )
+
+# Builds the header of a dBASE III table, including its field descriptors and terminator
+# @param COUNT = The number of records in the table
+# @param Fields = A list of ( name, width, decimals ) for every numeric field
+def BuildDBFHeader( COUNT, Fields ):
+    today = datetime.date.today()
+    HEADER_LENGTH = 32 + 32 * len( Fields ) + 1
+    RECORD_LENGTH = 1 + sum( [ width for ( name, width, decimals ) in Fields ] ) # Every record starts with its deletion flag
+    header = struct.pack( "<4BIHH20x", 3, today.year - 1900, today.month, today.day, COUNT, HEADER_LENGTH, RECORD_LENGTH )
+    for ( name, width, decimals ) in Fields:
+        header += struct.pack( "<11sc4xBB14x", name.encode( "ascii" )[:10], b"N", width, decimals )
+    return header + b"\r"
+
+# Formats numbers as right-aligned, fixed-point dBASE numeric fields, all at once. Each digit is pulled out of the scaled integer values
+# arithmetically, so no number is ever formatted individually
+# @return = An ( n, WIDTH ) uint8 array of ASCII characters
+def FormatNumericField( values, WIDTH, DECIMALS ):
+    values = np.asarray( values, dtype=np.float64 )
+    n = len( values )
+    magnitude = np.abs( values )
+    if n > 0 and ( np.all( np.isfinite( values ) ) == False or np.max( magnitude ) >= 10.0 ** ( WIDTH - DECIMALS - ( DECIMALS > 0 ) - 1 ) ):
+        raise ValueError( "A value is too large for a numeric field %s wide with %s decimals." % ( WIDTH, DECIMALS ) )
+    # The integer and fractional parts are scaled separately, so that large values don't lose their last digits to rounding
+    whole = np.floor( magnitude )
+    fraction = np.rint( ( magnitude - whole ) * 10.0 ** DECIMALS ).astype( np.uint64 )
+    scaled = whole.astype( np.uint64 ) * np.uint64( 10 ** DECIMALS ) + fraction
+    negative = ( values < 0 ) & ( scaled > 0 )
+    # The number of digits each value needs, counting at least one before the decimal point
+    digits = np.full( n, DECIMALS + 1, dtype=np.int64 )
+    for place in range( DECIMALS + 1, WIDTH ):
+        digits += scaled >= np.uint64( 10 ** place )
+
+    field = np.full( ( n, WIDTH ), ord( " " ), dtype=np.uint8 )
+    remaining = scaled.copy()
+    column = WIDTH - 1
+    for place in range( int( np.max( digits ) ) if n > 0 else 0 ):
+        if DECIMALS > 0 and place == DECIMALS:
+            field[ :, column ] = ord( "." )
+            column -= 1
+        inUse = place < digits
+        field[ inUse, column ] = ( remaining[ inUse ] % np.uint64( 10 ) ).astype( np.uint8 ) + ord( "0" )
+        remaining //= np.uint64( 10 )
+        column -= 1
+    # The minus sign goes just in front of each negative value's first digit
+    signColumn = WIDTH - 1 - digits - ( DECIMALS > 0 )
+    field[ np.flatnonzero( negative ), signColumn[ negative ] ] = ord( "-" )
+    return field
+
+# Streams points into a PointZ shapefile. Has the same interface as PointTile.TileWriter, so that either can be handed blocks of points
+# @param FILE_PATH = The path of the .shp file. The .shx, .dbf and .prj are written alongside it
+# @param CRS = The well-known text of the points' coordinate system. If empty, no .prj is written
+class ShapefileWriter( object ):
+    def __init__( self, FILE_PATH, CRS="", State=None ):
+        ( base, extension ) = os.path.splitext( FILE_PATH )
+        self.FilePath = FILE_PATH
+        self.Paths = [ base + ".shp", base + ".shx", base + ".dbf" ]
+        self.PartialPaths = [ Checkpoint.PartialPath( path ) for path in self.Paths ] # The files are written under temporary names until closed
+        self.CRS = CRS
+        self.Fields = [ ZField() ]
+        self.Count = 0
+        self.Min = None
+        self.Max = None
+        if State == None:
+            self.Files = [ io.open( path, "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) for path in self.PartialPaths ]
+            ( self.SHP, self.SHX, self.DBF ) = self.Files
+            # Placeholder headers. They are rewritten with the real values when the writer is closed
+            self.SHP.write( BuildShapeHeader( HEADER_SIZE, None ) )
+            self.SHX.write( BuildShapeHeader( HEADER_SIZE, None ) )
+            self.DBF.write( BuildDBFHeader( 0, self.Fields ) )
+        else:
+            ( self.Count, self.Min, self.Max ) = ( State[ "count" ], State[ "min" ], State[ "max" ] )
+            ROW_SIZE = 1 + sum( [ width for ( name, width, decimals ) in self.Fields ] )
+            Sizes = [ HEADER_SIZE + self.Count * RECORD_DTYPE.itemsize, HEADER_SIZE + self.Count * INDEX_DTYPE.itemsize,
+                      len( BuildDBFHeader( 0, self.Fields ) ) + self.Count * ROW_SIZE ]
+            self.Files = list()
+            try:
+                for ( path, size ) in zip( self.PartialPaths, Sizes ):
+                    self.Files.append( Checkpoint.Reopen( path, size, BathyConfig.WRITE_BUFFER_SIZE ) )
+            except Exception:
+                for f in self.Files:
+                    f.close()
+                raise
+            ( self.SHP, self.SHX, self.DBF ) = self.Files
+
+    # Adds a block of points to the shapefile
+    # @param Arrays = The [ x, y, z ] arrays of the block
+    def Append( self, Arrays ):
+        ( x, y, z ) = Arrays
+        n = len( z )
+        if n == 0:
+            return
+        if HEADER_SIZE + ( self.Count + n ) * RECORD_DTYPE.itemsize > MAX_FILE_SIZE:
+            raise ValueError( "%s would grow past the 2GB limit of a shapefile." % self.FilePath )
+        records = np.empty( n, dtype=RECORD_DTYPE )
+        records[ "number" ] = np.arange( self.Count + 1, self.Count + n + 1 )
+        records[ "length" ] = RECORD_CONTENT_WORDS
+        records[ "type" ] = SHAPE_TYPE_POINTZ
+        records[ "x" ] = x
+        records[ "y" ] = y
+        records[ "z" ] = z
+        records[ "m" ] = 0.0
+        self.SHP.write( records.tobytes() )
+
+        index = np.empty( n, dtype=INDEX_DTYPE )
+        index[ "offset" ] = ( HEADER_SIZE + np.arange( self.Count, self.Count + n, dtype=np.int64 ) * RECORD_DTYPE.itemsize ) // 2
+        index[ "length" ] = RECORD_CONTENT_WORDS
+        self.SHX.write( index.tobytes() )
+
+        # Each dBASE record is its deletion flag (a space) followed by its fields
+        rows = np.empty( ( n, 1 + sum( [ width for ( name, width, decimals ) in self.Fields ] ) ), dtype=np.uint8 )
+        rows[ :, 0 ] = ord( " " )
+        rows[ :, 1: ] = FormatNumericField( z, self.Fields[0][1], self.Fields[0][2] )
+        self.DBF.write( rows.tobytes() )
+
+        blockMin = [ float( np.min( a ) ) for a in ( x, y, z ) ]
+        blockMax = [ float( np.max( a ) ) for a in ( x, y, z ) ]
+        if self.Min == None:
+            ( self.Min, self.Max ) = ( blockMin, blockMax )
+        else:
+            self.Min = [ min( a, b ) for ( a, b ) in zip( self.Min, blockMin ) ]
+            self.Max = [ max( a, b ) for ( a, b ) in zip( self.Max, blockMax ) ]
+        self.Count += n
+
+    # Pushes every point appended so far out to disk
+    # @return = The state to carry on from, if the writer is interrupted before it is closed
+    def Flush( self ):
+        for f in self.Files:
+            Checkpoint.Sync( f )
+        return { "count": self.Count, "min": self.Min, "max": self.Max }
+
+    # Patches the headers with the final record count and bounding box, writes the .prj, and gives the files their real names
+    # @return = The path of the .shp file
+    def Close( self ):
+        BBOX = None if self.Min == None else self.Min + self.Max
+        self.SHP.seek( 0 )
+        self.SHP.write( BuildShapeHeader( HEADER_SIZE + self.Count * RECORD_DTYPE.itemsize, BBOX ) )
+        self.SHX.seek( 0 )
+        self.SHX.write( BuildShapeHeader( HEADER_SIZE + self.Count * INDEX_DTYPE.itemsize, BBOX ) )
+        self.DBF.write( b"\x1a" ) # End of file marker
+        self.DBF.seek( 0 )
+        self.DBF.write( BuildDBFHeader( self.Count, self.Fields ) )
+        for f in self.Files:
+            f.close()
+        Paths = list( self.Paths )
+        if self.CRS != "":
+            Paths.append( os.path.splitext( self.FilePath )[0] + ".prj" )
+            with io.open( Checkpoint.PartialPath( Paths[-1] ), "wb" ) as f:
+                f.write( self.CRS.encode( "ascii" ) )
+        CommitShapefile( Paths )
+        return self.FilePath
+
+    # Abandons the shapefile, removing everything written so far
+    def Abort( self ):
+        for f in self.Files:
+            f.close()
+        for path in self.PartialPaths:
+            Checkpoint.Remove( path )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, type, value, traceback ):
+        if type == None:
+            self.Close()
+        else:
+            self.Abort()
+
+# Gives the partial files of a shapefile their real names. The .shp goes last, so that a shapefile is only ever found with all of its files in place
+# @param Paths = The real paths of the files
+def CommitShapefile( Paths ):
+    for path in sorted( Paths, key=lambda path: path.lower().endswith( ".shp" ) ):
+        Checkpoint.Commit( Checkpoint.PartialPath( path ), path )
+
+# Writes points held in memory to a PointZ shapefile
+# @param CRS = The well-known text of the points' coordinate system. If empty, no .prj is written
+# @return = The path of the .shp file
+def WriteShapefile( FILE_PATH, x, y, z, CRS="" ):
+    with ShapefileWriter( FILE_PATH, CRS ) as Writer:
+        Writer.Append( [ x, y, z ] )
+    return FILE_PATH
+
+# Reads the header of a .shp or .shx file
+# @return = A tuple of ( FILE_SIZE, SHAPE_TYPE, BBOX ), where BBOX is [ xmin, ymin, zmin, xmax, ymax, zmax ]
+def ReadShapeHeader( FILE_PATH ):
+    with io.open( FILE_PATH, "rb" ) as f:
+        header = f.read( HEADER_SIZE )
+    if len( header ) < HEADER_SIZE or struct.unpack( ">i", header[0:4] )[0] != FILE_CODE:
+        raise ValueError( "%s is not a shapefile." % FILE_PATH )
+    ( words, ) = struct.unpack( ">i", header[24:28] )
+    ( version, SHAPE_TYPE ) = struct.unpack( "<2i", header[28:36] )
+    ( xmin, ymin, xmax, ymax, zmin, zmax, mmin, mmax ) = struct.unpack( "<8d", header[36:100] )
+    return ( words * 2, SHAPE_TYPE, [ xmin, ymin, zmin, xmax, ymax, zmax ] )
+
+# The layout of a point record with the given content length, or None if point records of that length don't exist.
+# A PointZ record's M value is optional, so it may be 28 or 36 bytes long. A Point record has no z
+def PointRecordDtype( SHAPE_TYPE, CONTENT_BYTES ):
+    fields = [ ( "number", ">i4" ), ( "length", ">i4" ), ( "type", "<i4" ), ( "x", "<f8" ), ( "y", "<f8" ) ]
+    if SHAPE_TYPE == SHAPE_TYPE_POINT and CONTENT_BYTES == 20:
+        return np.dtype( fields )
+    if SHAPE_TYPE == SHAPE_TYPE_POINTZ and CONTENT_BYTES in ( 28, 36 ):
+        return np.dtype( fields + [ ( "z", "<f8" ), ( "m", "<f8" ) ][ : ( CONTENT_BYTES - 20 ) // 8 ] )
+    return None
+
+# Reads the geometry of a Point or PointZ shapefile. Points have no z, so theirs is 0.
+# When every record is the same size (always the case for files this module writes), the records are viewed in place through a memory map,
+# and x, y and z are strided views onto it. Otherwise each field is gathered from the record offsets in the .shx. Null shapes are skipped
+# @return = A tuple of ( x, y, z ) arrays
+def ReadPoints( FILE_PATH ):
+    ( x, y, z, valid ) = ReadPointRecords( FILE_PATH )
+    return ( x, y, z )
+
+# Reads the geometry of a Point or PointZ shapefile, as ReadPoints does, along with which records it came from
+# @return = A tuple of ( x, y, z, valid ), where valid flags the records (in file order) whose points were read, or is None if every record was
+def ReadPointRecords( FILE_PATH ):
+    ( base, extension ) = os.path.splitext( FILE_PATH )
+    ( FILE_SIZE, SHAPE_TYPE, BBOX ) = ReadShapeHeader( base + ".shp" )
+    if SHAPE_TYPE not in ( SHAPE_TYPE_POINT, SHAPE_TYPE_POINTZ ):
+        raise ValueError( "%s holds shapes of type %s, which aren't points." % ( FILE_PATH, SHAPE_TYPE ) )
+    FILE_SIZE = min( FILE_SIZE, os.path.getsize( base + ".shp" ) )
+    if FILE_SIZE <= HEADER_SIZE:
+        empty = np.empty( 0, dtype=np.float64 )
+        return ( empty, empty.copy(), empty.copy(), None )
+    Map = np.memmap( base + ".shp", dtype=np.uint8, mode="r", shape=( FILE_SIZE, ) )
+
+    # The fast path. The length of the first record gives the layout of every record, if they're all the same
+    ( CONTENT_WORDS, ) = struct.unpack( ">i", Map[ HEADER_SIZE + 4 : HEADER_SIZE + 8 ].tobytes() )
+    dtype = PointRecordDtype( SHAPE_TYPE, CONTENT_WORDS * 2 )
+    if dtype != None and ( FILE_SIZE - HEADER_SIZE ) % dtype.itemsize == 0:
+        records = Map[ HEADER_SIZE: ].view( dtype )
+        if np.all( records[ "length" ] == CONTENT_WORDS ) and np.all( records[ "type" ] == SHAPE_TYPE ):
+            z = records[ "z" ] if "z" in dtype.names else np.zeros( len( records ), dtype=np.float64 )
+            return ( records[ "x" ], records[ "y" ], z, None )
+
+    # The general path. Every record is found through the index
+    index = np.fromfile( base + ".shx", dtype=INDEX_DTYPE, offset=HEADER_SIZE )
+    offsets = index[ "offset" ].astype( np.int64 ) * 2 + 8 # The start of each record's content
+    types = Gather( Map, offsets, "<i4" )
+    valid = ( types == SHAPE_TYPE ) & ( index[ "length" ].astype( np.int64 ) * 2 >= ( 28 if SHAPE_TYPE == SHAPE_TYPE_POINTZ else 20 ) )
+    offsets = offsets[ valid ]
+    x = Gather( Map, offsets + 4, "<f8" )
+    y = Gather( Map, offsets + 12, "<f8" )
+    z = Gather( Map, offsets + 20, "<f8" ) if SHAPE_TYPE == SHAPE_TYPE_POINTZ else np.zeros( len( offsets ), dtype=np.float64 )
+    return ( x, y, z, valid )
+
+# Opens the raw records of a point shapefile whose records are all the same size, with their attribute rows, without parsing either
+# @return = A tuple of ( SHAPE_TYPE, records, DBF_HEADER, rows ), where records is a structured view of the .shp records, DBF_HEADER the
+#           bytes of the .dbf header (field descriptors included), and rows an ( n, RECORD_LENGTH ) view of the .dbf records.
+#           None if the records aren't all the same size, or the .dbf doesn't have a row for every record
+def OpenPointRecords( FILE_PATH ):
+    ( base, extension ) = os.path.splitext( FILE_PATH )
+    ( FILE_SIZE, SHAPE_TYPE, BBOX ) = ReadShapeHeader( base + ".shp" )
+    FILE_SIZE = min( FILE_SIZE, os.path.getsize( base + ".shp" ) )
+    ( COUNT, HEADER_LENGTH, RECORD_LENGTH, Fields ) = ReadDBFHeader( base + ".dbf" )
+    with io.open( base + ".dbf", "rb" ) as f:
+        DBF_HEADER = f.read( HEADER_LENGTH )
+    if FILE_SIZE <= HEADER_SIZE:
+        if COUNT != 0:
+            return None
+        return ( SHAPE_TYPE, np.empty( 0, dtype=PointRecordDtype( SHAPE_TYPE_POINTZ, 36 ) ), DBF_HEADER, np.empty( ( 0, RECORD_LENGTH ), dtype=np.uint8 ) )
+    Map = np.memmap( base + ".shp", dtype=np.uint8, mode="r", shape=( FILE_SIZE, ) )
+    ( CONTENT_WORDS, ) = struct.unpack( ">i", Map[ HEADER_SIZE + 4 : HEADER_SIZE + 8 ].tobytes() )
+    dtype = PointRecordDtype( SHAPE_TYPE, CONTENT_WORDS * 2 )
+    if dtype == None or ( FILE_SIZE - HEADER_SIZE ) % dtype.itemsize != 0:
+        return None
+    records = Map[ HEADER_SIZE: ].view( dtype )
+    if np.any( records[ "length" ] != CONTENT_WORDS ) or np.any( records[ "type" ] != SHAPE_TYPE ) or COUNT != len( records ):
+        return None
+    if os.path.getsize( base + ".dbf" ) < HEADER_LENGTH + COUNT * RECORD_LENGTH:
+        return None
+    rows = np.memmap( base + ".dbf", dtype=np.uint8, mode="r", offset=HEADER_LENGTH, shape=( COUNT, RECORD_LENGTH ) )
+    return ( SHAPE_TYPE, records, DBF_HEADER, rows )
+
+# Writes raw records, as returned by OpenPointRecords (or a subset of them), out as a new shapefile. Records are renumbered, and the
+# headers are rebuilt for the records written. The attribute rows are copied byte for byte
+# @param CRS = The well-known text of the points' coordinate system. If empty, no .prj is written
+# @return = The path of the .shp file
+def WritePointRecords( FILE_PATH, SHAPE_TYPE, records, DBF_HEADER, rows, CRS="" ):
+    ( base, extension ) = os.path.splitext( FILE_PATH )
+    n = len( records )
+    records = np.array( records ) # A copy, so that the source isn't renumbered
+    records[ "number" ] = np.arange( 1, n + 1 )
+    BBOX = None
+    if n > 0:
+        z = records[ "z" ] if "z" in records.dtype.names else np.zeros( 1 )
+        BBOX = [ float( np.min( records[ "x" ] ) ), float( np.min( records[ "y" ] ) ), float( np.min( z ) ),
+                 float( np.max( records[ "x" ] ) ), float( np.max( records[ "y" ] ) ), float( np.max( z ) ) ]
+    header = bytearray( BuildShapeHeader( HEADER_SIZE + n * records.dtype.itemsize, BBOX ) )
+    header[ 32:36 ] = struct.pack( "<i", SHAPE_TYPE )
+    Paths = [ base + ".shp", base + ".shx", base + ".dbf" ] # Written under temporary names, and renamed once all are complete
+    with io.open( Checkpoint.PartialPath( Paths[0] ), "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) as f:
+        f.write( bytes( header ) )
+        f.write( records.tobytes() )
+
+    index = np.empty( n, dtype=INDEX_DTYPE )
+    index[ "offset" ] = ( HEADER_SIZE + np.arange( n, dtype=np.int64 ) * records.dtype.itemsize ) // 2
+    index[ "length" ] = ( records.dtype.itemsize - 8 ) // 2
+    header = bytearray( BuildShapeHeader( HEADER_SIZE + n * INDEX_DTYPE.itemsize, BBOX ) )
+    header[ 32:36 ] = struct.pack( "<i", SHAPE_TYPE )
+    with io.open( Checkpoint.PartialPath( Paths[1] ), "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) as f:
+        f.write( bytes( header ) )
+        f.write( index.tobytes() )
+
+    DBF_HEADER = bytearray( DBF_HEADER )
+    DBF_HEADER[ 4:8 ] = struct.pack( "<I", n )
+    with io.open( Checkpoint.PartialPath( Paths[2] ), "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) as f:
+        f.write( bytes( DBF_HEADER ) )
+        f.write( np.ascontiguousarray( rows ).tobytes() )
+        f.write( b"\x1a" )
+
+    if CRS != "":
+        Paths.append( base + ".prj" )
+        with io.open( Checkpoint.PartialPath( Paths[3] ), "wb" ) as f:
+            f.write( CRS.encode( "ascii" ) )
+    CommitShapefile( Paths )
+    return base + ".shp"
+
+# Reads one value of the given dtype from each of the given byte offsets of a buffer, all at once
+def Gather( Map, offsets, DTYPE ):
+    DTYPE = np.dtype( DTYPE )
+    return Map[ offsets[ :, None ] + np.arange( DTYPE.itemsize ) ].copy().view( DTYPE ).ravel()
+
+# Reads the field descriptors of a dBASE table
+# @return = A tuple of ( COUNT, HEADER_LENGTH, RECORD_LENGTH, Fields ), where Fields is a list of ( name, type, offset, width, decimals ),
+#           and offset is where the field starts within each record
+def ReadDBFHeader( FILE_PATH ):
+    with io.open( FILE_PATH, "rb" ) as f:
+        header = f.read( 32 )
+        ( COUNT, HEADER_LENGTH, RECORD_LENGTH ) = struct.unpack( "<IHH", header[4:12] )
+        descriptors = f.read( HEADER_LENGTH - 32 )
+    Fields = list()
+    offset = 1 # Every record starts with its deletion flag
+    for start in range( 0, len( descriptors ) - 31, 32 ):
+        descriptor = descriptors[ start : start + 32 ]
+        if descriptor[0:1] == b"\r":
+            break
+        name = descriptor[0:11].split( b"\0" )[0].decode( "ascii", "replace" )
+        ( width, decimals ) = struct.unpack( "<BB", descriptor[16:18] )
+        Fields.append( ( name, descriptor[11:12].decode( "ascii" ), offset, width, decimals ) )
+        offset += width
+    return ( COUNT, HEADER_LENGTH, RECORD_LENGTH, Fields )
+
+# Parses a column of fixed-width numeric dBASE fields. Blank and overflowed ('*') fields are NaN
+# @param text = An ( n, width ) uint8 array of the fields' characters
+def ParseNumericField( text ):
+    n = len( text )
+    if n == 0:
+        return np.empty( 0, dtype=np.float64 )
+    blank = np.all( ( text == ord( " " ) ) | ( text == ord( "*" ) ) | ( text == 0 ), axis=1 )
+    strings = np.ascontiguousarray( text ).view( "S%s" % text.shape[1] ).ravel()
+    values = np.full( n, np.nan, dtype=np.float64 )
+    values[ ~blank ] = strings[ ~blank ].astype( np.float64 )
+    return values
+
+# Reads columns of a dBASE table into arrays. The records are memory-mapped, and each column is converted in a single call.
+# Numeric (N, F) fields become float64 arrays, logical (L) fields bool arrays, and any other field an array of stripped byte strings
+# @param Columns = The names of the fields to read. Defaults to every field
+# @return = A dict mapping the name of each field to an array of its values, one per record
+def ReadDBF( FILE_PATH, Columns=None ):
+    ( COUNT, HEADER_LENGTH, RECORD_LENGTH, Fields ) = ReadDBFHeader( FILE_PATH )
+    COUNT = min( COUNT, max( 0, ( os.path.getsize( FILE_PATH ) - HEADER_LENGTH ) // RECORD_LENGTH ) )
+    if COUNT > 0:
+        records = np.memmap( FILE_PATH, dtype=np.uint8, mode="r", offset=HEADER_LENGTH, shape=( COUNT, RECORD_LENGTH ) )
+    else:
+        records = np.empty( ( 0, RECORD_LENGTH ), dtype=np.uint8 )
+    Values = dict()
+    for ( name, TYPE, offset, width, decimals ) in Fields:
+        if Columns != None and name not in Columns:
+            continue
+        text = records[ :, offset : offset + width ]
+        if TYPE in ( "N", "F" ):
+            Values[ name ] = ParseNumericField( text )
+        elif TYPE == "L":
+            Values[ name ] = np.isin( text[ :, 0 ], np.frombuffer( b"TtYy", dtype=np.uint8 ) )
+        else:
+            Values[ name ] = np.char.strip( np.ascontiguousarray( text ).view( "S%s" % width ).ravel() )
+    return Values
+
+# Reads a point shapefile's geometry and attributes
+# @param Columns = The names of the attribute fields to read. Defaults to every field
+# @return = A tuple of ( x, y, z, attributes ), where attributes maps the name of each field to an array of its values. The rows of any null or
+#           invalid shapes are dropped along with their shapes, so the attributes line up with the points
+def ReadShapefile( FILE_PATH, Columns=None ):
+    ( x, y, z, valid ) = ReadPointRecords( FILE_PATH )
+    Values = ReadDBF( os.path.splitext( FILE_PATH )[0] + ".dbf", Columns )
+    if valid is not None: # valid is an array, which can't be compared to None
+        for ( name, column ) in Values.items():
+            if len( column ) != len( valid ):
+                raise ValueError( "%s has %s attribute rows for %s shapes." % ( FILE_PATH, len( column ), len( valid ) ) )
+            Values[ name ] = column[ valid ]
+    return ( x, y, z, Values )
+
+# Returns the contents of a shapefile's .prj, or an empty string if it has none
+def ReadCRS( FILE_PATH ):
+    path = os.path.splitext( FILE_PATH )[0] + ".prj"
+    if os.path.exists( path ) == False:
+        return ""
+    with io.open( path, "rb" ) as f:
+        return f.read().decode( "ascii", "replace" ).strip()
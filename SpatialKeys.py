@@ -0,0 +1,76 @@
+# SpatialKeys
+# Space-filling curve keys for points. Sorting points by their keys puts points which are close together in space close together in memory,
+# so that a spatial query only has to touch a few contiguous runs of a file, rather than all of it
+
+import numpy as np
+
+# The number of bits each coordinate is quantized to. Two of them interleave into a 64-bit key
+MORTON_BITS = 32
+
+# The masks which spread the low 32 bits of a value out into the even bits of a 64-bit value
+SPREAD_STEPS = [ ( 16, 0x0000FFFF0000FFFF ), ( 8, 0x00FF00FF00FF00FF ), ( 4, 0x0F0F0F0F0F0F0F0F ), ( 2, 0x3333333333333333 ), ( 1, 0x5555555555555555 ) ]
+
+# Spreads the bits of every value out so that there is a zero between each of them: abcd -> 0a0b0c0d
+def SpreadBits( values ):
+    values = values.astype( np.uint64 )
+    for ( shift, mask ) in SPREAD_STEPS:
+        values = ( values | ( values << np.uint64( shift ) ) ) & np.uint64( mask )
+    return values
+
+# Quantizes coordinates onto a grid of 2^BITS cells spanning [ MIN, MAX ]
+# @return = An array of integer cell indices
+def Quantize( values, MIN, MAX, BITS=MORTON_BITS ):
+    cells = float( 2 ** BITS - 1 )
+    span = float( MAX ) - float( MIN )
+    if span <= 0:
+        return np.zeros( len( values ), dtype=np.uint64 )
+    return np.clip( ( np.asarray( values, dtype=np.float64 ) - MIN ) * ( cells / span ), 0, cells ).astype( np.uint64 )
+
+# Calculates the Morton (Z-order) key of every point, within the given bounding box
+# @param BBOX = The box the keys span, as ( xmin, ymin, xmax, ymax ). Defaults to the bounding box of the points themselves
+# @return = An array of uint64 keys
+def MortonKeys( x, y, BBOX=None ):
+    if BBOX == None:
+        if len( x ) == 0:
+            return np.zeros( 0, dtype=np.uint64 )
+        BBOX = ( np.min( x ), np.min( y ), np.max( x ), np.max( y ) )
+    ( xmin, ymin, xmax, ymax ) = BBOX
+    return SpreadBits( Quantize( x, xmin, xmax ) ) | ( SpreadBits( Quantize( y, ymin, ymax ) ) << np.uint64( 1 ) )
+
+# Returns the order which sorts points along the Morton curve
+def MortonOrder( x, y, BBOX=None ):
+    return np.argsort( MortonKeys( x, y, BBOX ), kind="stable" )
+
+# The number of bits each coordinate is quantized to for Hilbert keys
+HILBERT_BITS = 32
+
+# Calculates the Hilbert curve key of every point, within the given bounding box. Unlike the Morton curve, the Hilbert curve never jumps,
+# so consecutive runs of keys make more compact tiles. Walks down the bits of the coordinates one level at a time, for every point at once
+# @param BBOX = The box the keys span, as ( xmin, ymin, xmax, ymax ). Defaults to the bounding box of the points themselves
+# @return = An array of uint64 keys
+def HilbertKeys( x, y, BBOX=None, BITS=HILBERT_BITS ):
+    if BBOX == None:
+        if len( x ) == 0:
+            return np.zeros( 0, dtype=np.uint64 )
+        BBOX = ( np.min( x ), np.min( y ), np.max( x ), np.max( y ) )
+    ( xmin, ymin, xmax, ymax ) = BBOX
+    qx = Quantize( x, xmin, xmax, BITS )
+    qy = Quantize( y, ymin, ymax, BITS )
+    last = np.uint64( 2 ** BITS - 1 )
+    keys = np.zeros( len( qx ), dtype=np.uint64 )
+    for level in range( BITS - 1, -1, -1 ):
+        s = np.uint64( 1 << level )
+        rx = ( qx & s ) > 0
+        ry = ( qy & s ) > 0
+        keys += np.uint64( 1 << ( 2 * level ) ) * ( ( 3 * rx.astype( np.uint64 ) ) ^ ry.astype( np.uint64 ) )
+        # Rotate the quadrant, so that the curve within it runs the right way
+        flip = ( ry == False ) & rx
+        qx[ flip ] = last - qx[ flip ]
+        qy[ flip ] = last - qy[ flip ]
+        swap = ry == False
+        ( qx[ swap ], qy[ swap ] ) = ( qy[ swap ], qx[ swap ] )
+    return keys
+
+# Returns the order which sorts points along the Hilbert curve
+def HilbertOrder( x, y, BBOX=None ):
+    return np.argsort( HilbertKeys( x, y, BBOX ), kind="stable" )
@@ -0,0 +1,97 @@
+# Splitter
+# Splits a point file into pieces of a fixed number of points, reading the source once. Does the work of BathyToolbox.SplitFCByNumFeat
+# without running a selection over the whole source for every piece.
+# Pieces are either consecutive runs of records (OID order, as the arcpy splitter makes them), or consecutive runs along a space-filling
+# curve (Morton or Hilbert order), which makes spatially compact tiles that can be processed independently of one another.
+# Shapefiles are split record by record: the raw .shp records and .dbf rows are copied as they are, so every attribute survives the split
+
+import os
+import numpy as np
+import BathyConfig
+import OSToolbox
+import PointTile
+import Shapefile
+import SpatialKeys
+
+OID = "OID"
+MORTON = "MORTON"
+HILBERT = "HILBERT"
+
+# Returns the order points are split in, or None for their existing (OID) order
+# @param MODE = One of OID, MORTON or HILBERT
+def SplitOrder( x, y, MODE ):
+    if MODE == OID:
+        return None
+    if MODE == MORTON:
+        return SpatialKeys.MortonOrder( x, y )
+    if MODE == HILBERT:
+        return SpatialKeys.HilbertOrder( x, y )
+    raise ValueError( "Unknown split mode: %s" % MODE )
+
+# Generator that divides COUNT points into pieces of FEATURE_COUNT
+# @param order = The order to take the points in, or None for their existing order
+# @return = Yields a tuple of ( start, selection ) for every piece, where start is the position of the piece's first point in the order, and
+#           selection picks out its points: a slice in OID order, or an ascending array of indices, so that the source is read front to back
+def IterPieces( COUNT, FEATURE_COUNT, order ):
+    for start in range( 0, COUNT, FEATURE_COUNT ):
+        if order is None: # order may be an array, which can't be compared to None
+            yield ( start, slice( start, start + FEATURE_COUNT ) )
+        else:
+            yield ( start, np.sort( order[ start : start + FEATURE_COUNT ] ) )
+
+# Names a piece after its source. OID pieces are named after their range of records, the same way the arcpy splitter names them
+def PieceName( FILE_NAME, FILE_EXTENSION, MODE, start, FEATURE_COUNT ):
+    if MODE == OID:
+        return FILE_NAME + "Intersect_" + str( start ) + "_" + str( start + FEATURE_COUNT ) + FILE_EXTENSION
+    return FILE_NAME + "Tile_" + str( start // FEATURE_COUNT ) + FILE_EXTENSION
+
+# Splits a point shapefile into pieces of FEATURE_COUNT records
+# @param MODE = One of OID, MORTON or HILBERT. Defaults to the value specified in BathyConfig
+# @param OUT_DIRECTORY = Where the pieces are written. Defaults to the directory of the source
+# @return = The paths of the pieces, or None if the shapefile can't be split natively (its records aren't all points of the same size)
+def SplitShapefile( FILE_PATH, FEATURE_COUNT, MODE=None, OUT_DIRECTORY=None ):
+    if MODE == None:
+        MODE = BathyConfig.SPLIT_MODE
+    ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = OSToolbox.SplitFilePath( FILE_PATH )
+    if OUT_DIRECTORY == None:
+        OUT_DIRECTORY = FILE_DIRECTORY
+    opened = Shapefile.OpenPointRecords( FILE_PATH )
+    if opened == None:
+        return None
+    ( SHAPE_TYPE, records, DBF_HEADER, rows ) = opened
+    CRS = Shapefile.ReadCRS( FILE_PATH )
+    order = SplitOrder( records[ "x" ], records[ "y" ], MODE )
+    Pieces = list()
+    for ( start, selection ) in IterPieces( len( records ), FEATURE_COUNT, order ):
+        OUT_FILE = os.path.join( OUT_DIRECTORY, PieceName( FILE_NAME, FILE_EXTENSION, MODE, start, FEATURE_COUNT ) )
+        Pieces.append( Shapefile.WritePointRecords( OUT_FILE, SHAPE_TYPE, records[ selection ], DBF_HEADER, rows[ selection ], CRS ) )
+    return Pieces
+
+# Splits a PointTile into pieces of FEATURE_COUNT points. Every column is carried over
+# @param MODE = One of OID, MORTON or HILBERT. Defaults to the value specified in BathyConfig
+# @param OUT_DIRECTORY = Where the pieces are written. Defaults to the directory of the source
+# @return = The paths of the pieces
+def SplitTile( FILE_PATH, FEATURE_COUNT, MODE=None, OUT_DIRECTORY=None ):
+    if MODE == None:
+        MODE = BathyConfig.SPLIT_MODE
+    ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = OSToolbox.SplitFilePath( FILE_PATH )
+    if OUT_DIRECTORY == None:
+        OUT_DIRECTORY = FILE_DIRECTORY
+    tile = PointTile.ReadTile( FILE_PATH )
+    order = SplitOrder( tile[ "x" ], tile[ "y" ], MODE )
+    Pieces = list()
+    for ( start, selection ) in IterPieces( tile.Count, FEATURE_COUNT, order ):
+        OUT_FILE = os.path.join( OUT_DIRECTORY, PieceName( FILE_NAME, FILE_EXTENSION, MODE, start, FEATURE_COUNT ) )
+        PointTile.WriteTile( OUT_FILE, [ ( name, tile[ name ][ selection ] ) for name in tile.ColumnNames ], tile.CRS )
+        Pieces.append( OUT_FILE )
+    return Pieces
+
+# Splits a shapefile or PointTile into pieces of FEATURE_COUNT points
+# @return = The paths of the pieces, or None if the file can't be split natively
+def SplitFile( FILE_PATH, FEATURE_COUNT, MODE=None, OUT_DIRECTORY=None ):
+    extension = os.path.splitext( FILE_PATH )[1].lower()
+    if extension == ".shp":
+        return SplitShapefile( FILE_PATH, FEATURE_COUNT, MODE, OUT_DIRECTORY )
+    if extension == PointTile.EXTENSION:
+        return SplitTile( FILE_PATH, FEATURE_COUNT, MODE, OUT_DIRECTORY )
+    return None
@@ -1,126 +1,122 @@
 import BathyConfig
+import Progress
+import RunConfig
+import concurrent.futures
 import threading
 import time
-import traceback
-import re
 
-class TooManyThreadsException( Exception ):
-    pass
+# Runs a function with the given arguments, and times it. Lives at module level so that it can be sent to pool processes
+# @return = A tuple of ( result, runTime )
+def TimedCall( function, arguments ):
+    startTime = time.time()
+    result = function( *arguments )
+    return ( result, time.time() - startTime )
 
-# A class for creating, executing, synchronizing, and managing FunctionThreads.
-# @param max = The max number of threads allowed to run simultaneously. Attempts to create additional threads when this limit has been reached will result in the raising of a TooManyThreadsException. The default value is 4
-# @param output = The display module which this ThreadingManager will use to display the messages generated by it's threads
+# A class for executing, synchronizing, and managing parallel tasks. Tasks run on a pool of worker processes (or threads, if BathyConfig says so).
+# Submitting a task blocks until fewer than the max number of tasks are in flight, so the caller never has to poll and retry.
+# Every submission returns a future. Tasks which fail are collected, along with their exceptions, and handed back to the caller by Wait()
+# @param max = The max number of tasks allowed to run simultaneously. The default value is 4
+# @param output = The display module which this ThreadingManager will use to display the messages generated by it's tasks
+# @param processes = If True, tasks run in worker processes, which sidesteps the GIL. Defaults to the value specified in BathyConfig
 class ThreadingManager( object ):
-    def __init__( self, max=4, output=None ):
-        self.MaxAllowableThreads = max # The max number of threads allowed to be running simultaneously
-        self.ThreadIDCounter = 0 # A variable used to ensure that no thread has the same ID as another
-        self.ActiveThreads = list() # Initialize the list we'll use to store all currently active threads. Contains IDs, not the threads themselves
-        self.ThreadCount = 0 # The number of active threads. Equal to len( ActiveThreads )
-        self.AverageRunTime = -1 # The average runtime of the thread. -1 indicates that no threads have yet completed.
-        self.TotalRunTime = 0 # The sum of all runtimes of all threads that have completed so far. Used to calculate average runtime
+    def __init__( self, max=4, output=None, processes=None ):
+        self.MaxAllowableThreads = max # The max number of tasks allowed to be running simultaneously
+        if processes == None:
+            processes = BathyConfig.USE_PROCESSES
+        self.UseProcesses = processes
+        self.Executor = None # The pool is created when the first task is submitted
+        self.Slots = threading.BoundedSemaphore( max ) # One slot per task in flight. Submitting blocks while every slot is taken
+        self.ActiveFutures = dict() # Maps the future of each submitted task to its ( function, arguments ), until the caller has waited on it
+        self.AverageRunTime = -1 # The average runtime of the tasks. -1 indicates that no tasks have yet completed.
+        self.TotalRunTime = 0 # The sum of all runtimes of all tasks that have completed so far. Used to calculate average runtime
         self.NumCompletedThreads = 0 # Used to calculate the average runtime
         self.DisplayOutput = output # The module used to write messages to the display
-        # Resource locks. Used to protect against memory and run-time errors. 
-        self.CheckInLock = threading.RLock() # Only one thread may check in at a time
-        self.CheckOutLock = threading.RLock() # Only one thread may check out at a time
+        # Resource locks. Used to protect against memory and run-time errors.
+        self.FutureLock = threading.RLock() # Only one thread may add or remove futures at a time
+        self.RunTimeLock = threading.RLock() # Only one task may update the runtime accounting at a time
         self.DisplayLock = threading.RLock() # Only one thread may print to the display at a time
-        self.ExceptionLock = threading.RLock() # Only one thread may lose it's shit at a time
 
-    def checkIn( self, FunctionThreadID ):
-        self.ActiveThreads.append( FunctionThreadID )
-        self.ThreadCount = len( self.ActiveThreads )
+    # Returns the pool tasks are executed on, creating it if need be
+    def GetExecutor( self ):
+        if self.Executor == None:
+            if self.UseProcesses == True:
+                # Worker processes take on this process's settings, and send the points they get through back to the progress reporter, if one is running
+                self.Executor = concurrent.futures.ProcessPoolExecutor( max_workers=self.MaxAllowableThreads, initializer=RunConfig.InitializeWorker,
+                                                                        initargs=( RunConfig.Current(), Progress.GetWorkerQueue() ) )
+            else:
+                self.Executor = concurrent.futures.ThreadPoolExecutor( max_workers=self.MaxAllowableThreads )
+        return self.Executor
 
-    # @param FunctionThread = The thread checking out
-    # @param runTime = The runtime of the thread. Defaults to -1, which indicates that the thread did not complete successfully. An overriden value indicates successful completion, and represents the runtime of the thread.
-    def checkOut( self, FunctionThreadID, runTime=-1 ):
-        self.ActiveThreads.remove( FunctionThreadID )
-        self.ThreadCount = len( self.ActiveThreads )
-        if runTime > -1: # A value > -1 indicates a successful execution. Thus, we can update the average runtime value
+    # Submits a task to be executed. Enforces the maximum number of tasks allowed to be running simultaneously by blocking until a slot is free
+    # @param function = The function the task will execute. Must be picklable (i.e. defined at module level) when running on processes
+    # @param args = The arguments that the passed function will require
+    # @return = The future of the task. Its result is a tuple of ( result, runTime ), where result is the function's return value
+    def Submit( self, function, args ):
+        self.Slots.acquire()
+        try:
+            future = self.GetExecutor().submit( TimedCall, function, args )
+        except Exception:
+            self.Slots.release()
+            raise
+        with self.FutureLock:
+            self.ActiveFutures[ future ] = ( function, args )
+        future.add_done_callback( self.checkOut )
+        return future
+
+    # Called as each task finishes. Frees its slot, and if the task completed successfully, updates the runtime accounting
+    def checkOut( self, future ):
+        self.Slots.release()
+        if future.cancelled() == False and future.exception() == None:
+            ( result, runTime ) = future.result()
             self.updateAverageRunTime( runTime )
 
     # Updates the AverageRunTime value for this ThreadingManager.
-    # @param runTime = The runTime of the most recently completed thread.
-    # NOTE: Should implement resource protection on the variables used
+    # @param runTime = The runTime of the most recently completed task.
     def updateAverageRunTime( self, runTime ):
-        self.TotalRunTime += runTime
-        self.NumCompletedThreads += 1
-        self.AverageRunTime = self.TotalRunTime / self.NumCompletedThreads
+        with self.RunTimeLock:
+            self.TotalRunTime += runTime
+            self.NumCompletedThreads += 1
+            self.AverageRunTime = self.TotalRunTime / self.NumCompletedThreads
 
-    # Used to create a new thread managed by this instance of ThreadingManager. Enforces the maximum number of threads allowed to be running simultaneously
-    # @param function = The function the new thread will execute
-    # @param args = The arguments that the passed function will require
-    # @throws = This function raises a TooManyThreadsException if the max thread limit has already been reached.
-    def CreateNewFunctionThread( self, function, args ):
-        if self.ThreadCount >= self.MaxAllowableThreads:
-			e = TooManyThreadsException()
-			BathyConfig.ConditionalPrint( "Too many threads active" )
-			raise e
-        else:
-            newThread = FunctionThread( self, self.ThreadIDCounter, function, args )
-            newThread.start()
-            self.ThreadIDCounter += 1
+    # Blocks until every task submitted so far has finished
+    # @return = A list of ( function, args, exception ) for every task which failed
+    def Wait( self ):
+        with self.FutureLock:
+            futures = self.ActiveFutures
+            self.ActiveFutures = dict()
+        concurrent.futures.wait( list( futures ) )
+        Failures = list()
+        for ( future, ( function, args ) ) in futures.items():
+            exception = future.exception()
+            if exception != None:
+                Failures.append( ( function, args, exception ) )
+        return Failures
+
+    # Waits for every task to finish, then shuts down the pool. A new pool is created if more tasks are submitted afterwards
+    def Shutdown( self ):
+        Failures = self.Wait()
+        if self.Executor != None:
+            self.Executor.shutdown()
+            self.Executor = None
+        return Failures
 
     def report( self ):
-        print( "Registered thread IDs: %s" % ( self.ActiveThreads ) )
+        with self.FutureLock:
+            print( "Tasks in flight: %s" % ( len( [ f for f in self.ActiveFutures if f.done() == False ] ) ) )
 
     def writeToOutput( self, message ):
         if self.DisplayOutput == None: # If this ThreadingManager has no output module for display, then it is not meant to output messages to any display
             pass
         else:
-            self.DisplayOutput.Display( message ) # Otherwise, tell the Display module to display this message
-
-    def handleException( self, e ):
-		BathyConfig.ConditionalPrint( "An exception has been raised." ) # TODO: Intelligent exception handling
-		raise e
+            with self.DisplayLock:
+                self.DisplayOutput.Display( message ) # Otherwise, tell the Display module to display this message
 
     def isIdle( self ):
-        if self.ThreadCount <= 0:
-            return True
-        else:
-            return False
+        return self.isBusy() == False
 
     def isBusy( self ):
-        if self.ThreadCount > 0:
-            return True
-        else:
-            return False
-
-# A threadable object which accepts an arbitrary function and an array of arguments for said function.
-# Upon starting, the thread executes the specified functions with the specified parameters.
-# FunctionThread tracks it's own runtime, and reports it to it's ThreadingManager
-# @param ThreadManager = The ThreadingManager
-class FunctionThread( threading.Thread ):
-    # @param ThreadManager = This thread's ThreadManager
-    def __init__( self, ThreadingManager, ID, function, arguments ):
-        threading.Thread.__init__( self, name=str( ID ) )
-        self.ThreadingManager = ThreadingManager
-        self.ID = ID
-        self.function = function
-        self.arguments = arguments
-        self.ThreadingManager.CheckInLock.acquire()
-        self.ThreadingManager.checkIn( self.ID ) # Check in with the thread manager
-        self.ThreadingManager.CheckInLock.release()
-
-    # Executes the function it was given upon initialization. Upon completing the function, the thread checks itself out with the threadmanager, and reports it's runtime
-    def run( self ):
-        self.startTime = time.time()
-        try:
-            self.function( *self.arguments )
-        except Exception as e:
-			raise e
-			"""
-            self.ThreadingManager.ExceptionLock.acquire()
-            self.ThreadingManager.handleException( e )
-            self.ThreadingManager.ExceptionLock.release()
-			"""
-        self.endTime = time.time()
-        runTime = self.endTime - self.startTime
-        self.ThreadingManager.CheckOutLock.acquire()
-        self.ThreadingManager.checkOut( self.ID, runTime ) # Upon complete execution of it's assigned function, this thread checks itself out of the ThreadingManager, and then terminates
-        self.ThreadingManager.CheckOutLock.release()
-
-    # Method for writing outputs to the display
-    def writeToOutput( self, message ):
-        self.ThreadingManager.DisplayLock.acquire()
-        self.ThreadingManager.writeToOutput( message )
-        self.ThreadingManager.DisplayLock.release()
+        with self.FutureLock:
+            for future in self.ActiveFutures:
+                if future.done() == False:
+                    return True
+        return False
@@ -0,0 +1,190 @@
+# XYZParser
+# Vectorized parsing of XYZ text files into NumPy arrays. This is the shared front end for every numeric processing stage.
+# Whole blocks of lines are decoded at once into contiguous x, y and z arrays, instead of splitting and converting each line in Python.
+
+import io
+import re
+import warnings
+import numpy as np
+import BathyConfig
+import Checkpoint
+
+# Matches any run of the delimiters found in XYZ files (tabs, spaces and commas)
+DELIMITERS = re.compile( br"[\t ,]+" )
+
+# Lookup table used to classify every byte of a block at once. True for bytes which separate values
+SEPARATOR_BYTES = np.zeros( 256, dtype=bool )
+for byte in b"\t\n\r ,":
+    SEPARATOR_BYTES[ byte ] = True
+
+# Generator that streams a file in fixed-size byte chunks, yielding blocks made up only of complete lines.
+# A partial line at the end of a chunk is carried over and completed by the next chunk, so no line is ever split in two.
+# Only a single chunk is held in memory at a time, no matter how large the file is.
+# @param FILE_PATH = The path of the file to be streamed
+# @param CHUNK_SIZE = The number of bytes read at a time. Defaults to the value specified in BathyConfig
+# @param SKIP_HEADER = If True, the first line of the file is discarded
+def IterBlocks( FILE_PATH, CHUNK_SIZE=None, SKIP_HEADER=True ):
+    for ( block, end ) in IterBlocksFrom( FILE_PATH, None, CHUNK_SIZE, SKIP_HEADER ):
+        yield block
+
+# Like IterBlocks, but starts from a given byte offset, and tells where each block ends. Lets a stream be picked up again where it left off
+# @param OFFSET = The offset to start from, which must be the start of a line (i.e. the end of a block yielded before). If None, the stream
+#                 starts from the beginning of the file (after the header, if SKIP_HEADER is True)
+# @return = Yields a tuple of ( block, end ) for every block, where end is the offset of the byte just after the block
+def IterBlocksFrom( FILE_PATH, OFFSET=None, CHUNK_SIZE=None, SKIP_HEADER=True ):
+    if CHUNK_SIZE == None:
+        CHUNK_SIZE = BathyConfig.READ_CHUNK_SIZE
+    remainder = b""
+    with io.open( FILE_PATH, "rb" ) as f:
+        if OFFSET != None:
+            f.seek( OFFSET )
+        elif SKIP_HEADER == True:
+            f.readline()
+        position = f.tell() # The offset of the first byte not yet yielded
+        while True:
+            chunk = f.read( CHUNK_SIZE )
+            if not chunk:
+                break
+            block = remainder + chunk
+            end = block.rfind( b"\n" ) + 1
+            remainder = block[end:] # Either empty, or a line which continues in the next chunk
+            if end > 0:
+                position += end
+                yield ( block[:end], position )
+    if remainder:
+        yield ( remainder, position + len( remainder ) )
+
+# Parses a block of complete lines one line at a time. This is the fallback for blocks which contain malformed rows.
+# The first two values of a line are taken as x and y, and the last value as z. Blank lines are ignored. Lines with a value which isn't a finite
+# number in DTYPE (nan, inf, or too large, like 1e400) are bad lines too, as they would poison the statistics of every later stage
+# @return = A tuple of ( values, badLines ), where values is an (n, 3) array and badLines is a list of the lines which could not be parsed
+def ParseBlockByLine( BLOCK, DTYPE=np.float64 ):
+    rows = list()
+    lines = list() # The line of every row
+    badLines = list()
+    for line in BLOCK.split( b"\n" ):
+        line = line.strip( b"\t ,\r" )
+        if len( line ) == 0:
+            continue
+        fields = DELIMITERS.split( line )
+        try:
+            if len( fields ) < 3:
+                raise ValueError( "Missing data" )
+            rows.append( ( float( fields[0] ), float( fields[1] ), float( fields[-1] ) ) )
+            lines.append( line )
+        except ValueError:
+            badLines.append( line.decode( "latin-1" ) )
+    with np.errstate( over="ignore" ):
+        values = np.array( rows, dtype=DTYPE ).reshape( -1, 3 )
+    finite = np.isfinite( values ).all( axis=1 )
+    if finite.all() == False:
+        badLines.extend( [ lines[i].decode( "latin-1" ) for i in np.flatnonzero( ~finite ) ] )
+        values = values[ finite ]
+    return ( values, badLines )
+
+# Parses a block of complete lines into an (n, 3) array in a single bulk conversion.
+# Every byte of the block is classified at once to count the values on each line. If every non-blank line holds the same number of values
+# (at least three) and all of them convert to finite numbers, the block is decoded in one call. Otherwise the block falls back to ParseBlockByLine.
+# @return = A tuple of ( values, badLines ), where values is an (n, 3) array and badLines is a list of the lines which could not be parsed
+def ParseBlock( BLOCK, DTYPE=np.float64 ):
+    if len( BLOCK ) == 0:
+        return ( np.empty( ( 0, 3 ), dtype=DTYPE ), list() )
+
+    buf = np.frombuffer( BLOCK, dtype=np.uint8 )
+    isSeparator = SEPARATOR_BYTES[ buf ]
+    isTokenStart = ~isSeparator # A value starts wherever a non-separator byte follows a separator
+    isTokenStart[1:] &= isSeparator[:-1]
+    tokenStarts = np.flatnonzero( isTokenStart )
+    if len( tokenStarts ) == 0: # Nothing but blank lines
+        return ( np.empty( ( 0, 3 ), dtype=DTYPE ), list() )
+    lineOfToken = np.searchsorted( np.flatnonzero( buf == 10 ), tokenStarts ) # The line each value sits on, found from the positions of the newlines
+    valuesPerLine = np.bincount( lineOfToken )
+    valuesPerLine = valuesPerLine[ valuesPerLine > 0 ]
+    columns = valuesPerLine[0]
+
+    if columns < 3 or np.any( valuesPerLine != columns ):
+        return ParseBlockByLine( BLOCK, DTYPE )
+
+    # Depending on the NumPy version, np.fromstring either raises or warns and stops early when it meets a value it can't convert.
+    # We catch the former, and detect the latter by the number of values returned
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter( "ignore" )
+            values = np.fromstring( BLOCK.replace( b",", b" " ), dtype=np.float64, sep=" " )
+    except ValueError:
+        return ParseBlockByLine( BLOCK, DTYPE )
+    if values.size != len( tokenStarts ):
+        return ParseBlockByLine( BLOCK, DTYPE )
+
+    values = values.reshape( -1, columns )
+    if columns > 3:
+        values = values[ :, [ 0, 1, -1 ] ]
+    with np.errstate( over="ignore" ):
+        values = values.astype( DTYPE, copy=False )
+    if np.isfinite( values ).all() == False: # Left to ParseBlockByLine, which reports the lines
+        return ParseBlockByLine( BLOCK, DTYPE )
+    return ( values, list() )
+
+# Splits an (n, 3) array into contiguous x, y and z arrays
+def SplitColumns( values ):
+    return ( np.ascontiguousarray( values[ :, 0 ] ), np.ascontiguousarray( values[ :, 1 ] ), np.ascontiguousarray( values[ :, 2 ] ) )
+
+# Generator that parses an XYZ file block by block.
+# @param FILE_PATH = The path of the file to be parsed
+# @param CHUNK_SIZE = The number of bytes read at a time. Defaults to the value specified in BathyConfig
+# @param DTYPE = The dtype of the returned arrays
+# @param SKIP_HEADER = If True, the first line of the file is discarded
+# @return = Yields a tuple of ( x, y, z, badLines ) for every block
+def IterXYZBlocks( FILE_PATH, CHUNK_SIZE=None, DTYPE=np.float64, SKIP_HEADER=True ):
+    for ( end, x, y, z, badLines ) in IterXYZBlocksFrom( FILE_PATH, None, CHUNK_SIZE, DTYPE, SKIP_HEADER ):
+        yield ( x, y, z, badLines )
+
+# Like IterXYZBlocks, but starts from a given byte offset, and tells where each block ends (see IterBlocksFrom)
+# @return = Yields a tuple of ( end, x, y, z, badLines ) for every block
+def IterXYZBlocksFrom( FILE_PATH, OFFSET=None, CHUNK_SIZE=None, DTYPE=np.float64, SKIP_HEADER=True ):
+    for ( block, end ) in IterBlocksFrom( FILE_PATH, OFFSET, CHUNK_SIZE, SKIP_HEADER ):
+        ( values, badLines ) = ParseBlock( block, DTYPE )
+        ( x, y, z ) = SplitColumns( values )
+        yield ( end, x, y, z, badLines )
+
+# Reads an entire XYZ file into memory. Offending lines are reported, and skipped
+# @param FILE_PATH = The path of the file to be read
+# @param DTYPE = The dtype of the returned arrays
+# @param SKIP_HEADER = If True, the first line of the file is discarded
+# @return = A tuple of ( x, y, z, errorCount )
+def ReadXYZFile( FILE_PATH, DTYPE=np.float64, SKIP_HEADER=True ):
+    blocks = list()
+    errorCount = 0
+    for ( x, y, z, badLines ) in IterXYZBlocks( FILE_PATH, DTYPE=DTYPE, SKIP_HEADER=SKIP_HEADER ):
+        blocks.append( ( x, y, z ) )
+        errorCount += len( badLines )
+    if errorCount > 0:
+        BathyConfig.ConditionalPrint( "Skipped %s offending lines in %s.", ( errorCount, FILE_PATH ) )
+    if len( blocks ) == 0:
+        empty = np.empty( 0, dtype=DTYPE )
+        return ( empty, empty.copy(), empty.copy(), errorCount )
+    return ( np.concatenate( [ b[0] for b in blocks ] ), np.concatenate( [ b[1] for b in blocks ] ), np.concatenate( [ b[2] for b in blocks ] ), errorCount )
+
+# Formats x, y and z arrays as comma delimited lines, ready to be written to an XYZ file
+# @return = The formatted lines, as bytes
+def FormatXYZBlock( x, y, z ):
+    n = len( z )
+    if n == 0:
+        return b""
+    values = np.empty( ( n, 3 ), dtype=np.float64 )
+    values[ :, 0 ] = x
+    values[ :, 1 ] = y
+    values[ :, 2 ] = z
+    return ( ( "%r,%r,%r\n" * n ) % tuple( values.ravel().tolist() ) ).encode( "ascii" )
+
+# Writes x, y and z arrays to an XYZ file with an 'x,y,z' header, one block of rows at a time
+# @param FILE_PATH = The path of the file to be written
+# @param BLOCK_SIZE = The number of rows formatted at a time
+def WriteXYZFile( FILE_PATH, x, y, z, BLOCK_SIZE=100000 ):
+    PARTIAL_PATH = Checkpoint.PartialPath( FILE_PATH ) # Written under a temporary name, and renamed once complete
+    with io.open( PARTIAL_PATH, "wb", buffering=BathyConfig.WRITE_BUFFER_SIZE ) as f:
+        f.write( b"x,y,z\n" )
+        for start in range( 0, len( z ), BLOCK_SIZE ):
+            end = start + BLOCK_SIZE
+            f.write( FormatXYZBlock( x[start:end], y[start:end], z[start:end] ) )
+    return Checkpoint.Commit( PARTIAL_PATH, FILE_PATH )
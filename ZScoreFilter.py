@@ -0,0 +1,162 @@
+# ZScoreFilter
+# Z-score calculation and filtering over point arrays. Does the work of BathyToolbox.CalculateAndAddZScores and
+# BathyToolbox.RemoveExtremeZScores in a vectorized pass, without intermediate tables, and without an ArcGIS license.
+# Files too large to hold in memory are filtered in two streaming passes, using statistics accumulated chunk by chunk.
+# Files may be XYZ text or PointTiles. Tiles are memory-mapped, and filtered into tiles
+
+import os
+import numpy as np
+import BathyConfig
+import OSToolbox
+import PointIO
+import Precision
+import Progress
+
+# Calculates the mean and standard deviation of an array of values. Always accumulates in float64, whatever the dtype of the values
+# @return = A tuple of ( MEAN, STD_DEV )
+def CalculateStatistics( values ):
+    if len( values ) == 0:
+        return ( 0.0, 0.0 )
+    MEAN = float( np.mean( values, dtype=np.float64 ) )
+    STD_DEV = float( np.std( values, dtype=np.float64 ) )
+    return ( MEAN, STD_DEV )
+
+# Accumulates the count, mean and sum of squared deviations from the mean (M2) of a stream of values, chunk by chunk, using Welford's method.
+# Each chunk is summarized in a vectorized pass, then merged into the running totals. Accumulators built over separate chunks, files, or
+# processes can be merged in the same way, so statistics can be computed over a whole survey in constant memory.
+class RunningStatistics( object ):
+    def __init__( self, Count=0, Mean=0.0, M2=0.0 ):
+        self.Count = Count
+        self.Mean = Mean
+        self.M2 = M2
+
+    # Adds a chunk of values to the running statistics
+    def Update( self, values ):
+        n = len( values )
+        if n == 0:
+            return self
+        chunkMean = float( np.mean( values, dtype=np.float64 ) )
+        chunkM2 = float( np.sum( np.square( np.asarray( values, dtype=np.float64 ) - chunkMean ) ) )
+        return self.Merge( RunningStatistics( n, chunkMean, chunkM2 ) )
+
+    # Merges another accumulator into this one. The result is the same as if every value had been added to this accumulator
+    def Merge( self, other ):
+        if other.Count == 0:
+            return self
+        total = self.Count + other.Count
+        delta = other.Mean - self.Mean
+        self.Mean += delta * other.Count / total
+        self.M2 += other.M2 + delta * delta * self.Count * other.Count / total
+        self.Count = total
+        return self
+
+    def Variance( self ):
+        if self.Count == 0:
+            return 0.0
+        return self.M2 / self.Count
+
+    def StandardDeviation( self ):
+        return self.Variance() ** 0.5
+
+    def __repr__( self ):
+        return "RunningStatistics( Count=%s, Mean=%s, M2=%s )" % ( self.Count, self.Mean, self.M2 )
+
+# Calculates the z-score of every value: ( Z - MEAN ) / STD_DEV
+# If MEAN and STD_DEV aren't given, they are calculated from the values themselves. If every value is the same, every z-score is 0
+def CalculateZScores( z, MEAN=None, STD_DEV=None ):
+    if MEAN == None or STD_DEV == None:
+        ( MEAN, STD_DEV ) = CalculateStatistics( z )
+    if STD_DEV == 0:
+        return np.zeros( len( z ), dtype=np.float64 )
+    return ( np.asarray( z, dtype=np.float64 ) - MEAN ) / STD_DEV
+
+# Returns a boolean mask which is True for every value whose z-score is within the maximum allowed
+# @param MAX_MIN = The maximum absolute value a z-score is allowed to have. Defaults to the value specified in BathyConfig
+def ZScoreMask( z, MAX_MIN=None, MEAN=None, STD_DEV=None ):
+    if MAX_MIN == None:
+        MAX_MIN = BathyConfig.Z_SCORE_MAX_MIN
+    if MEAN == None or STD_DEV == None:
+        ( MEAN, STD_DEV ) = CalculateStatistics( z )
+    # Equivalent to ABS( ( Z - MEAN ) / STD_DEV ) <= MAX_MIN, without dividing every value
+    return np.abs( z - MEAN ) <= float( MAX_MIN ) * STD_DEV
+
+# Removes all points whose z-scores are outside the maximum allowed
+# @param MAX_MIN = The maximum absolute value a z-score is allowed to have. Defaults to the value specified in BathyConfig
+# @return = A tuple of the filtered ( x, y, z ) arrays
+def RemoveExtremeZScores( x, y, z, MAX_MIN=None ):
+    keep = ZScoreMask( z, MAX_MIN )
+    return ( x[keep], y[keep], z[keep] )
+
+# Pass one of the streaming filter. Accumulates the statistics of z over an XYZ file (with header) or PointTile, one chunk at a time
+# @param Stats = An optional accumulator to add the file's statistics to. If not given, a new one is created
+# @return = The accumulator
+def AccumulateZStatistics( FILE_PATH, Stats=None ):
+    if Stats == None:
+        Stats = RunningStatistics()
+    for ( x, y, z, badLines ) in PointIO.IterPointBlocks( FILE_PATH ):
+        Stats.Update( z )
+    return Stats
+
+# Accumulates the statistics of z over a whole survey, so that every file can be filtered against the same mean and standard deviation
+# @param FILE_PATHS = The XYZ files (with headers) which make up the survey
+# @return = The accumulator
+def AccumulateSurveyZStatistics( FILE_PATHS ):
+    Stats = RunningStatistics()
+    for FILE_PATH in FILE_PATHS:
+        Stats.Merge( AccumulateZStatistics( FILE_PATH ) )
+    return Stats
+
+# Removes all points whose z-scores are outside the maximum allowed from an XYZ file (with header), in two streaming passes.
+# Memory use stays constant no matter how big the file is.
+# @param FILE_PATH = The path of the file to be processed
+# @param OUT_DIRECTORY = The directory to save the newly processed file
+# @param Stats = Optional statistics to filter against, such as those of the whole survey. If not given, pass one calculates them from the file
+# @param MAX_MIN = The maximum absolute value a z-score is allowed to have. Defaults to the value specified in BathyConfig
+# @return = The path of the new file
+def StreamRemoveExtremeZScoresFromXYZFile( FILE_PATH, OUT_DIRECTORY, Stats=None, MAX_MIN=None ):
+    ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = OSToolbox.SplitFilePath( FILE_PATH )
+    OUT_FILE = os.path.join( OUT_DIRECTORY, FILE_NAME + "_ZS" + FILE_EXTENSION )
+
+    with PointIO.CheckpointedStream( FILE_PATH, OUT_FILE, PointIO.ReadCRS( FILE_PATH ) ) as f:
+        # The statistics are saved with every checkpoint, so that a resumed filter keeps filtering against the same ones without pass one
+        if f.Resumed == True:
+            Stats = RunningStatistics( *f.Extra[ "stats" ] )
+        elif Stats == None:
+            Stats = AccumulateZStatistics( FILE_PATH )
+        f.Extra[ "stats" ] = ( Stats.Count, Stats.Mean, Stats.M2 )
+        MEAN = Stats.Mean
+        STD_DEV = Stats.StandardDeviation()
+
+        kept = f.Extra.get( "kept", 0 )
+        for ( x, y, z, badLines ) in f.Blocks():
+            keep = ZScoreMask( z, MAX_MIN, MEAN=MEAN, STD_DEV=STD_DEV )
+            kept += int( np.count_nonzero( keep ) )
+            f.Extra[ "kept" ] = kept
+            f.Append( [ x[keep], y[keep], z[keep] ] )
+            Progress.Advance( len( z ) )
+    BathyConfig.ConditionalPrint( "Kept %s points of %s.", ( kept, FILE_NAME ) )
+    return OUT_FILE
+
+# Removes all points whose z-scores are outside the maximum allowed from an XYZ file (with header), and saves the result to the specified directory.
+# Files larger than BathyConfig.MAX_IN_MEMORY_FILE_SIZE, and any file filtered against survey-wide statistics, go through the streaming filter instead
+# @param FILE_PATH = The path of the file to be processed
+# @param OUT_DIRECTORY = The directory to save the newly processed file
+# @param Stats = Optional statistics to filter against, such as those of the whole survey
+# @param MAX_MIN = The maximum absolute value a z-score is allowed to have. Defaults to the value specified in BathyConfig
+# @return = The path of the new file
+def RemoveExtremeZScoresFromXYZFile( FILE_PATH, OUT_DIRECTORY, Stats=None, MAX_MIN=None ):
+    if Stats != None or os.path.getsize( FILE_PATH ) > BathyConfig.MAX_IN_MEMORY_FILE_SIZE:
+        return StreamRemoveExtremeZScoresFromXYZFile( FILE_PATH, OUT_DIRECTORY, Stats, MAX_MIN )
+
+    ( FILE_DIRECTORY, FILE_NAME, FILE_EXTENSION ) = OSToolbox.SplitFilePath( FILE_PATH )
+    OUT_FILE = os.path.join( OUT_DIRECTORY, FILE_NAME + "_ZS" + FILE_EXTENSION )
+
+    points = PointIO.ReadCompactPoints( FILE_PATH ) # In the precision specified in BathyConfig
+    if points.Precision != Precision.FLOAT64:
+        BathyConfig.ConditionalPrint( "%s: %s", ( FILE_NAME, points.Describe() ) )
+    Progress.Advance( points.Count )
+    ( x, y, z ) = points.XYZ( ZScoreMask( points.Z, MAX_MIN ) )
+    BathyConfig.ConditionalPrint( "Kept %s points of %s.", ( len( z ), FILE_NAME ) )
+
+    PointIO.WritePoints( OUT_FILE, x, y, z, PointIO.ReadCRS( FILE_PATH ) )
+    return OUT_FILE
@@ -0,0 +1,74 @@
+# Interrupts a checkpointed stream into each kind of point writer, recovers the manifest as the script does after an improper shutdown,
+# and checks that the stream carries on from its checkpoint and produces the same output as an uninterrupted run
+
+import os
+import numpy as np
+import pytest
+import BathyConfig
+import Checkpoint
+import Manifest
+import PointIO
+
+# The number of blocks streamed before the interruption
+BLOCKS_BEFORE_INTERRUPT = 3
+
+@pytest.fixture
+def survey( tmp_path, monkeypatch ):
+    monkeypatch.setattr( BathyConfig, "CONDITIONAL_OUTPUT_ALLOWED", False )
+    monkeypatch.setattr( BathyConfig, "READ_CHUNK_SIZE", 4096 ) # Many small blocks
+    monkeypatch.setattr( BathyConfig, "CHECKPOINT_INTERVAL", 0 ) # A checkpoint after every block
+    rng = np.random.default_rng( 0 )
+    n = 5000
+    INPUT = str( tmp_path / "line.csv" )
+    PointIO.WritePoints( INPUT, rng.uniform( 0, 1000, n ), rng.uniform( 0, 1000, n ), -rng.gamma( 5, 20, n ) )
+    return INPUT
+
+# Streams INPUT into OUT_FILE, stopping as an interrupted run would (leaving the checkpoint) after BLOCKS_BEFORE_INTERRUPT blocks
+def StreamUntilInterrupted( INPUT, OUT_FILE ):
+    with pytest.raises( KeyboardInterrupt ):
+        with PointIO.CheckpointedStream( INPUT, OUT_FILE ) as Stream:
+            for ( i, ( x, y, z, badLines ) ) in enumerate( Stream.Blocks() ):
+                if i == BLOCKS_BEFORE_INTERRUPT:
+                    raise KeyboardInterrupt()
+                Stream.Append( [ x, y, z ] )
+
+@pytest.mark.parametrize( "EXTENSION", [ ".bpt", ".csv", ".shp" ] )
+def test_interrupted_stream_resumes_after_recovery( survey, tmp_path, EXTENSION ):
+    EXPECTED = str( tmp_path / ( "expected" + EXTENSION ) )
+    PointIO.ConvertPoints( survey, EXPECTED, "" )
+
+    OUT_DIRECTORY = tmp_path / "out"
+    OUT_DIRECTORY.mkdir()
+    OUT_FILE = str( OUT_DIRECTORY / ( "line_proc" + EXTENSION ) )
+    Records = Manifest.ProcessingManifest( str( tmp_path / "manifest.sqlite" ) )
+    Records.MarkStarted( survey, "Stage", str( OUT_DIRECTORY ) )
+    StreamUntilInterrupted( survey, OUT_FILE )
+    assert os.path.exists( Checkpoint.CheckpointPath( OUT_FILE ) )
+
+    Records.RecoverIncompleteEntries()
+    assert Records.GetInterruptedDirectory( survey, "Stage" ) == str( OUT_DIRECTORY )
+    with PointIO.CheckpointedStream( survey, OUT_FILE ) as Stream:
+        assert Stream.Resumed == True
+        for ( x, y, z, badLines ) in Stream.Blocks():
+            Stream.Append( [ x, y, z ] )
+    Records.Close()
+
+    for ( expected, actual ) in zip( PointIO.ReadPoints( EXPECTED ), PointIO.ReadPoints( OUT_FILE ) ):
+        assert np.array_equal( expected, actual )
+    assert [ name for name in os.listdir( str( OUT_DIRECTORY ) ) if Checkpoint.IsTemporary( name ) ] == list()
+
+# An input whose name starts with the name of an interrupted input keeps its complete output, even if it was written after the interruption began
+def test_recovery_keeps_complete_outputs_of_other_inputs( survey, tmp_path ):
+    OUT_DIRECTORY = tmp_path / "out"
+    OUT_DIRECTORY.mkdir()
+    Records = Manifest.ProcessingManifest( str( tmp_path / "manifest.sqlite" ) )
+    Records.MarkStarted( survey, "Stage", str( OUT_DIRECTORY ) )
+    with open( str( OUT_DIRECTORY / "line_proc.bpt.partial" ), "wb" ) as f: # Left behind without a checkpoint
+        f.write( b"partial" )
+    OTHER = str( OUT_DIRECTORY / "line_b_proc.bpt" )
+    PointIO.ConvertPoints( survey, OTHER, "" )
+
+    Records.RecoverIncompleteEntries()
+    assert sorted( os.listdir( str( OUT_DIRECTORY ) ) ) == [ "line_b_proc.bpt" ]
+    assert Records.GetInterruptedDirectory( survey, "Stage" ) == None
+    Records.Close()
@@ -0,0 +1,17 @@
+# Checks that values which aren't finite numbers are reported as bad lines by both of the parser's paths, rather than read as points
+
+import numpy as np
+import pytest
+import XYZParser
+
+@pytest.mark.parametrize( "BLOCK", [ b"1,2,3\n4,5,nan\n6,7,1e400\n8,9,-inf\n10,11,12\n", # Decoded in one call, apart from the bad lines
+                                     b"1,2,3\n4,5,nan\n6,7,1e400\n8,9,-inf\n10,11\n10,11,12\n" ] ) # Parsed line by line, as one line is short
+def test_non_finite_values_are_bad_lines( BLOCK ):
+    ( values, badLines ) = XYZParser.ParseBlock( BLOCK )
+    assert values.tolist() == [ [ 1.0, 2.0, 3.0 ], [ 10.0, 11.0, 12.0 ] ]
+    assert set( [ "4,5,nan", "6,7,1e400", "8,9,-inf" ] ) <= set( badLines )
+
+def test_values_too_large_for_the_dtype_are_bad_lines():
+    ( values, badLines ) = XYZParser.ParseBlock( b"1,2,3\n4,5,1e39\n", np.float32 )
+    assert values.tolist() == [ [ 1.0, 2.0, 3.0 ] ]
+    assert badLines == [ "4,5,1e39" ]